@@ -5,36 +5,261 @@ from typing import *
 import asyncio
 import traceback
 import logging
+import os
+import threading
+import datetime
 
 # http things
 from aiohttp import web
 import aiohttp
-from util import aiohttp_utils
+from util import aiohttp_utils, fast_json
+from util.delta import DeltaEncoder, parse_epsilons
 
 # websocket data
 from util import websocket_types
+from util.position_predictor import PositionPredictor
+from util.telemetry_history import TelemetryHistory
+from util.telemetry_recorder import TelemetryRecorder, Recording
+from util.downsample import Pyramid, PyramidCache
+from util.control_mailbox import ClockOffset, ControlMailbox
+from util.control_resampler import ControlResampler
+from util.gamepad_mapping import GamepadMapper, load_profiles, parse_assignments
 
 # ros things
 import rclpy
-from rclpy.executors import MultiThreadedExecutor
+from rclpy.executors import Executor, MultiThreadedExecutor
 from submodules import Submodule, Core, Arm, Auto, Bio, Antenna, Anchor, Ptz
 
 LOG = logging.getLogger(__name__)
 
 routes = web.RouteTableDef()
-ws_connections = aiohttp_utils.WSSender()
+ws_connections = aiohttp_utils.WSSender(
+    max_queue=int(os.environ.get("WS_QUEUE_SIZE", 64)),
+    policy=aiohttp_utils.SlowClientPolicy(
+        os.environ.get("WS_SLOW_CLIENT_POLICY", "latest_per_topic")
+    ),
+    snapshot=os.environ.get("WS_SNAPSHOT", "1") == "1",
+    replay_size=int(os.environ.get("WS_REPLAY_SIZE", 1024)),
+    delta=DeltaEncoder(
+        keyframe_interval=int(os.environ.get("WS_DELTA_KEYFRAME", 20)),
+        epsilons=parse_epsilons(os.environ.get("WS_DELTA_EPSILONS", "")),
+        default_epsilon=float(os.environ.get("WS_DELTA_EPSILON", 0)),
+    ),
+)
 submodules: List[Submodule] = list()
 
+# how many characters string columns of history and recordings hold
+str_widths = {
+    pattern: int(width)
+    for pattern, width in parse_epsilons(os.environ.get("STR_WIDTHS", "")).items()
+}
+
+# recent feedback, so clients can backfill after (re)connecting
+history = TelemetryHistory(
+    (
+        websocket_types.CoreFeedbackData,
+        websocket_types.AutoFeedbackData,
+        websocket_types.DigitFeedbackData,
+        websocket_types.BioFeedbackData,
+        websocket_types.SocketFeedbackData,
+        websocket_types.AntennaFeedbackData,
+    ),
+    capacity=int(os.environ.get("HISTORY_SIZE", 36000)),
+    str_widths=str_widths,
+)
+
+# set in main if RECORD_DIR is set
+recorder: Optional[TelemetryRecorder] = None
+
+# downsampling pyramids for /api/query. they're built, extended and read in
+# executor threads, one query at a time
+pyramids = PyramidCache()
+pyramids_lock = threading.Lock()
+
 executor: MultiThreadedExecutor
 
 
 async def spin_loop(executor: MultiThreadedExecutor):
-    """Main ROS loop. Spins ROS asynchronously."""
-    while rclpy.ok():
-        executor.spin_once(timeout_sec=0)
-        await asyncio.sleep(1e-4)
+    """
+    Main ROS loop. The executor spins in its own thread and wakes up only when
+    there is work, so callbacks run as soon as their data arrives. Callbacks
+    hand data back to asyncio through the thread-safe WSSender.post.
+    """
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def finish(error: Optional[BaseException]):
+        if done.done():
+            return
+        if error is None:
+            done.set_result(None)
+        else:
+            done.set_exception(error)
+
+    def spin():
+        error = None
+        try:
+            executor.spin()
+        except BaseException as e:
+            error = e
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(finish, error)
+
+    threading.Thread(target=spin, name="ros-executor", daemon=True).start()
+    try:
+        await done
+    finally:
+        LOG.info(f"ROS loop exited")
+
+
+# messages that configure the client's own connection rather than the rover
+CLIENT_CONTROL_TYPES = (
+    websocket_types.SubscribeData,
+    websocket_types.UnsubscribeData,
+    websocket_types.RateLimitData,
+)
+
+# encodings that depend on the client knowing the schema
+POSITIONAL_ENCODINGS = (aiohttp_utils.Encoding.ARRAY, aiohttp_utils.Encoding.PACKED)
+
+# commands that carry the whole state of a control, so only the newest matters.
+# controller state isn't one of them: its button presses are edges, which
+# coalescing could drop, so it is mapped first and its commands go through
+# the mailbox instead, see map_controller
+MAILBOX_TYPES = (
+    websocket_types.CoreControlData,
+    websocket_types.ArmManualData,
+    websocket_types.ArmIKData,
+)
+
+
+# commands republished at a fixed rate, with the fields that make each of them
+# stop the rover once its client goes quiet
+STOP_COMMANDS = {
+    websocket_types.CoreControlData: {
+        "left_stick": 0.0,
+        "right_stick": 0.0,
+        "brake": True,
+        "turn_to_enable": False,
+    },
+    websocket_types.ArmManualData: {
+        "axis0": 0,
+        "axis1": 0,
+        "axis2": 0,
+        "axis3": 0,
+        "brake": True,
+        "effector_roll": 0,
+        "effector_yaw": 0,
+        "gripper": 0,
+        "linear_actuator": 0,
+    },
+    websocket_types.ArmIKData: {
+        "movement_vector": {"x": 0.0, "y": 0.0, "z": 0.0},
+        "effector_roll": 0,
+        "effector_yaw": 0,
+        "gripper": 0,
+        "linear_actuator": 0,
+    },
+}
+
+
+# message type -> the submodules that handle it, see build_routing
+routing: Dict[Type[websocket_types.WebsocketData], List[Submodule]] = {}
+# msg_type -> how many messages of it no submodule handles
+unrouted: Dict[str, int] = {}
+
+
+def build_routing(
+    submodules: Iterable[Submodule],
+) -> Dict[Type[websocket_types.WebsocketData], List[Submodule]]:
+    """Map every message type to the submodules that declare they handle it."""
+    table: Dict[Type[websocket_types.WebsocketData], List[Submodule]] = {}
+    for submodule in submodules:
+        for ws_type in submodule.handles:
+            table.setdefault(ws_type, []).append(submodule)
+    return table
+
+
+def publish(websocket_data: websocket_types.WebsocketData):
+    """Hand a message to the submodules that handle its type."""
+    handlers = routing.get(type(websocket_data))
+    if not handlers:
+        msg_type = type(websocket_data).msg_type
+        if msg_type not in unrouted:
+            LOG.warning(f"No submodule handles {msg_type}, dropping those messages")
+        unrouted[msg_type] = unrouted.get(msg_type, 0) + 1
+        return
+
+    for submodule in handlers:
+        submodule.handle_ws_msg(websocket_data)
 
-    LOG.info(f"ROS loop exited")
+
+def record(websocket_data: websocket_types.WebsocketData):
+    """
+    Record a message from a client, if recording. It is recorded when we got
+    it, as client clocks don't agree with each other or ours, and under its
+    own msg_type so e.g. which controller sent it survives.
+    """
+    if recorder is not None:
+        recorder.record(
+            type(websocket_data),
+            websocket_data.to_dict(),
+            msg_type=websocket_data.msg_type,
+        )
+
+
+def dispatch(websocket_data: websocket_types.WebsocketData):
+    """Record a message from a client and pass it on to be published."""
+    record(websocket_data)
+    control_resampler.update(websocket_data)
+
+
+def map_controller(websocket_data: websocket_types.ControllerStateData, age: int):
+    """
+    Record a controller's state and map it to commands, which go through the
+    control mailbox. Every frame is mapped, so a button pressed and released
+    within one burst still toggles or steps. No submodule takes the raw state.
+    """
+    record(websocket_data)
+    for command in gamepad_mapper.map(websocket_data):
+        control_mailbox.put(command, age)
+
+
+gamepad_mapper = GamepadMapper(
+    load_profiles(os.environ.get("GAMEPAD_PROFILE_FILE")),
+    parse_assignments(os.environ.get("GAMEPAD_PROFILES", "")),
+)
+control_resampler = ControlResampler(
+    publish,
+    STOP_COMMANDS,
+    rate=float(os.environ.get("CONTROL_RATE", 50)),
+    timeout=float(os.environ.get("CONTROL_TIMEOUT", 0.5)),
+    stop_duration=float(os.environ.get("CONTROL_STOP_DURATION", 1.0)),
+)
+control_mailbox = ControlMailbox(
+    dispatch, max_age=int(os.environ.get("CONTROL_MAX_AGE", 500))
+)
+
+
+def handle_client_control(
+    ws: web.WebSocketResponse, websocket_data: websocket_types.WebsocketData
+):
+    """Apply a client's subscription or rate limit request."""
+    if isinstance(websocket_data, websocket_types.RateLimitData):
+        ws_connections.set_rate(
+            ws, websocket_data.data["topic"], websocket_data.data["rate"]
+        )
+        return
+
+    topics = websocket_data.data["topics"]
+    if not all(isinstance(topic, str) for topic in topics):
+        LOG.error(f"Subscription request with non-string topics: {topics}")
+        return
+
+    if isinstance(websocket_data, websocket_types.SubscribeData):
+        ws_connections.subscribe(ws, topics)
+    else:
+        ws_connections.unsubscribe(ws, topics)
 
 
 @routes.get("/api/ws")
@@ -42,70 +267,325 @@ async def handle_controller(request: web.BaseRequest) -> web.WebSocketResponse:
     # get the websocket ready to use
     ws = web.WebSocketResponse(heartbeat=3)
     await ws.prepare(request)
-    ws_connections.add(ws)
+
+    # reconnecting clients pass the last session and sequence number they saw
+    resume = None
+    if "session" in request.query and "seq" in request.query:
+        try:
+            resume = (request.query["session"], int(request.query["seq"]))
+        except ValueError:
+            LOG.error(f"{request.remote} sent invalid resume sequence")
+    # clients opt in to other feedback encodings with ?encoding=..., and to
+    # the positional ones with the hash of the schema they were written for
+    try:
+        encoding = aiohttp_utils.Encoding(request.query.get("encoding", "json"))
+    except ValueError:
+        LOG.error(f"{request.remote} asked for an unknown encoding")
+        encoding = aiohttp_utils.Encoding.JSON
+    if encoding in POSITIONAL_ENCODINGS and (
+        request.query.get("schema") != websocket_types.registry.schema()["hash"]
+    ):
+        LOG.warning(f"{request.remote} has an outdated schema, sending it JSON")
+        encoding = aiohttp_utils.Encoding.JSON
+    ws_connections.add(ws, request.remote, resume, encoding)
+    # how late this client's messages arrive, for the control mailbox. a
+    # clock step is only worth catching if it would get commands dropped
+    clock = ClockOffset(step=(control_mailbox.max_age or 500) / 1000)
     LOG.info(f"websocket connected at ip {request.remote}")
 
-    # when we get a message
-    async for msg in ws:
-        LOG.debug(f"websocket message from {request.remote}: {msg.data}")
+    # a client that errors out must not leave its queue and sender behind
+    try:
+        # when we get a message
+        async for msg in ws:
+            LOG.debug(f"websocket message from {request.remote}: {msg.data}")
 
-        if msg.type == aiohttp.WSMsgType.CLOSE or msg.data == "close":
-            LOG.info(f"websocket connection at ip {request.remote} requested close")
-            await ws.close()
-            break
+            if msg.type == aiohttp.WSMsgType.CLOSE or msg.data == "close":
+                LOG.info(f"websocket connection at ip {request.remote} requested close")
+                await ws.close()
+                break
 
-        # exit out if the connection errored out
-        if msg.type == aiohttp.WSMsgType.ERROR:
-            LOG.fatal(
-                f"websocket connection at ip {request.remote} closed with exception {msg.data}"
-            )
-            break
+            # exit out if the connection errored out
+            if msg.type == aiohttp.WSMsgType.ERROR:
+                LOG.fatal(
+                    f"websocket connection at ip {request.remote} closed with exception {msg.data}"
+                )
+                break
 
-        # we only accept text messages, so we can just ignore them
-        if not (msg.type == aiohttp.WSMsgType.TEXT):
-            LOG.error(f"{request.remote} sent message with invalid type {msg.type}")
-            continue
+            # we only accept text and packed binary messages, so we can just ignore
+            # anything else
+            if msg.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                LOG.error(f"{request.remote} sent message with invalid type {msg.type}")
+                continue
 
-        # if we got no data, we can ignore the message
-        if msg.data is None:
-            LOG.error(f"{request.remote} sent empty message")
-            continue
+            # if we got no data, we can ignore the message
+            if msg.data is None:
+                LOG.error(f"{request.remote} sent empty message")
+                continue
 
-        # process json into a websocket data object
-        websocket_data: Optional[websocket_types.WebsocketData] = None
-        try:
-            json_data = msg.json()
-            LOG.debug(f"websocket message from {request.remote} with data: {json_data}")
-            data: dict = json_data["data"]
-            msg_type: str = json_data["type"]
-            msg_timestamp: int = json_data["timestamp"]
-
-            # find the correct type to parse the data
-            for t in websocket_types.types:
-                if t.check_type(msg_type):
-                    websocket_data = t.from_dict(
-                        data, msg_type=msg_type, msg_timestamp=msg_timestamp
+            # process json into a websocket data object
+            websocket_data: Optional[websocket_types.WebsocketData] = None
+            try:
+                if msg.type == aiohttp.WSMsgType.BINARY:
+                    # packed frame, see TypeRegistry.encode_packed
+                    websocket_data = websocket_types.registry.decode_packed(msg.data)
+                elif msg.data.startswith("["):
+                    # positional frame, see TypeRegistry.encode_array
+                    websocket_data = websocket_types.registry.decode_array(msg.json())
+                else:
+                    json_data = msg.json()
+                    LOG.debug(
+                        f"websocket message from {request.remote} with data: {json_data}"
                     )
-                    break
-        except Exception as e:
-            print(traceback.format_exc())
-            # There was an error processing the data
-            LOG.error(f"Websocket message from {request.remote} with invalid data")
-            # Skip ahead to the next message
-            continue
-
-        if websocket_data is None:
-            LOG.error(
-                f"Websocket message from {request.remote} with invalid type {msg_type}"
-            )
-            continue
-
-        # send the data to all submodules, they will handle it if they can
-        for submodule in submodules:
-            submodule.handle_ws_msg(websocket_data)
+                    data: dict = json_data["data"]
+                    msg_type: str = json_data["type"]
+                    msg_timestamp: int = json_data["timestamp"]
+
+                    # find the correct type to parse the data
+                    t = websocket_types.registry.lookup(msg_type)
+                    if t is not None:
+                        websocket_data = t.from_dict(
+                            data, msg_type=msg_type, msg_timestamp=msg_timestamp
+                        )
+            except Exception as e:
+                print(traceback.format_exc())
+                # There was an error processing the data
+                LOG.error(f"Websocket message from {request.remote} with invalid data")
+                # Skip ahead to the next message
+                continue
+
+            if websocket_data is None:
+                LOG.error(
+                    f"Websocket message from {request.remote} with invalid type {msg_type}"
+                )
+                continue
+
+            # subscriptions and rate limits are between the client and us, not the rover
+            if isinstance(websocket_data, CLIENT_CONTROL_TYPES):
+                handle_client_control(ws, websocket_data)
+                continue
+
+            # controllers with a mapping profile drive the rover through the backend
+            if isinstance(websocket_data, websocket_types.ControllerStateData):
+                map_controller(websocket_data, clock.age(websocket_data.msg_timestamp))
+                continue
+
+            # stale or superseded commands never reach the rover
+            if isinstance(websocket_data, MAILBOX_TYPES):
+                control_mailbox.put(
+                    websocket_data, clock.age(websocket_data.msg_timestamp)
+                )
+                continue
+
+            dispatch(websocket_data)
+
+    finally:
+        ws_connections.remove(ws)
     return ws
 
 
+@routes.get("/api/schema")
+async def handle_schema(_: web.BaseRequest) -> web.Response:
+    """
+    Describe every message type: its id and fields in the order the array and
+    packed encodings use, and the hash to connect with.
+    """
+    return web.json_response(websocket_types.registry.schema())
+
+
+@routes.get("/api/stats")
+async def handle_stats(_: web.BaseRequest) -> web.Response:
+    return web.json_response(
+        {
+            "dispatch": websocket_types.registry.stats(),
+            "clients": ws_connections.stats(),
+            "stream": ws_connections.stream_stats(),
+            "antenna": [
+                submodule.stats()
+                for submodule in submodules
+                if isinstance(submodule, Antenna)
+            ],
+            "history": history.stats(),
+            "recorder": recorder.stats() if recorder is not None else None,
+            "query_cache": pyramids.stats(),
+            "control": control_mailbox.stats(),
+            "control_rate": control_resampler.stats(),
+            "gamepad": gamepad_mapper.stats(),
+            "routing": {
+                "routes": {
+                    ws_type.msg_type: [submodule.name for submodule in handlers]
+                    for ws_type, handlers in routing.items()
+                },
+                "unrouted": unrouted,
+            },
+            "publishers": [
+                publisher.stats()
+                for submodule in submodules
+                for publisher in submodule.publishers
+            ],
+        }
+    )
+
+
+@routes.get("/api/history/{topic:.+}")
+async def handle_history(request: web.Request) -> web.Response:
+    """
+    Get the stored history of a feedback topic, e.g. /api/history/core/feedback.
+
+    Query parameters:
+        since: only messages with a timestamp after this (milliseconds)
+        limit: at most this many of the newest messages, all by default
+        format: "json" (default) for columnar JSON, "npy" for a numpy .npy file
+    """
+    topic = request.match_info["topic"]
+    # most topics start with a slash, but not all of them
+    topic_history = history.get("/" + topic)
+    if topic_history is None:
+        topic_history = history.get(topic)
+    if topic_history is None:
+        raise web.HTTPNotFound(text=f"no history for topic {topic}")
+
+    try:
+        since = int(request.query.get("since", 0))
+    except ValueError:
+        raise web.HTTPBadRequest(text="since must be a timestamp in milliseconds")
+    try:
+        limit = int(request.query.get("limit", topic_history.capacity))
+    except ValueError:
+        raise web.HTTPBadRequest(text="limit must be an integer")
+    if limit < 0:
+        raise web.HTTPBadRequest(text="limit must not be negative")
+
+    output = request.query.get("format", "json")
+    if output not in ("json", "npy"):
+        raise web.HTTPBadRequest(text=f"unknown format {output}")
+
+    def build() -> str | bytes:
+        rows = topic_history.since(since)
+        rows = rows[max(len(rows) - limit, 0) :]
+        if output == "npy":
+            return topic_history.to_npy(rows)
+        return fast_json.dumps(topic_history.to_columns(rows))
+
+    # a full history is megabytes of JSON, so it's built away from the event
+    # loop, where it would hold up control
+    body = await asyncio.get_running_loop().run_in_executor(None, build)
+    if output == "npy":
+        return web.Response(body=body, content_type="application/octet-stream")
+    return web.Response(text=body, content_type="application/json")
+
+
+@routes.get("/api/query/{topic:.+}")
+async def handle_query(request: web.Request) -> web.Response:
+    """
+    Get a numeric field of a feedback topic downsampled for charting, e.g.
+    /api/query/core/feedback?field=bat_voltage&points=500.
+
+    Query parameters:
+        field: the column to query, nested fields like bno_accel.x
+        start, end: the time range in milliseconds, all data by default
+        points: how many buckets or samples to return (default 500)
+        mode: "minmax" (default) for min/max/mean buckets, "lttb" for samples
+        session: a session recorded under RECORD_DIR to query instead of the
+            in-memory history
+    """
+    topic = request.match_info["topic"]
+    query = request.query
+    try:
+        field = query["field"]
+        points = min(max(int(query.get("points", 500)), 1), 5000)
+        start = int(query["start"]) if "start" in query else None
+        end = int(query["end"]) if "end" in query else None
+    except (KeyError, ValueError):
+        raise web.HTTPBadRequest(
+            text="field is required, points, start and end must be integers"
+        )
+
+    mode = query.get("mode", "minmax")
+    if mode not in ("minmax", "lttb"):
+        raise web.HTTPBadRequest(text=f"unknown mode {mode}")
+
+    session = query.get("session")
+    if session is not None:
+        record_dir = os.environ.get("RECORD_DIR")
+        if not record_dir or os.sep in session or session.startswith("."):
+            raise web.HTTPNotFound(text=f"no recorded session {session}")
+
+        def load_pyramid() -> Tuple[str, Pyramid]:
+            try:
+                recording = Recording(os.path.join(record_dir, session))
+            except FileNotFoundError:
+                raise web.HTTPNotFound(text=f"no recorded session {session}")
+            name = "/" + topic if "/" + topic in recording.segments else topic
+            if name not in recording.segments:
+                raise web.HTTPNotFound(text=f"{name} was not recorded in {session}")
+
+            key = (session, name, field)
+            version = recording.version(name)
+            pyramid = pyramids.lookup(key, version)
+            if pyramid is None:
+                try:
+                    rows = recording.columns(name, ["timestamp", field])
+                    pyramid = Pyramid(rows["timestamp"], rows[field])
+                except (ValueError, KeyError):
+                    raise web.HTTPBadRequest(
+                        text=f"{name} has no numeric field {field}"
+                    )
+                pyramids.put(key, version, pyramid)
+            return name, pyramid
+
+    else:
+        topic_history = history.get("/" + topic)
+        if topic_history is None:
+            topic_history = history.get(topic)
+        if topic_history is None:
+            raise web.HTTPNotFound(text=f"no history for topic {topic}")
+
+        def load_pyramid() -> Tuple[str, Pyramid]:
+            name = topic_history.topic
+            version = topic_history.appended
+
+            def load():
+                rows = topic_history.appended_rows(0, version)
+                return rows["timestamp"], rows[field]
+
+            def extend(built: int, pyramid: Pyramid) -> bool:
+                # only the messages since the pyramid was built are read, until
+                # it holds twice the history and is rebuilt to drop the
+                # overwritten
+                if len(pyramid) + version - built > 2 * topic_history.capacity:
+                    return False
+                rows = topic_history.appended_rows(built, version)
+                return len(rows) == version - built and pyramid.extend(
+                    rows["timestamp"], rows[field]
+                )
+
+            try:
+                pyramid = pyramids.get((session, name, field), version, load, extend)
+            except (ValueError, KeyError):
+                raise web.HTTPBadRequest(text=f"{name} has no numeric field {field}")
+            return name, pyramid
+
+    def run() -> str:
+        with pyramids_lock:
+            name, pyramid = load_pyramid()
+            if not len(pyramid):
+                raise web.HTTPNotFound(text=f"no data for {name}")
+
+            timestamps = pyramid.levels[0][0]
+            first = int(timestamps[0]) if start is None else start
+            last = int(timestamps[-1]) if end is None else end
+            if mode == "lttb":
+                result = pyramid.lttb(first, last, points)
+            else:
+                result = pyramid.buckets(first, last, points)
+        return fast_json.dumps({"type": name, "field": field, **result})
+
+    # building a pyramid takes a while, and so can reading a recording, so
+    # keep both away from the event loop, where they would hold up control
+    text = await asyncio.get_running_loop().run_in_executor(None, run)
+    return web.Response(text=text, content_type="application/json")
+
+
 async def start_webserver():
     app = web.Application(logger=LOG)
     app.add_routes(routes)
@@ -115,35 +595,112 @@ async def start_webserver():
     await site.start()
 
 
+def create_submodules(
+    executor: Executor,
+    ws_sender: aiohttp_utils.WSSender,
+    shared_node: bool = False,
+    history: Optional[TelemetryHistory] = None,
+    recorder: Optional[TelemetryRecorder] = None,
+) -> List[Submodule]:
+    """
+    Create the ROS submodules and add their node(s) to the executor.
+
+    :param executor: Executor
+        The executor that will spin the nodes.
+    :param ws_sender: aiohttp_utils.WSSender
+        Where the submodules send their feedback.
+    :param shared_node: bool
+        Put every submodule on a single "basestation" node instead of one node
+        each. This cuts the discovery traffic and startup time of five extra
+        nodes. Topic and service names are the same either way.
+    :param history: Optional[TelemetryHistory]
+        Where the submodules keep recent feedback.
+    :param recorder: Optional[TelemetryRecorder]
+        Where the submodules record their feedback to disk.
+    :return: List[Submodule]
+        The created submodules.
+    """
+    node = rclpy.create_node("basestation") if shared_node else None
+
+    created = []
+    for submodule_type in [Core, Arm, Auto, Bio, Anchor, Ptz]:
+        submodule = submodule_type(
+            node or rclpy.create_node(f"bs_{submodule_type.name}"), ws_sender
+        )
+        submodule.history = history
+        submodule.recorder = recorder
+        created.append(submodule)
+        # adding the shared node again is a no-op
+        executor.add_node(submodule.node)
+    return created
+
+
 def main():
+    global recorder
+    record_dir = os.environ.get("RECORD_DIR")
+    if record_dir:
+        session = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        recorder = TelemetryRecorder(
+            os.path.join(record_dir, session),
+            segment_bytes=int(os.environ.get("RECORD_SEGMENT_MB", 64)) * 1024 * 1024,
+            str_widths=str_widths,
+        )
+        recorder.start()
+
     # initialize ROS and submodules
     LOG.info("Initializing ROS")
     rclpy.init()
     executor = MultiThreadedExecutor()
-    for node in [Core, Arm, Auto, Bio, Anchor, Ptz]:
-        submodule = node(rclpy.create_node(f"bs_{node.name}"), ws_connections)
-        submodules.append(submodule)
-        executor.add_node(submodule.node)
+    shared_node = os.environ.get("SHARED_ROS_NODE", "0") == "1"
+    # control publishers skip messages that haven't changed, see GatedPublisher
+    Submodule.keepalive_interval = float(os.environ.get("CONTROL_KEEPALIVE", 0.25))
+    Submodule.publish_tolerances = parse_epsilons(
+        os.environ.get("CONTROL_TOLERANCES", "")
+    )
+    # the resampler already sets how often its topics are published
+    if control_resampler.rate > 0:
+        Submodule.steady_topics = frozenset(
+            ws_type.msg_type for ws_type in STOP_COMMANDS
+        )
+    submodules.extend(
+        create_submodules(executor, ws_connections, shared_node, history, recorder)
+    )
 
-    data_provider: Callable[[None], str | None] = None
+    core: Optional[Core] = None
     for submodule in submodules:
         if isinstance(submodule, Core):
-            data_provider = lambda: submodule.last_sat
+            core = submodule
             break
-    if data_provider is None:
+    if core is None:
         raise RuntimeError("No Core submodule found")
 
-    antenna = Antenna(ws_connections, data_provider)
+    prediction_rate = float(os.environ.get("ANTENNA_PREDICTION_RATE", 0))
+    antenna = Antenna(
+        ws_connections,
+        lambda: core.last_sat,
+        min_interval=float(os.environ.get("ANTENNA_MIN_INTERVAL", 0.1)),
+        heartbeat_interval=float(os.environ.get("ANTENNA_HEARTBEAT", 1.0)),
+        predictor=PositionPredictor() if prediction_rate > 0 else None,
+        prediction_rate=prediction_rate,
+    )
+    antenna.history = history
+    antenna.recorder = recorder
+    core.fix_listeners.append(antenna.notify_fix)
     submodules.append(antenna)
+    routing.update(build_routing(submodules))
 
     LOG.info("Initializing webserver routes")
 
     loop = asyncio.get_event_loop()
+    # ROS callbacks post messages from executor threads, so this has to be
+    # known before the executor starts
+    ws_connections.bind(loop)
     future = asyncio.wait(
         [
             spin_loop(executor),
             start_webserver(),
             ws_connections.loop(),
+            control_resampler.loop(),
             antenna.send_udp_message_task(),
             antenna.listen_for_udp_messages(),
         ],
@@ -155,3 +712,6 @@ def main():
             task.result()
     except KeyboardInterrupt:
         LOG.info("Shutting down")
+    finally:
+        if recorder is not None:
+            recorder.close()
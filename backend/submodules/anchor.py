@@ -16,12 +16,13 @@ class Anchor(Submodule):
 
     LOG = logging.getLogger(__name__)
     name = "anchor"
+    handles = (websocket_types.AnchorRelayData,)
 
     def __init__(self, node: Node, ws_sender: WSSender):
         super().__init__(node, ws_sender)
 
         # register publishers
-        self.publisher = self.node.create_publisher(
+        self.publisher = self.create_gated_publisher(
             msg.String,
             f"/{self.name}/relay",
             10,
@@ -29,10 +30,6 @@ class Anchor(Submodule):
 
     # Process data handling from a websocket and publish it
     def handle_ws_msg(self, ws_data) -> bool:
-        if (
-            isinstance(ws_data, websocket_types.AnchorRelayData)
-            and self.publisher.get_subscription_count() > 0
-        ):
-            self.publisher.publish(ws_data.to_ros())
-            return True
+        if isinstance(ws_data, websocket_types.AnchorRelayData):
+            return self.publisher.publish(ws_data)
         return False
@@ -1,82 +1,292 @@
 from submodules import Submodule
 import logging
 from util.aiohttp_utils import WSSender
-from asyncio import sleep, get_running_loop, DatagramProtocol
-from typing import Callable
+from asyncio import (
+    DatagramProtocol,
+    DatagramTransport,
+    Event,
+    AbstractEventLoop,
+    TimeoutError,
+    get_running_loop,
+    sleep,
+    wait_for,
+)
+from typing import *
+from struct import Struct
+from crccheck.crc import Crc16CcittFalse
 from util import websocket_types
+from util.position_predictor import PositionPredictor
 from json import loads
+from time import monotonic
 
 
 class TrackingAntennaProtocol(DatagramProtocol):
+    """
+    Receives antenna feedback and forwards it to the websocket clients.
+
+    Feedback can be JSON or a fixed-layout binary packet (little endian):
+
+    ========  =======  =============================================
+    offset    type     field
+    ========  =======  =============================================
+    0         char[2]  magic, b"AT"
+    2         uint8    version, 1
+    3         uint16   sequence number, wraps around
+    5         float64  lat
+    13        float64  lon
+    21        uint8    sat
+    22        float32  heading
+    26        uint8    calib
+    27        uint16   CRC-16/CCITT-FALSE of bytes 0-26
+    ========  =======  =============================================
+
+    Binary packets up to LATE_WINDOW sequence numbers behind the newest one
+    received so far are dropped as late. Packets arriving in a burst are
+    coalesced so that only the newest reaches the websockets.
+    """
+
     LOG = logging.getLogger(__name__)
 
-    def __init__(self, ws_sender: WSSender):
-        self.ws_sender = ws_sender
+    MAGIC = b"AT"
+    VERSION = 1
+    PACKET = Struct("<2sBHddBfB")
+    CRC = Struct("<H")
+    LATE_WINDOW = 64
+
+    def __init__(
+        self,
+        post_feedback: Callable[
+            [Type[websocket_types.WebsocketData], Dict[str, Any]], None
+        ],
+    ):
+        # where coalesced feedback goes, normally Antenna.post_feedback
+        self.post_feedback = post_feedback
+        self._latest: websocket_types.AntennaFeedbackData | None = None
+        self._flush_scheduled = False
+        self._last_seq: int | None = None
+
+        # stats
+        self.received = 0
+        self.binary = 0
+        self.corrupt = 0
+        self.late = 0
+        self.coalesced = 0
+
+    @classmethod
+    def pack(
+        cls, seq: int, lat: float, lon: float, sat: int, heading: float, calib: int
+    ) -> bytes:
+        """
+        Build a binary feedback packet, e.g. for testing without an antenna.
+        """
+        body = cls.PACKET.pack(
+            cls.MAGIC, cls.VERSION, seq & 0xFFFF, lat, lon, sat, heading, calib
+        )
+        return body + cls.CRC.pack(Crc16CcittFalse.calc(body))
+
+    def _unpack(self, data: bytes) -> Dict[str, Any] | None:
+        """
+        Decode a binary packet, returning None if it is late.
+        """
+        if len(data) != self.PACKET.size + self.CRC.size:
+            raise ValueError(f"binary packet has wrong length {len(data)}")
+
+        body = data[: self.PACKET.size]
+        (crc,) = self.CRC.unpack_from(data, self.PACKET.size)
+        if Crc16CcittFalse.calc(body) != crc:
+            raise ValueError("binary packet failed CRC check")
+
+        _, version, seq, lat, lon, sat, heading, calib = self.PACKET.unpack(body)
+        if version != self.VERSION:
+            raise ValueError(f"unsupported binary packet version {version}")
+
+        # serial number arithmetic so the sequence can wrap around. anything
+        # further behind than LATE_WINDOW means the antenna restarted
+        if (
+            self._last_seq is not None
+            and 0 < (self._last_seq - seq) & 0xFFFF <= self.LATE_WINDOW
+        ):
+            return None
+        self._last_seq = seq
+
+        return {"lat": lat, "lon": lon, "sat": sat, "heading": heading, "calib": calib}
 
     def datagram_received(self, data, addr):
-        loop = get_running_loop()
-        msg = websocket_types.AntennaFeedbackData.from_dict(loads(data.decode()))
-        self.LOG.debug(f"Received UDP from {addr}: {msg.to_json()}")
-        loop.create_task(self.ws_sender.send(msg.to_json()))
+        self.received += 1
+        try:
+            if data[: len(self.MAGIC)] == self.MAGIC:
+                unpacked = self._unpack(data)
+                self.binary += 1
+                if unpacked is None:
+                    self.late += 1
+                    return
+                feedback = websocket_types.AntennaFeedbackData(unpacked)
+            else:
+                feedback = websocket_types.AntennaFeedbackData.from_dict(
+                    loads(data.decode())
+                )
+        except Exception as e:
+            self.corrupt += 1
+            self.LOG.debug(f"Dropping corrupt UDP packet from {addr}: {e}")
+            return
+
+        # hold on to the newest feedback until the burst is over
+        if self._latest is not None:
+            self.coalesced += 1
+        self._latest = feedback
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        msg, self._latest = self._latest, None
+        if msg is None:
+            return
+
+        # already validated when it was received
+        self.LOG.debug(f"Received antenna feedback: {msg.data}")
+        self.post_feedback(websocket_types.AntennaFeedbackData, msg.to_dict())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "received": self.received,
+            "binary": self.binary,
+            "corrupt": self.corrupt,
+            "late": self.late,
+            "coalesced": self.coalesced,
+        }
 
 
 class Antenna(Submodule):
     """
     Tracking Antenna submodule.
+
+    GPS fixes are pushed to the antenna as soon as Core receives them (see
+    notify_fix), but never more often than min_interval. The latest fix is
+    resent every heartbeat_interval even if nothing changed.
+
+    With a predictor and a prediction_rate, the antenna is instead sent the
+    predicted position at that fixed rate, so it keeps tracking between fixes.
     """
 
     LOG = logging.getLogger(__name__)
     name = "antenna"
+    handles = (websocket_types.AntennaResetData,)
     data_provider: Callable[[None], str | None] = None
     overwrite_msg: str | None = None
 
     def __init__(
-        self, ws_sender: WSSender, data_provider: Callable[[None], str | None]
+        self,
+        ws_sender: WSSender,
+        data_provider: Callable[[None], str | None],
+        host: str = "192.168.1.4",
+        port: int = 42069,
+        min_interval: float = 0.1,
+        heartbeat_interval: float = 1.0,
+        predictor: PositionPredictor | None = None,
+        prediction_rate: float = 0.0,
     ):
         super().__init__(None, ws_sender)
         self.data_provider = data_provider
+        self.host = host
+        self.port = port
+        self.min_interval = min_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.predictor = predictor
+        self.prediction_rate = prediction_rate if predictor is not None else 0.0
         self.udp_transport = None  # Will hold persistent transport for receiving
+        self.protocol = TrackingAntennaProtocol(self.post_feedback)
+        self.send_transport: DatagramTransport | None = None
+
+        self._loop: AbstractEventLoop | None = None
+        self._wakeup = Event()
 
     def handle_ws_msg(self, ws_data):
         if isinstance(ws_data, websocket_types.AntennaResetData):
             self.overwrite_msg = ws_data.data["message"]
+            self._wakeup.set()
             return True
         return False
 
+    def notify_fix(self, feedback: Dict[str, Any]):
+        """
+        Handle new CoreFeedbackData (in to_dict form). Safe to call from ROS
+        executor threads.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._on_fix, feedback, monotonic())
+
+    def _on_fix(self, feedback: Dict[str, Any], received: float):
+        if self.predictor is not None:
+            self.predictor.update_feedback(feedback, received)
+        # predicted fixes go out at a fixed rate, so only wake up for raw ones
+        if not self.prediction_rate:
+            self._wakeup.set()
+
+    def _next_message(self) -> str | None:
+        to_send = self.data_provider()
+        if self.prediction_rate:
+            predicted = self.predictor.predict(monotonic())
+            if predicted is not None:
+                to_send = f"{predicted[0]:.7f},{predicted[1]:.7f}\n"
+        if self.overwrite_msg is not None:
+            if self.overwrite_msg.startswith("!"):
+                to_send = self.overwrite_msg[1:]
+            else:
+                to_send = self.overwrite_msg
+                self.overwrite_msg = None
+        return to_send
+
     async def send_udp_message_task(self):
         self.LOG.info("Starting UDP message sender task")
+        self._loop = get_running_loop()
+        self.send_transport, _ = await self._loop.create_datagram_endpoint(
+            DatagramProtocol, remote_addr=(self.host, self.port)
+        )
+
+        last_sent = float("-inf")
         while True:
             try:
-                to_send = self.data_provider()
-                if self.overwrite_msg is not None:
-                    if self.overwrite_msg.startswith("!"):
-                        to_send = self.overwrite_msg[1:]
-                    else:
-                        to_send = self.overwrite_msg
-                        self.overwrite_msg = None
+                # sleep until there's a new fix or the next send is due
+                period = (
+                    1 / self.prediction_rate
+                    if self.prediction_rate
+                    else self.heartbeat_interval
+                )
+                due_in = last_sent + period - self._loop.time()
+                try:
+                    await wait_for(self._wakeup.wait(), max(due_in, 0))
+                except TimeoutError:
+                    pass
+
+                # fixes that arrive while we wait here are coalesced into one send
+                wait = last_sent + self.min_interval - self._loop.time()
+                if wait > 0:
+                    await sleep(wait)
+                self._wakeup.clear()
+
+                to_send = self._next_message()
                 if to_send:
-                    await self.send_udp_message(to_send)
-                await sleep(1)
+                    self.send_udp_message(to_send)
+                last_sent = self._loop.time()
             except Exception as e:
                 self.LOG.error(f"Error in UDP message sender task: {e}", exc_info=True)
+                await sleep(self.heartbeat_interval)
 
-    async def send_udp_message(self, message, host="192.168.1.4", port=42069):
-        loop = get_running_loop()
-        transport, _ = await loop.create_datagram_endpoint(
-            lambda: TrackingAntennaProtocol(
-                self.ws_sender
-            ),  # No need to receive in this one-time send
-            remote_addr=(host, port),
-        )
-        try:
-            transport.sendto(message.encode())
-        finally:
-            transport.close()
+    def send_udp_message(self, message: str):
+        self.send_transport.sendto(message.encode())
 
     async def listen_for_udp_messages(self, local_host="0.0.0.0", local_port=42069):
         self.LOG.info(f"Listening for UDP on {local_host}:{local_port}")
         loop = get_running_loop()
         self.udp_transport, _ = await loop.create_datagram_endpoint(
-            lambda: TrackingAntennaProtocol(self.ws_sender),
+            lambda: self.protocol,
             local_addr=(local_host, local_port),
         )
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get counters for the feedback received from the antenna.
+        """
+        return self.protocol.stats()
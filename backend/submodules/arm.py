@@ -17,17 +17,18 @@ class Arm(Submodule):
 
     LOG = logging.getLogger(__name__)
     name = "arm"
+    handles = (websocket_types.ArmIKData, websocket_types.ArmManualData)
 
     def __init__(self, node: Node, ws_sender: WSSender):
         super().__init__(node, ws_sender)
 
         # register publishers
-        self.ik_publisher = self.node.create_publisher(
+        self.ik_publisher = self.create_gated_publisher(
             msg.ArmIK,
             f"/{self.name}/control/ik",
             1,
         )
-        self.manual_publisher = self.node.create_publisher(
+        self.manual_publisher = self.create_gated_publisher(
             msg.ArmManual,
             f"/{self.name}/control/manual",
             1,
@@ -54,33 +55,28 @@ class Arm(Submodule):
         )
 
     def handle_ws_msg(self, ws_data: websocket_types.WebsocketData) -> bool:
-        if (
-            isinstance(ws_data, websocket_types.ArmIKData)
-            and self.ik_publisher.get_subscription_count() > 0
-        ):
-            self.ik_publisher.publish(ws_data.to_ros())
-            return True
-        elif (
-            isinstance(ws_data, websocket_types.ArmManualData)
-            and self.manual_publisher.get_subscription_count() > 0
-        ):
-            self.manual_publisher.publish(ws_data.to_ros())
-            return True
+        if isinstance(ws_data, websocket_types.ArmIKData):
+            return self.ik_publisher.publish(ws_data)
+        elif isinstance(ws_data, websocket_types.ArmManualData):
+            return self.manual_publisher.publish(ws_data)
         return False
 
-    async def feedback_callback(
+    def feedback_callback(
         self, ros_data: Union[msg.SocketFeedback, msg.BioFeedback, msg.DigitFeedback]
     ):
         match type(ros_data):
             case msg.SocketFeedback:
-                await self.ws_sender.send(
-                    websocket_types.SocketFeedbackData.from_ros(ros_data).to_json()
+                self.post_feedback(
+                    websocket_types.SocketFeedbackData,
+                    websocket_types.SocketFeedbackData.ros_to_dict(ros_data),
                 )
             case msg.BioFeedback:
-                await self.ws_sender.send(
-                    websocket_types.BioFeedbackData.from_ros(ros_data).to_json()
+                self.post_feedback(
+                    websocket_types.BioFeedbackData,
+                    websocket_types.BioFeedbackData.ros_to_dict(ros_data),
                 )
             case msg.DigitFeedback:
-                await self.ws_sender.send(
-                    websocket_types.DigitFeedbackData.from_ros(ros_data).to_json()
+                self.post_feedback(
+                    websocket_types.DigitFeedbackData,
+                    websocket_types.DigitFeedbackData.ros_to_dict(ros_data),
                 )
@@ -35,7 +35,8 @@ class Auto(Submodule):
     def handle_ws_msg(self, _) -> bool:
         return False
 
-    async def feedback_callback(self, ros_msg: msg.AutoFeedback):
-        await self.ws_sender.send(
-            websocket_types.AutoFeedbackData.from_ros(ros_msg).to_json()
+    def feedback_callback(self, ros_msg: msg.AutoFeedback):
+        self.post_feedback(
+            websocket_types.AutoFeedbackData,
+            websocket_types.AutoFeedbackData.ros_to_dict(ros_msg),
         )
@@ -17,12 +17,13 @@ class Bio(Submodule):
 
     LOG = logging.getLogger(__name__)
     name = "bio"
+    handles = (websocket_types.BioControlData,)
 
     def __init__(self, node: Node, ws_sender: WSSender):
         super().__init__(node, ws_sender)
 
         # register publishers
-        self.publisher = self.node.create_publisher(
+        self.publisher = self.create_gated_publisher(
             msg.BioControl,
             f"/{self.name}/control",
             10,
@@ -36,15 +37,12 @@ class Bio(Submodule):
         )
 
     def handle_ws_msg(self, ws_data: websocket_types.WebsocketData) -> bool:
-        if (
-            isinstance(ws_data, websocket_types.BioControlData)
-            and self.publisher.get_subscription_count() > 0
-        ):
-            self.publisher.publish(ws_data.to_ros())
-            return True
+        if isinstance(ws_data, websocket_types.BioControlData):
+            return self.publisher.publish(ws_data)
         return False
 
-    async def feedback_callback(self, ros_msg: msg.BioFeedback):
-        await self.ws_sender.send(
-            websocket_types.BioFeedbackData.from_ros(ros_msg).to_json()
+    def feedback_callback(self, ros_msg: msg.BioFeedback):
+        self.post_feedback(
+            websocket_types.BioFeedbackData,
+            websocket_types.BioFeedbackData.ros_to_dict(ros_msg),
         )
@@ -1,5 +1,7 @@
 from submodules import Submodule
 
+from typing import *
+
 # ControllerState & CoreFeedback
 from ros2_interfaces_pkg import msg
 from util.aiohttp_utils import WSSender
@@ -17,13 +19,17 @@ class Core(Submodule):
 
     LOG = logging.getLogger(__name__)
     name = "core"
+    handles = (websocket_types.CoreControlData,)
 
     last_sat: str | None = None
 
     def __init__(self, node: Node, ws_sender: WSSender):
         super().__init__(node, ws_sender)
 
-        self.core_publisher = self.node.create_publisher(
+        # called from the ROS executor with every new CoreFeedbackData dict
+        self.fix_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+        self.core_publisher = self.create_gated_publisher(
             msg.CoreControl,
             f"/{self.name}/control",
             10,
@@ -37,19 +43,13 @@ class Core(Submodule):
 
     # Process data handling from a websocket and publish it
     def handle_ws_msg(self, ws_msg: websocket_types.CoreControlData) -> bool:
-        if (
-            isinstance(ws_msg, websocket_types.CoreControlData)
-            and self.core_publisher.get_subscription_count() > 0
-        ):
-            self.core_publisher.publish(ws_msg.to_ros())
-            return True
+        if isinstance(ws_msg, websocket_types.CoreControlData):
+            return self.core_publisher.publish(ws_msg)
         return False
 
-    async def feedback_callback(self, ros_msg: msg.CoreFeedback):
-        msg: websocket_types.CoreFeedbackData = (
-            websocket_types.CoreFeedbackData.from_ros(ros_msg)
-        )
-        gps_lat = msg.data["gps_lat"]
-        gps_long = msg.data["gps_long"]
-        self.last_sat = f"{gps_lat:.7f},{gps_long:.7f}\n"
-        await self.ws_sender.send(msg.to_json())
+    def feedback_callback(self, ros_msg: msg.CoreFeedback):
+        feedback = websocket_types.CoreFeedbackData.ros_to_dict(ros_msg)
+        self.last_sat = f"{ros_msg.gps_lat:.7f},{ros_msg.gps_long:.7f}\n"
+        for listener in self.fix_listeners:
+            listener(feedback)
+        self.post_feedback(websocket_types.CoreFeedbackData, feedback)
@@ -16,12 +16,13 @@ class Ptz(Submodule):
 
     LOG = logging.getLogger(__name__)
     name = "ptz"
+    handles = (websocket_types.PtzControlData,)
 
     def __init__(self, node: Node, ws_sender: WSSender):
         super().__init__(node, ws_sender)
 
         # register publishers
-        self.publisher = self.node.create_publisher(
+        self.publisher = self.create_gated_publisher(
             msg.PtzControl,
             f"/{self.name}/control",
             10,
@@ -29,10 +30,6 @@ class Ptz(Submodule):
 
     # Process data handling from a websocket and publish it
     def handle_ws_msg(self, ws_data) -> bool:
-        if (
-            isinstance(ws_data, websocket_types.PtzControlData)
-            and self.publisher.get_subscription_count() > 0
-        ):
-            self.publisher.publish(ws_data.to_ros())
-            return True
+        if isinstance(ws_data, websocket_types.PtzControlData):
+            return self.publisher.publish(ws_data)
         return False
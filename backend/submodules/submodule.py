@@ -1,14 +1,187 @@
 from typing import *
 from std_srvs.srv import Empty
 from rclpy.node import Node, SrvTypeRequest, SrvTypeResponse
+from rclpy.publisher import Publisher
 from rclpy.service import Service
-from time import time
+from rclpy.timer import Timer
+from time import time, monotonic
+from fnmatch import fnmatchcase
+from threading import Lock
 from util.aiohttp_utils import WSSender
+from util.telemetry_history import TelemetryHistory
+from util.telemetry_recorder import TelemetryRecorder
+import datetime
 import logging
 from abc import ABC, abstractmethod
 from util.websocket_types import WebsocketData
 
 
+class GatedPublisher:
+    """
+    Publisher that only publishes while something subscribes to its topic.
+
+    Asking the middleware for the subscription count is a graph query, so the
+    count is cached here and refreshed by its submodule's timer instead of being
+    checked for every message.
+
+    With a keepalive interval, messages that are the same as the last one
+    published are suppressed, except once per interval so watchdogs on the
+    rover still hear from us. The submodule's timer calls send_keepalive,
+    which publishes the newest suppressed message once an interval has passed
+    even if nothing newer arrives. Once messages stop coming, so do
+    keepalives, just as they would without suppression.
+
+    publish is called from the event loop and send_keepalive from the ROS
+    executor, so the suppression state is locked, and messages are published
+    under that lock so they reach ROS in the order they were taken.
+
+    :param publisher: Publisher
+        The publisher to wrap.
+    :param keepalive: float
+        Seconds after which an unchanged message is published anyway. 0
+        publishes every message.
+    :param tolerances: Optional[Dict[str, float]]
+        Glob patterns of field names (nested fields as e.g.
+        "movement_vector.x") to how much a float may change and still count as
+        the same. The first matching pattern wins; other fields must be equal.
+    """
+
+    def __init__(
+        self,
+        publisher: Publisher,
+        keepalive: float = 0.0,
+        tolerances: Optional[Dict[str, float]] = None,
+    ):
+        self.publisher = publisher
+        self.topic: str = publisher.topic_name
+        self.subscribers: int = publisher.get_subscription_count()
+
+        self.keepalive = keepalive
+        self.tolerances = tolerances or {}
+        # positional values of the last message published, and when
+        self._last: Optional[List[Any]] = None
+        self._last_time = 0.0
+        # the newest message suppressed since then
+        self._pending: Optional[WebsocketData] = None
+        self._lock = Lock()
+        # message type -> tolerance of each positional value
+        self._resolved: Dict[Type[WebsocketData], List[float]] = {}
+
+        # stats
+        self.published = 0
+        self.dropped = 0
+        self.suppressed = 0
+        self.keepalives = 0
+
+    def refresh(self):
+        """
+        Refresh the cached subscription count from the ROS graph.
+        """
+        self.subscribers = self.publisher.get_subscription_count()
+
+    def publish(self, ws_data: WebsocketData) -> bool:
+        """
+        Publish websocket data if anything is listening, otherwise count it as
+        dropped.
+
+        :param ws_data: WebsocketData
+            The data to convert and publish.
+        :return: bool
+            True if the data was published.
+        """
+        if self.subscribers <= 0:
+            self.dropped += 1
+            return False
+
+        if self.keepalive <= 0:
+            self.publisher.publish(ws_data.to_ros())
+            self.published += 1
+            return True
+
+        values = ws_data.values()
+        with self._lock:
+            now = monotonic()
+            if now - self._last_time < self.keepalive and self._unchanged(
+                type(ws_data), values
+            ):
+                self._pending = ws_data
+                self.suppressed += 1
+                return False
+            self._last = values
+            self._last_time = now
+            self._pending = None
+            # publish under the lock so a keepalive can't overtake this
+            self.publisher.publish(ws_data.to_ros())
+            self.published += 1
+        return True
+
+    def send_keepalive(self):
+        """
+        Publish the newest suppressed message if nothing was published for a
+        keepalive interval.
+        """
+        if self.keepalive <= 0 or self.subscribers <= 0:
+            return
+        with self._lock:
+            now = monotonic()
+            if self._pending is None or now - self._last_time < self.keepalive:
+                return
+            ws_data, self._pending = self._pending, None
+            self._last_time = now
+            # otherwise a newer message published meanwhile would be followed
+            # by this older one
+            self.publisher.publish(ws_data.to_ros())
+            self.published += 1
+            self.keepalives += 1
+
+    def _unchanged(self, ws_type: Type[WebsocketData], values: List[Any]) -> bool:
+        """
+        Check if values are within tolerance of the last message published.
+        """
+        if self._last is None or len(values) != len(self._last):
+            return False
+        tolerances = self._resolved.get(ws_type)
+        if tolerances is None:
+            tolerances = [
+                next(
+                    (
+                        t
+                        for p, t in self.tolerances.items()
+                        if fnmatchcase(".".join(path), p)
+                    ),
+                    0.0,
+                )
+                for path, _ in ws_type._flat
+            ]
+            self._resolved[ws_type] = tolerances
+
+        for value, last, tolerance in zip(values, self._last, tolerances):
+            # NaN counts as the same as NaN
+            if type(value) is type(last) and (
+                value == last or (value != value and last != last)
+            ):
+                continue
+            if (
+                tolerance
+                and isinstance(value, float)
+                and isinstance(last, float)
+                and abs(value - last) <= tolerance
+            ):
+                continue
+            return False
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "topic": self.topic,
+            "subscribers": self.subscribers,
+            "published": self.published,
+            "dropped_no_subscribers": self.dropped,
+            "suppressed_unchanged": self.suppressed,
+            "keepalives": self.keepalives,
+        }
+
+
 class Submodule(ABC):
     """
     Class to handle communication between ROS and Websockets.
@@ -21,10 +194,27 @@ class Submodule(ABC):
     node: Node | None
 
     ws_sender: WSSender
+    # the message types handle_ws_msg takes, which the app routes here
+    handles: Tuple[Type[WebsocketData], ...] = ()
+    # where feedback is recorded for backfill, if anywhere
+    history: TelemetryHistory | None = None
+    # where feedback is recorded to disk, if anywhere
+    recorder: TelemetryRecorder | None = None
 
     _ping_server: Service
     last_ping: float = 0.0
 
+    # how often gated publishers refresh their subscription counts, in seconds
+    subscriber_refresh_period: float = 0.5
+    # how gated publishers suppress unchanged messages, see GatedPublisher
+    keepalive_interval: float = 0.0
+    publish_tolerances: Dict[str, float] = {}
+    # topics published at a steady rate already, which are never suppressed
+    steady_topics: FrozenSet[str] = frozenset()
+    publishers: List[GatedPublisher]
+    _refresh_timer: Timer | None = None
+    _next_refresh: float = 0.0
+
     LOG: logging.Logger
 
     def __init__(
@@ -36,12 +226,73 @@ class Submodule(ABC):
 
         self.node = node
         self.ws_sender = ws_sender
+        self.publishers = []
         if node:
             self.LOG.info(f"Initializing node {self.name}")
             self._ping_server = self.node.create_service(
                 Empty, f"/{self.name}/ping", self.handle_ping
             )
 
+    def create_gated_publisher(
+        self, msg_type: Any, topic: str, qos_depth: int
+    ) -> GatedPublisher:
+        """
+        Create a publisher that only publishes while the topic has subscribers.
+
+        :param msg_type: Any
+            The ROS message type.
+        :param topic: str
+            The topic to publish on.
+        :param qos_depth: int
+            The QoS history depth.
+        :return: GatedPublisher
+        """
+        publisher = GatedPublisher(
+            self.node.create_publisher(msg_type, topic, qos_depth),
+            0.0 if topic in self.steady_topics else self.keepalive_interval,
+            self.publish_tolerances,
+        )
+        self.publishers.append(publisher)
+
+        if self._refresh_timer is None:
+            # the timer also sends keepalives, so it runs at least twice per
+            # keepalive interval
+            period = self.subscriber_refresh_period
+            if self.keepalive_interval > 0:
+                period = min(period, self.keepalive_interval / 2)
+            self._refresh_timer = self.node.create_timer(
+                period, self._refresh_subscribers
+            )
+        return publisher
+
+    def post_feedback(self, ws_type: Type[WebsocketData], data: Dict[str, Any]):
+        """
+        Record feedback in the history (and the recording, if there is one) and
+        send it to the websocket clients.
+        Safe to call from ROS executor threads.
+
+        :param ws_type: Type[WebsocketData]
+            The feedback type.
+        :param data: Dict[str, Any]
+            The feedback in to_dict form, e.g. from ws_type.ros_to_dict.
+        """
+        timestamp = int(datetime.datetime.now().timestamp() * 1000)
+        if self.history is not None:
+            self.history.record(ws_type, data, timestamp)
+        if self.recorder is not None:
+            self.recorder.record(ws_type, data, timestamp)
+        self.ws_sender.post_data(ws_type, data, timestamp)
+
+    def _refresh_subscribers(self):
+        now = monotonic()
+        refresh = now >= self._next_refresh
+        if refresh:
+            self._next_refresh = now + self.subscriber_refresh_period
+        for publisher in self.publishers:
+            if refresh:
+                publisher.refresh()
+            publisher.send_keepalive()
+
     def handle_ping(
         self, _: SrvTypeRequest, response: SrvTypeResponse
     ) -> SrvTypeResponse:
@@ -17,3 +17,15 @@ def list_types():
     from .list_types import main
 
     run(main())
+
+
+def benchmark():
+    from .benchmark import main
+
+    run(main())
+
+
+def replay():
+    from .replay import main
+
+    run(main())
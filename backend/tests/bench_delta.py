@@ -0,0 +1,126 @@
+"""
+Measures how many bytes delta encoding saves on feedback streams, with and
+without per-message deflate, and checks that reconstruction stays within the
+epsilons.
+
+By default, ten minutes of synthetic 10 Hz CoreFeedback and SocketFeedback are
+used: slow random walks quantized like the real sensors. Set DELTA_RECORDING
+to a session directory written with RECORD_DIR to measure a real session.
+"""
+
+from typing import *
+import math
+import os
+import random
+import zlib
+from util import fast_json, websocket_types
+from util.delta import DeltaEncoder, apply_delta, parse_epsilons
+from util.telemetry_recorder import Recording
+from .bench_util import print_table
+
+RATE = 10
+SECONDS = 600
+KEYFRAME_INTERVAL = 20
+EPSILONS = "*voltage*=0.05,*_3=0.05,*_5=0.05,*_12=0.05,*temp*=0.5,*current*=0.05"
+
+
+def synthetic_messages() -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+    """
+    Slowly drifting sensor values, quantized to what the sensors report.
+    """
+    random.seed(0)
+    streams = (websocket_types.CoreFeedbackData, websocket_types.SocketFeedbackData)
+    state = {}
+    for t in range(SECONDS * RATE):
+        timestamp = 1_700_000_000_000 + t * 1000 // RATE
+        for ws_type in streams:
+            data = {}
+            for entry in ws_type._fields:
+                name = entry.field
+                if issubclass(entry.field_type, websocket_types.WebsocketData):
+                    data[name] = {
+                        axis: round(random.gauss(0, 0.05), 2) for axis in "xyz"
+                    }
+                elif entry.field_type is int:
+                    data[name] = state.setdefault(name, random.randint(0, 10))
+                else:
+                    value = state.get(name, random.uniform(5, 30))
+                    value += random.gauss(0, 0.01)
+                    state[name] = value
+                    data[name] = round(value, 2)
+            if "gps_lat" in data:
+                data["gps_lat"] = 38.4 + math.sin(t / 3000) / 1000
+                data["gps_long"] = -110.8 + math.cos(t / 3000) / 1000
+            yield timestamp, ws_type.msg_type, data
+
+
+def recorded_messages(path: str) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+    return Recording(path).messages()
+
+
+def measure(messages, encoder: Optional[DeltaEncoder]):
+    """
+    Get the raw and deflated bytes of a stream, and the largest absolute
+    reconstruction error of any field.
+    """
+    deflate = zlib.compressobj(wbits=-15)
+    raw = compressed = 0
+    keyframes: Dict[int, Dict[str, Any]] = {}
+    max_error = 0.0
+    for timestamp, topic, data in messages:
+        text = fast_json.dumps({"type": topic, "timestamp": timestamp, "data": data})
+        if encoder is not None:
+            key, delta = encoder.encode(topic, data, timestamp)
+            if delta is None:
+                keyframes[key] = data
+            else:
+                text = delta
+                decoded = apply_delta(keyframes[key], fast_json.loads(delta)["delta"])
+                max_error = max(max_error, error(data, decoded))
+
+        encoded = text.encode()
+        raw += len(encoded)
+        # like permessage-deflate with context takeover
+        compressed += len(deflate.compress(encoded) + deflate.flush(zlib.Z_SYNC_FLUSH))
+    return raw, compressed, max_error
+
+
+def error(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+    worst = 0.0
+    for field, value in a.items():
+        if isinstance(value, dict):
+            worst = max(worst, error(value, b[field]))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            worst = max(worst, abs(value - b[field]))
+    return worst
+
+
+async def main():
+    path = os.environ.get("DELTA_RECORDING")
+    if path:
+        print(f"measuring {path}")
+        source = lambda: recorded_messages(path)
+    else:
+        print(f"measuring {SECONDS} s of synthetic feedback at {RATE} Hz")
+        messages = list(synthetic_messages())
+        source = lambda: iter(messages)
+
+    full_raw, full_deflated, _ = measure(source(), None)
+    rows = [("full", full_raw / 1e6, full_deflated / 1e6, "", 0.0)]
+    for name, epsilons in (("delta, exact", {}), ("delta, epsilons", EPSILONS)):
+        if isinstance(epsilons, str):
+            epsilons = parse_epsilons(epsilons)
+        encoder = DeltaEncoder(KEYFRAME_INTERVAL, epsilons)
+        raw, deflated, max_error = measure(source(), encoder)
+        rows.append(
+            (
+                name,
+                raw / 1e6,
+                deflated / 1e6,
+                f"{(1 - raw / full_raw) * 100:.0f}% / {(1 - deflated / full_deflated) * 100:.0f}%",
+                max_error,
+            )
+        )
+    print_table(
+        ("encoding", "raw MB", "deflated MB", "saved raw/defl", "max error"), rows
+    )
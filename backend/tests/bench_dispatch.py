@@ -0,0 +1,58 @@
+"""
+Compares the old linear scan over `websocket_types.types` with the
+TypeRegistry lookup while padding the registry with more and more types.
+"""
+
+from typing import *
+from util.websocket_types import TypeRegistry, WebsocketData, types
+from .bench_util import ns_per_call, print_table
+
+# a mix of exact hits, a prefix hit and a miss, like real traffic
+LOOKUPS = [
+    "/core/control",
+    "/arm/control/manual",
+    "/basestation/controller0",
+    "/ptz/control",
+    "/does/not/exist",
+]
+
+
+def linear_scan(all_types: Iterable[Type[WebsocketData]], msg_type: str):
+    for t in all_types:
+        if t.check_type(msg_type):
+            return t
+    return None
+
+
+def synthetic_types(count: int) -> List[Type[WebsocketData]]:
+    return [
+        type(
+            f"Synthetic{i}",
+            (WebsocketData,),
+            {"msg_type": f"/synthetic/{i}/feedback", "ros_type": None, "spec": set()},
+        )
+        for i in range(count)
+    ]
+
+
+async def main():
+    rows = []
+    for extra in (0, 16, 128, 1024, 8192):
+        all_types = set(types) | set(synthetic_types(extra))
+        registry = TypeRegistry(all_types)
+
+        # both must agree before timing means anything
+        for msg_type in LOOKUPS:
+            assert registry.lookup(msg_type) is linear_scan(all_types, msg_type)
+
+        scan_ns = ns_per_call(
+            lambda: [linear_scan(all_types, m) for m in LOOKUPS]
+        ) / len(LOOKUPS)
+        registry_ns = ns_per_call(lambda: [registry.lookup(m) for m in LOOKUPS]) / len(
+            LOOKUPS
+        )
+        rows.append((len(all_types), scan_ns, registry_ns, scan_ns / registry_ns))
+
+    print_table(("types", "scan ns", "registry ns", "speedup"), rows)
+    print()
+    print(f"registry self-reported stats: {registry.stats()}")
@@ -0,0 +1,93 @@
+"""
+Compares min/max/mean bucketing straight from raw samples with the pyramid
+used by /api/query, for a two hour mission of 10 Hz feedback, and checks the
+two agree to within the pyramid's block size. Also times appending a new
+sample to a built pyramid, which is what a live topic costs per query.
+"""
+
+from typing import *
+import numpy as np
+from util.downsample import Pyramid, PyramidCache
+from .bench_util import ns_per_call, print_table
+
+RATE = 10
+HOURS = 2
+POINTS = 800
+
+
+def raw_buckets(t: np.ndarray, y: np.ndarray, start: int, end: int, points: int):
+    """
+    The straightforward version: bucket every raw sample in the range.
+    """
+    first, last = np.searchsorted(t, [start, end], side="left")
+    t, y = t[first:last], y[first:last]
+    index = ((t - start) * points // (end - start)).clip(0, points - 1)
+    mn = np.full(points, np.inf)
+    mx = np.full(points, -np.inf)
+    np.minimum.at(mn, index, y)
+    np.maximum.at(mx, index, y)
+    total = np.bincount(index, y, points)
+    count = np.bincount(index, None, points)
+    return mn, mx, total / np.maximum(count, 1)
+
+
+def ms_per_call(fn: Callable[[], Any]) -> float:
+    return ns_per_call(fn, repeat=3) / 1e6
+
+
+async def main():
+    n = RATE * 3600 * HOURS
+    t = np.arange(n, dtype=np.int64) * (1000 // RATE)
+    rng = np.random.default_rng(0)
+    y = 24 + np.cumsum(rng.normal(0, 0.01, n))
+
+    cache = PyramidCache()
+    build_ms = ms_per_call(lambda: Pyramid(t, y))
+    cache.get("voltage", n, lambda: (t, y))
+
+    growing = Pyramid(t, y)
+    appended = iter(range(1, 1 << 62))
+
+    def extend():
+        growing.extend(t[-1:] + next(appended) * (1000 // RATE), y[-1:])
+
+    extend_ms = ms_per_call(extend)
+
+    rows = []
+    # full mission, then zooming in
+    for fraction in (1, 1 / 8, 1 / 64, 1 / 512):
+        start = int(t[0])
+        end = int(t[0] + (t[-1] - t[0]) * fraction)
+        raw_ms = ms_per_call(lambda: raw_buckets(t, y, start, end, POINTS))
+        cached_ms = ms_per_call(
+            lambda: cache.get("voltage", n, lambda: (t, y)).buckets(start, end, POINTS)
+        )
+        lttb_ms = ms_per_call(
+            lambda: cache.get("voltage", n, lambda: (t, y)).lttb(start, end, POINTS)
+        )
+
+        # buckets can only differ by what the blocks straddling an edge hold
+        pyramid = cache.get("voltage", n, lambda: (t, y))
+        mn = np.array(pyramid.buckets(start, end, POINTS)["columns"]["min"])
+        raw_mn = raw_buckets(t, y, start, end, POINTS)[0]
+        raw_mn = raw_mn[np.isfinite(raw_mn)][: len(mn)]
+        error = float(np.max(np.abs(mn - raw_mn)))
+
+        rows.append(
+            (
+                f"{fraction:.4g} of mission",
+                raw_ms,
+                cached_ms,
+                lttb_ms,
+                pyramid.level_for(start, end, POINTS),
+                error,
+            )
+        )
+
+    print(
+        f"{n} samples, pyramid built in {build_ms:.1f} ms, "
+        f"extended by a sample in {extend_ms:.3f} ms"
+    )
+    print_table(
+        ("range", "raw ms", "pyramid ms", "lttb ms", "level", "max min err"), rows
+    )
@@ -0,0 +1,56 @@
+"""
+Compares the fused ROS-to-JSON feedback encoder with the old
+from_ros -> to_dict -> json.dumps path.
+"""
+
+from typing import *
+import json
+import random
+from ros2_interfaces_pkg import msg
+from util import fast_json, websocket_types
+from util.websocket_types import WebsocketData
+from .bench_util import ns_per_call, print_table
+from .util import generate_random_data
+
+TYPES = [
+    websocket_types.CoreFeedbackData,
+    websocket_types.SocketFeedbackData,
+    websocket_types.BioFeedbackData,
+    websocket_types.DigitFeedbackData,
+    websocket_types.AutoFeedbackData,
+]
+
+
+def legacy_encode(cls: Type[WebsocketData], ros_data: Any) -> str:
+    data = cls.from_ros(ros_data)
+    return json.dumps(
+        {"type": data.msg_type, "timestamp": data.msg_timestamp, "data": data.to_dict()}
+    )
+
+
+def random_ros(cls: Type[WebsocketData]) -> Any:
+    ros_data = generate_random_data(cls.from_ros(cls.ros_type())).to_ros()
+    # feedback from a broken sensor shows up as NaN
+    for entry in cls.spec:
+        if entry.field_type == float and random.random() < 0.2:
+            setattr(ros_data, entry.ros_property, float("nan"))
+    return ros_data
+
+
+async def main():
+    print(f"JSON backend: {fast_json.BACKEND}")
+    print()
+
+    rows = []
+    for cls in TYPES:
+        ros_data = random_ros(cls)
+
+        legacy = json.loads(legacy_encode(cls, ros_data))
+        fused = json.loads(cls.encode_ros(ros_data, msg_timestamp=legacy["timestamp"]))
+        assert legacy == fused, f"{cls.__name__}: {legacy} != {fused}"
+
+        legacy_ns = ns_per_call(lambda: legacy_encode(cls, ros_data))
+        fused_ns = ns_per_call(lambda: cls.encode_ros(ros_data))
+        rows.append((cls.__name__[:15], legacy_ns, fused_ns, legacy_ns / fused_ns))
+
+    print_table(("type", "old ns", "fused ns", "speedup"), rows)
@@ -0,0 +1,87 @@
+"""
+Compares the size and encode/decode cost of the feedback encodings a client
+can ask for: JSON objects, positional arrays and packed binary frames.
+
+Sizes are for the synthetic feedback from bench_delta. Costs are timed for
+every feedback type, since they depend on the type's fields.
+"""
+
+from typing import *
+import zlib
+from util import fast_json, websocket_types
+from util.websocket_types import registry
+from .bench_decode import sample
+from .bench_delta import synthetic_messages, SECONDS, RATE
+from .bench_util import ns_per_call, print_table
+
+
+FEEDBACK_TYPES = [
+    websocket_types.CoreFeedbackData,
+    websocket_types.AutoFeedbackData,
+    websocket_types.DigitFeedbackData,
+    websocket_types.BioFeedbackData,
+    websocket_types.SocketFeedbackData,
+    websocket_types.AntennaFeedbackData,
+]
+
+
+def encoders() -> Dict[str, Callable[[Any, Dict[str, Any], int], Union[str, bytes]]]:
+    return {
+        "json": lambda t, data, ts: t.encode_dict(data, ts),
+        "array": registry.encode_array,
+        "packed": registry.encode_packed,
+    }
+
+
+def decoders() -> Dict[str, Callable[[Union[str, bytes]], Any]]:
+    return {
+        "json": lambda text: (
+            lambda j: registry.lookup(j["type"]).from_dict(
+                j["data"], msg_timestamp=j["timestamp"]
+            )
+        )(fast_json.loads(text)),
+        "array": lambda text: registry.decode_array(fast_json.loads(text)),
+        "packed": registry.decode_packed,
+    }
+
+
+async def main():
+    print(f"encoding {SECONDS} s of synthetic feedback at {RATE} Hz")
+    messages = [
+        (registry.lookup(topic), data, timestamp)
+        for timestamp, topic, data in synthetic_messages()
+    ]
+
+    rows = []
+    for name, encode in encoders().items():
+        deflate = zlib.compressobj(wbits=-15)
+        raw = deflated = 0
+        for t, data, timestamp in messages:
+            frame = encode(t, data, timestamp)
+            if isinstance(frame, str):
+                frame = frame.encode()
+            raw += len(frame)
+            deflated += len(deflate.compress(frame) + deflate.flush(zlib.Z_SYNC_FLUSH))
+        rows.append((name, raw / 1e6, deflated / 1e6))
+    print_table(("encoding", "raw MB", "deflated MB"), rows)
+
+    decode = decoders()
+    rows = []
+    for t in FEEDBACK_TYPES:
+        message = (t, sample(t), 1718000000000)
+        for name, encode in encoders().items():
+            encoded = encode(*message)
+            if encoded is None:
+                # can't be packed, so it is sent as an array
+                continue
+            rows.append(
+                (
+                    t.__name__[:15],
+                    name,
+                    len(encoded),
+                    ns_per_call(lambda: encode(*message)) / 1000,
+                    ns_per_call(lambda: decode[name](encoded)) / 1000,
+                )
+            )
+    print()
+    print_table(("type", "encoding", "bytes", "encode us", "decode us"), rows)
@@ -0,0 +1,149 @@
+"""
+Measures idle CPU use and ROS-callback-to-websocket latency for the old
+busy-polling spin loop and the threaded executor in `backend.app.spin_loop`.
+
+Needs a working ROS2 install; everything runs in this process over localhost.
+"""
+
+from typing import *
+import asyncio
+import statistics
+import time
+import aiohttp
+from aiohttp import web
+import rclpy
+from rclpy.executors import MultiThreadedExecutor
+from ros2_interfaces_pkg import msg
+from backend.app import spin_loop
+from util import fast_json, websocket_types
+from util.aiohttp_utils import WSSender
+from .bench_util import print_table
+
+IDLE_SECONDS = 5.0
+SAMPLES = 500
+PUBLISH_PERIOD = 0.01
+PORT = 5050
+TOPIC = "/bench/core/feedback"
+
+
+async def legacy_spin_loop(executor: MultiThreadedExecutor):
+    """The spin loop backend.app used to run."""
+    while rclpy.ok():
+        executor.spin_once(timeout_sec=0)
+        await asyncio.sleep(1e-4)
+
+
+async def run_spin(
+    spin: Callable[[MultiThreadedExecutor], Awaitable[None]],
+    executor: MultiThreadedExecutor,
+    during: Callable[[], Awaitable[Any]],
+) -> Any:
+    task = asyncio.create_task(spin(executor))
+    try:
+        return await during()
+    finally:
+        executor.shutdown()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def idle_cpu(spin, name: str) -> float:
+    """
+    Fraction of a core used while there is no ROS traffic at all.
+    """
+    executor = MultiThreadedExecutor()
+    executor.add_node(rclpy.create_node(f"bench_idle_{name}"))
+
+    async def measure():
+        start_cpu, start = time.process_time(), time.monotonic()
+        await asyncio.sleep(IDLE_SECONDS)
+        return (time.process_time() - start_cpu) / (time.monotonic() - start)
+
+    return await run_spin(spin, executor, measure)
+
+
+async def latency(spin, name: str) -> List[float]:
+    """
+    Seconds from publishing a CoreFeedback to receiving it on a websocket.
+    The publish time travels in gps_alt.
+    """
+    sender = WSSender()
+
+    async def handler(request: web.BaseRequest) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        sender.add(ws, request.remote)
+        async for _ in ws:
+            pass
+        sender.remove(ws)
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/ws", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    sender_task = asyncio.create_task(sender.loop())
+
+    node = rclpy.create_node(f"bench_latency_{name}")
+    node.create_subscription(
+        msg.CoreFeedback,
+        TOPIC,
+        lambda ros_msg: sender.post(
+            websocket_types.CoreFeedbackData.encode_ros(ros_msg), TOPIC
+        ),
+        10,
+    )
+    publisher = node.create_publisher(msg.CoreFeedback, TOPIC, 10)
+    executor = MultiThreadedExecutor()
+    executor.add_node(node)
+
+    async def measure():
+        samples = []
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(f"http://127.0.0.1:{PORT}/ws") as ws:
+                # give discovery a moment to match the publisher and subscriber
+                await asyncio.sleep(1.0)
+                for _ in range(SAMPLES):
+                    ros_msg = msg.CoreFeedback()
+                    ros_msg.gps_alt = time.perf_counter()
+                    publisher.publish(ros_msg)
+                    try:
+                        received = await asyncio.wait_for(ws.receive(), 1.0)
+                    except asyncio.TimeoutError:
+                        continue
+                    sent = fast_json.loads(received.data)["data"]["gps_alt"]
+                    samples.append(time.perf_counter() - sent)
+                    await asyncio.sleep(PUBLISH_PERIOD)
+        return samples
+
+    try:
+        return await run_spin(spin, executor, measure)
+    finally:
+        sender_task.cancel()
+        await runner.cleanup()
+        node.destroy_node()
+
+
+async def main():
+    rclpy.init()
+    rows = []
+    for name, spin in (("busy_poll", legacy_spin_loop), ("threaded", spin_loop)):
+        cpu = await idle_cpu(spin, name)
+        samples = sorted(await latency(spin, name))
+        if not samples:
+            print(f"{name}: no messages made it through")
+            continue
+        p99 = samples[int(len(samples) * 0.99) - 1]
+        rows.append(
+            (
+                name,
+                cpu * 100,
+                statistics.median(samples) * 1e6,
+                p99 * 1e6,
+                len(samples),
+            )
+        )
+    rclpy.shutdown()
+
+    print_table(("spin", "idle cpu %", "median us", "p99 us", "samples"), rows)
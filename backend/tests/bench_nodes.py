@@ -0,0 +1,74 @@
+"""
+Compares startup time and discovery cost of one rclpy node per submodule with
+all submodules sharing a single node (SHARED_ROS_NODE=1).
+
+Each mode runs in its own ROS domain. An observer in a separate context
+measures how long it takes until it has discovered everything the
+basestation created.
+
+Needs a working ROS2 install.
+"""
+
+from typing import *
+import asyncio
+import time
+import rclpy
+from rclpy.context import Context
+from rclpy.executors import MultiThreadedExecutor
+from backend.app import create_submodules
+from util.aiohttp_utils import WSSender
+from .bench_util import print_table
+
+# pick domains that are unlikely to have anything else on them
+DOMAINS = {"per_submodule": 97, "shared": 98}
+TIMEOUT = 30.0
+
+
+async def run_mode(shared: bool, domain_id: int) -> Tuple[float, float, int, int]:
+    rclpy.init(domain_id=domain_id)
+    observer_context = Context()
+    rclpy.init(context=observer_context, domain_id=domain_id)
+    observer = rclpy.create_node("bench_observer", context=observer_context)
+
+    executor = MultiThreadedExecutor()
+    start = time.perf_counter()
+    submodules = create_submodules(executor, WSSender(), shared)
+    startup = time.perf_counter() - start
+
+    nodes = {submodule.node for submodule in submodules}
+    names = {node.get_name() for node in nodes}
+    topics = set()
+    for node in nodes:
+        for get in (
+            node.get_publisher_names_and_types_by_node,
+            node.get_subscriber_names_and_types_by_node,
+        ):
+            topics.update(name for name, _ in get(node.get_name(), "/"))
+
+    # wait until the observer has seen every node and topic
+    discovered = None
+    while time.perf_counter() - start < TIMEOUT:
+        seen_nodes = set(observer.get_node_names())
+        seen_topics = {name for name, _ in observer.get_topic_names_and_types()}
+        if names <= seen_nodes and topics <= seen_topics:
+            discovered = time.perf_counter() - start
+            break
+        await asyncio.sleep(0.001)
+
+    for node in nodes:
+        node.destroy_node()
+    executor.shutdown()
+    observer.destroy_node()
+    rclpy.shutdown(context=observer_context)
+    rclpy.shutdown()
+
+    return startup, discovered or float("nan"), len(nodes), len(topics)
+
+
+async def main():
+    rows = []
+    for mode, domain_id in DOMAINS.items():
+        startup, discovered, nodes, topics = await run_mode(mode == "shared", domain_id)
+        rows.append((mode, startup * 1e3, discovered * 1e3, nodes, topics))
+
+    print_table(("mode", "startup ms", "discovered ms", "nodes", "topics"), rows)
@@ -0,0 +1,185 @@
+"""
+Replays a GPS track through the PositionPredictor and compares its error with
+just holding the last fix, which is what the antenna got before.
+
+By default a synthetic track is generated: the rover drives a loop of curves
+at a few m/s with a noisy 1 Hz GPS. Like on the rover, the fix reaches the
+predictor through 10 Hz feedback that repeats it until the next one. The
+table also shows what feeding every feedback to the filter as a new fix
+would give. Set PREDICTOR_TRACK to a CSV file with `t,lat,lon` columns
+(seconds, degrees) to replay a recorded track, e.g. recorded feedback,
+instead. For recorded tracks the truth between fixes is unknown, so both are
+scored by how far their position just before each new fix is from that fix.
+"""
+
+from typing import *
+import csv
+import math
+import os
+import random
+import time
+import numpy as np
+from util.position_predictor import PositionPredictor, EARTH_RADIUS
+from .bench_util import print_table
+
+GPS_RATE = 1.0
+FEEDBACK_RATE = 10.0
+PREDICTION_RATE = 10.0
+GPS_NOISE = 1.5
+ORIGIN = (38.406, -110.792)
+
+
+def synthetic_track(
+    seconds: float = 600.0, rate: float = 100.0
+) -> List[Tuple[float, float, float]]:
+    """
+    Ground truth (t, lat, lon) of a rover driving varying arcs.
+    """
+    random.seed(0)
+    out = []
+    east = north = 0.0
+    heading = 0.0
+    speed = 2.0
+    turn_rate = 0.0
+    dt = 1 / rate
+    for i in range(int(seconds * rate)):
+        if i % int(rate * 10) == 0:
+            speed = random.uniform(0.5, 3.0)
+            turn_rate = random.uniform(-0.15, 0.15)
+        heading += turn_rate * dt
+        east += speed * math.sin(heading) * dt
+        north += speed * math.cos(heading) * dt
+        out.append((i * dt, *to_global(east, north)))
+    return out
+
+
+def to_global(east: float, north: float) -> Tuple[float, float]:
+    lat = ORIGIN[0] + math.degrees(north / EARTH_RADIUS)
+    lon = ORIGIN[1] + math.degrees(
+        east / (EARTH_RADIUS * math.cos(math.radians(ORIGIN[0])))
+    )
+    return lat, lon
+
+
+def distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """
+    Equirectangular distance in meters, plenty for a few km.
+    """
+    north = math.radians(a[0] - b[0]) * EARTH_RADIUS
+    east = math.radians(a[1] - b[1]) * EARTH_RADIUS * math.cos(math.radians(ORIGIN[0]))
+    return math.hypot(east, north)
+
+
+def feedback(lat: float, lon: float) -> Dict[str, Any]:
+    """
+    The parts of CoreFeedbackData the predictor reads, in to_dict form.
+    """
+    return {
+        "gps_lat": lat,
+        "gps_long": lon,
+        "orientation": 0.0,
+        "bno_accel": {"x": 0.0, "y": 0.0},
+    }
+
+
+def load_track(path: str) -> List[Tuple[float, float, float]]:
+    with open(path) as f:
+        return [
+            (float(r["t"]), float(r["lat"]), float(r["lon"])) for r in csv.DictReader(f)
+        ]
+
+
+def score_synthetic(truth: List[Tuple[float, float, float]]):
+    """
+    Sample noisy fixes from the truth, feed them through feedback that
+    repeats them, and score every prediction tick against the truth.
+    """
+    random.seed(1)
+    rate = round(1 / (truth[1][0] - truth[0][0]))
+    gps_every = int(rate / GPS_RATE)
+    feedback_every = int(rate / FEEDBACK_RATE)
+    tick_every = int(rate / PREDICTION_RATE)
+    meters = math.degrees(1 / EARTH_RADIUS)
+
+    predictor = PositionPredictor(gps_noise=GPS_NOISE)
+    # takes every feedback as a new fix
+    naive = PositionPredictor(gps_noise=GPS_NOISE)
+    last_fix = None
+    errors: Dict[str, List[float]] = {
+        "hold last fix": [],
+        "predicted": [],
+        "every feedback": [],
+    }
+    update_ns, predict_ns = [], []
+    for i, (t, lat, lon) in enumerate(truth):
+        if i % gps_every == 0:
+            last_fix = (
+                lat + random.gauss(0, GPS_NOISE) * meters,
+                lon + random.gauss(0, GPS_NOISE) * meters,
+            )
+        if i % feedback_every == 0 and last_fix is not None:
+            start = time.perf_counter_ns()
+            predictor.update_feedback(feedback(*last_fix), t)
+            update_ns.append(time.perf_counter_ns() - start)
+            naive.update(*last_fix, t)
+        if i % tick_every == 0 and last_fix is not None:
+            start = time.perf_counter_ns()
+            predicted = predictor.predict(t)
+            predict_ns.append(time.perf_counter_ns() - start)
+            errors["hold last fix"].append(distance(last_fix, (lat, lon)))
+            errors["predicted"].append(distance(predicted, (lat, lon)))
+            errors["every feedback"].append(distance(naive.predict(t), (lat, lon)))
+    return errors, update_ns, predict_ns
+
+
+def score_recorded(track: List[Tuple[float, float, float]]):
+    """
+    Score the position each method would have given just before every new
+    fix. Rows that repeat the last fix, as feedback does, aren't scored.
+    """
+    predictor = PositionPredictor()
+    errors: Dict[str, List[float]] = {"hold last fix": [], "predicted": []}
+    update_ns, predict_ns = [], []
+    last_fix = None
+    for t, lat, lon in track:
+        if last_fix is not None:
+            start = time.perf_counter_ns()
+            predicted = predictor.predict(t)
+            predict_ns.append(time.perf_counter_ns() - start)
+        start = time.perf_counter_ns()
+        new_fix = predictor.update_feedback(feedback(lat, lon), t)
+        update_ns.append(time.perf_counter_ns() - start)
+        if new_fix:
+            if last_fix is not None:
+                errors["hold last fix"].append(distance(last_fix, (lat, lon)))
+                errors["predicted"].append(distance(predicted, (lat, lon)))
+            last_fix = (lat, lon)
+    return errors, update_ns, predict_ns
+
+
+async def main():
+    path = os.environ.get("PREDICTOR_TRACK")
+    if path:
+        print(f"replaying {path}")
+        errors, update_ns, predict_ns = score_recorded(load_track(path))
+    else:
+        print("replaying synthetic track")
+        errors, update_ns, predict_ns = score_synthetic(synthetic_track())
+
+    rows = []
+    for name, method_errors in errors.items():
+        method_errors = np.array(method_errors)
+        rows.append(
+            (
+                name,
+                float(np.mean(method_errors)),
+                float(np.percentile(method_errors, 95)),
+                float(np.max(method_errors)),
+            )
+        )
+    print_table(("position", "mean err m", "p95 err m", "max err m"), rows)
+    print()
+    print(
+        f"update {np.median(update_ns) / 1e3:.1f} us, "
+        f"predict {np.median(predict_ns) / 1e3:.1f} us (median)"
+    )
@@ -0,0 +1,28 @@
+from typing import *
+import timeit
+
+# ANSI escape codes for bold and reset
+BOLD = "\033[1m"
+END = "\033[0m"
+
+
+def ns_per_call(fn: Callable[[], Any], repeat: int = 5) -> float:
+    """
+    Time a function, returning the best observed nanoseconds per call.
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def print_table(header: Sequence[str], rows: Iterable[Sequence[Any]]):
+    """
+    Print a simple aligned table.
+    """
+    print(BOLD + "".join(f"{h:>16s}" for h in header) + END)
+    for row in rows:
+        print(
+            "".join(
+                f"{v:>16.1f}" if isinstance(v, float) else f"{v!s:>16s}" for v in row
+            )
+        )
@@ -0,0 +1,33 @@
+"""
+Runs one of the backend micro-benchmarks, e.g. `poetry run benchmark dispatch`.
+"""
+
+import argparse
+import importlib
+
+# benchmark name -> description, implemented in tests/bench_<name>.py
+BENCHMARKS = {
+    "dispatch": "message type lookup cost as more types are registered",
+    "decode": "compiled websocket message validation against the old spec loop",
+    "encode": "fused ROS-to-JSON feedback encoding against from_ros + to_json",
+    "executor": "idle CPU and callback-to-websocket latency of the ROS spin loop",
+    "nodes": "startup and discovery time with one node per submodule vs a shared node",
+    "predictor": "antenna position prediction error on a replayed GPS track",
+    "downsample": "min/max/mean bucketing of a long mission, raw vs cached pyramid",
+    "delta": "bytes saved by delta encoded feedback frames",
+    "encodings": "size and cost of JSON, positional array and packed frames",
+    "ingress": "control frame to ROS message, JSON text vs packed binary",
+}
+
+
+async def main(args=None):
+    parser = argparse.ArgumentParser(description="Run a backend benchmark")
+    parser.add_argument(
+        "benchmark",
+        choices=sorted(BENCHMARKS),
+        help="; ".join(f"{k}: {v}" for k, v in sorted(BENCHMARKS.items())),
+    )
+    args = parser.parse_args(args=args)
+
+    module = importlib.import_module(f".bench_{args.benchmark}", __package__)
+    await module.main()
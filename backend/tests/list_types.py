@@ -1,4 +1,4 @@
-from util.websocket_types import types
+from util.websocket_types import registry
 
 # ANSI escape codes for bold and reset
 BOLD = "\033[1m"
@@ -8,10 +8,13 @@ MAGENTA = "\033[95m"
 
 
 async def main():
-    for t in types:
-        print(f'{BOLD}{t.__name__:22s}{END}{GREEN}"{t.msg_type}"{END}')
-        spec = list(t.spec)
-        spec.sort(key=lambda x: x.field)
-        for entry in spec:
-            print(f"  {entry.field:20s}{MAGENTA}{entry.field_type.__name__}{END}")
+    schema = registry.schema()
+    print(f"{BOLD}schema v{schema['version']} {schema['hash']}{END}\n")
+    for t in schema["types"]:
+        packed = f"  packed {t['packed']}" if t["packed"] else ""
+        print(
+            f'{BOLD}{t["id"]:<3d}{t["name"]:22s}{END}{GREEN}"{t["type"]}"{END}{packed}'
+        )
+        for entry in t["fields"]:
+            print(f"     {entry['name']:20s}{MAGENTA}{entry['type']}{END}")
         print()
@@ -0,0 +1,178 @@
+#!/bin/env python
+
+"""
+Replays a session recorded with RECORD_DIR, either to websocket clients (acting
+as the backend) or onto the ROS topics (acting as the rover and clients).
+"""
+
+from typing import *
+from fnmatch import fnmatchcase
+import argparse
+import asyncio
+import datetime
+import logging
+import time
+from aiohttp import web
+from util import websocket_types
+from util.aiohttp_utils import WSSender, SlowClientPolicy
+from util.telemetry_recorder import Recording
+
+LOG = logging.getLogger(__name__)
+
+
+def now_ms() -> int:
+    return int(datetime.datetime.now().timestamp() * 1000)
+
+
+async def replay(
+    recording: Recording,
+    send: Callable[
+        [Type[websocket_types.WebsocketData], str, Dict[str, Any], int], None
+    ],
+    speed: float,
+    start: Optional[int],
+    end: Optional[int],
+    topics: List[str],
+):
+    """
+    Feed the recorded messages to send, paced like they were recorded.
+
+    :param speed: float
+        Playback speed, e.g. 2 for twice as fast. 0 replays as fast as possible.
+    """
+    offset: Optional[int] = None
+    replay_start = time.monotonic()
+    sent = 0
+    for timestamp, topic, data in recording.messages(start, end, topics):
+        ws_type = websocket_types.registry.lookup(topic)
+        if ws_type is None:
+            continue
+
+        # shift timestamps so the replay looks live
+        if offset is None:
+            offset = now_ms() - timestamp
+            first = timestamp
+        if speed > 0:
+            due = replay_start + (timestamp - first) / 1000 / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif sent % 1000 == 0:
+            # let the websockets drain
+            await asyncio.sleep(0)
+
+        send(ws_type, topic, data, timestamp + offset)
+        sent += 1
+    LOG.info(f"replayed {sent} messages")
+
+
+async def replay_ws(recording: Recording, port: int, **kwargs):
+    """
+    Serve /api/ws like the backend and replay once the first client connects.
+    """
+    # replaying as fast as possible easily outruns the client, so give it
+    # room rather than coalescing frames away
+    ws_sender = WSSender(max_queue=100000, policy=SlowClientPolicy.DROP_OLDEST)
+    connected = asyncio.Event()
+    routes = web.RouteTableDef()
+
+    @routes.get("/api/ws")
+    async def handle_ws(request: web.BaseRequest) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=3)
+        await ws.prepare(request)
+        ws_sender.add(ws, request.remote)
+        connected.set()
+        async for _ in ws:
+            pass
+        ws_sender.remove(ws)
+        return ws
+
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host="0.0.0.0", port=port).start()
+    sender = asyncio.create_task(ws_sender.loop())
+
+    LOG.info(f"waiting for a client on port {port}")
+    await connected.wait()
+    await replay(
+        recording,
+        lambda ws_type, topic, data, timestamp: ws_sender.post(
+            ws_type.encode_dict(data, timestamp, topic), topic
+        ),
+        **kwargs,
+    )
+    # let the clients catch up before hanging up
+    await asyncio.sleep(0.1)
+    while any(client["depth"] for client in ws_sender.stats()):
+        await asyncio.sleep(0.1)
+    await ws_sender.close()
+    sender.cancel()
+    await runner.cleanup()
+
+
+async def replay_ros(recording: Recording, **kwargs):
+    """
+    Publish the recorded messages on the ROS topics they came from or went to.
+    """
+    import rclpy
+
+    rclpy.init()
+    node = rclpy.create_node("replay")
+    publishers = {}
+
+    def publish(ws_type, topic, data, timestamp):
+        if ws_type.ros_type is None:
+            return
+        publisher = publishers.get(topic)
+        if publisher is None:
+            publisher = node.create_publisher(ws_type.ros_type, topic, 10)
+            publishers[topic] = publisher
+        publisher.publish(
+            ws_type.from_dict(data, msg_type=topic, msg_timestamp=timestamp).to_ros()
+        )
+
+    try:
+        await replay(recording, publish, **kwargs)
+    finally:
+        node.destroy_node()
+        rclpy.shutdown()
+
+
+async def main(args=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded session")
+    parser.add_argument("recording", help="session directory written by RECORD_DIR")
+    parser.add_argument(
+        "--to",
+        choices=("ws", "ros"),
+        default="ws",
+        help="replay to websocket clients or onto ROS topics",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="playback speed, 0 for as fast as possible",
+    )
+    parser.add_argument("--start", type=int, help="start timestamp in milliseconds")
+    parser.add_argument("--end", type=int, help="end timestamp in milliseconds")
+    parser.add_argument(
+        "--topics", nargs="*", default=["*"], help="topic glob patterns to replay"
+    )
+    parser.add_argument("--port", type=int, default=5000, help="websocket port")
+    args = parser.parse_args(args=args)
+
+    recording = Recording(args.recording)
+    topics = [
+        topic
+        for topic in recording.topics
+        if any(fnmatchcase(topic, pattern) for pattern in args.topics)
+    ]
+    LOG.info(f"replaying {', '.join(topics)}")
+
+    options = dict(speed=args.speed, start=args.start, end=args.end, topics=topics)
+    if args.to == "ws":
+        await replay_ws(recording, args.port, **options)
+    else:
+        await replay_ros(recording, **options)
@@ -0,0 +1,70 @@
+"""
+Checks that ClockOffset keeps judging messages by their delay when the client's
+clock steps, so a clock correction doesn't get every command expired.
+
+Run with `python -m unittest tests.test_control_mailbox`.
+"""
+
+from typing import *
+import unittest
+from util.control_mailbox import ClockOffset
+
+# 50 Hz frames
+PERIOD = 20
+
+
+class TestClockOffset(unittest.TestCase):
+    def setUp(self):
+        self.clock = ClockOffset(step=0.5, settle=1.0)
+        self.now = 1_000_000
+        # the client's clock is an hour behind ours
+        self.client = self.now - 3_600_000
+
+    def send(self, count: int) -> List[int]:
+        """
+        Send count frames at 50 Hz that arrive without delay, and get their
+        ages.
+        """
+        ages = []
+        for _ in range(count):
+            self.now += PERIOD
+            self.client += PERIOD
+            ages.append(self.clock.age(self.client, self.now))
+        return ages
+
+    def test_steady(self):
+        self.assertEqual(max(self.send(100)), 0)
+
+    def test_stall_burst(self):
+        self.send(50)
+        # frames held up for 2 s arrive at once, oldest first
+        ages = [
+            self.clock.age(self.client + PERIOD * i, self.now + 2000)
+            for i in range(1, 101)
+        ]
+        self.now += 2000
+        self.client += PERIOD * 100
+        self.assertGreater(ages[0], 1500)
+        self.assertEqual(self.clock.steps, 0)
+        # and the link is back to normal afterwards
+        self.assertEqual(max(self.send(50)), 0)
+
+    def test_clock_stepped_back(self):
+        self.send(50)
+        self.client -= 2000
+        ages = self.send(100)
+        self.assertEqual(self.clock.steps, 1)
+        # late until the step is told apart from a stall, fine after that
+        late = [age for age in ages if age > 500]
+        self.assertLessEqual(len(late), 1000 // PERIOD + 1)
+        self.assertEqual(max(ages[len(late) :]), 0)
+
+    def test_clock_stepped_forward(self):
+        self.send(50)
+        self.client += 2000
+        self.assertEqual(max(self.send(100)), 0)
+        self.assertEqual(self.clock.steps, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Checks that button actions survive the control mailbox: controller frames are
+mapped one by one before their commands are coalesced, so a press and release
+that arrive in the same burst still fire.
+
+Run with `python -m unittest tests.test_gamepad_mapping`.
+"""
+
+from typing import *
+import asyncio
+import unittest
+from util.control_mailbox import ControlMailbox
+from util.gamepad_mapping import DEFAULT_PROFILES, GamepadMapper
+from util.websocket_types import ControllerStateData, WebsocketData
+
+CONTROLLER = ControllerStateData.msg_type + "1"
+
+
+def frame(timestamp: int, **pressed: bool) -> ControllerStateData:
+    """
+    A controller frame with the given buttons pressed and sticks at rest.
+    """
+    data = {entry.field: entry.field_type() for entry in ControllerStateData._fields}
+    data.update(pressed)
+    return ControllerStateData.from_dict(
+        data, msg_type=CONTROLLER, msg_timestamp=timestamp
+    )
+
+
+class TestEdgesThroughMailbox(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.mapper = GamepadMapper(DEFAULT_PROFILES, {"controller1": ["arm", "drive"]})
+        self.delivered: List[WebsocketData] = []
+        self.mailbox = ControlMailbox(self.delivered.append, max_age=0)
+
+    async def burst(self, *frames: ControllerStateData) -> Dict[str, Dict[str, Any]]:
+        """
+        Map frames the way the app does, all before the mailbox flushes, and
+        get the delivered commands by topic.
+        """
+        self.delivered.clear()
+        for controller_frame in frames:
+            for command in self.mapper.map(controller_frame):
+                self.mailbox.put(command)
+        # let the flush scheduled by the first put run
+        await asyncio.sleep(0)
+        return {command.msg_type: command.to_dict() for command in self.delivered}
+
+    async def test_toggle_in_one_burst(self):
+        commands = await self.burst(frame(0, a=True), frame(20))
+        self.assertEqual(commands["/arm/control/manual"]["laser"], 1)
+        self.assertEqual(self.mailbox.coalesced["/arm/control/manual"], 1)
+
+        # and pressing it again in another burst toggles it back
+        commands = await self.burst(frame(40, a=True), frame(60))
+        self.assertEqual(commands["/arm/control/manual"]["laser"], 0)
+
+    async def test_step_in_one_burst(self):
+        default = DEFAULT_PROFILES["drive"]["defaults"]["max_speed"]
+        commands = await self.burst(
+            frame(0, d_up=True), frame(20), frame(40, d_up=True), frame(60)
+        )
+        self.assertEqual(commands["/core/control"]["max_speed"], default + 20)
+
+    async def test_hold_follows_last_frame(self):
+        commands = await self.burst(frame(0, b=True), frame(20))
+        self.assertFalse(commands["/core/control"]["brake"])
+        commands = await self.burst(frame(40), frame(60, b=True))
+        self.assertTrue(commands["/core/control"]["brake"])
+
+
+if __name__ == "__main__":
+    unittest.main()
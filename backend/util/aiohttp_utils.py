@@ -1,8 +1,14 @@
-from aiohttp import web
+from aiohttp import web, WSMsgType
 from typing import *
+from collections import deque
+from enum import Enum
+from fnmatch import fnmatchcase
 import asyncio
 import logging
-import traceback
+import secrets
+import struct
+from util.websocket_types import ResumeData, WebsocketData, registry
+from util.delta import DeltaEncoder
 
 LOG = logging.getLogger(__name__)
 
@@ -25,33 +31,530 @@ def file_route(table: web.RouteTableDef, route: str, path: str):
         return web.FileResponse(path)
 
 
+class SlowClientPolicy(Enum):
+    """
+    What to do when a client's outbound queue is full.
+    """
+
+    # drop the oldest queued frame to make room
+    DROP_OLDEST = "drop_oldest"
+    # collapse the queue to the newest frame of each topic, then drop oldest
+    LATEST_PER_TOPIC = "latest_per_topic"
+    # give up on the client and close its connection
+    DISCONNECT = "disconnect"
+
+
+class Encoding(Enum):
+    """
+    How feedback is encoded for a client, chosen with ?encoding= when it
+    connects. See util.websocket_types.TypeRegistry.schema for the positional
+    encodings.
+    """
+
+    # JSON objects
+    JSON = "json"
+    # JSON objects, as deltas against keyframes where possible, see util.delta
+    DELTA = "delta"
+    # JSON arrays: [seq, type id, timestamp, values...] in schema order
+    ARRAY = "array"
+    # binary frames: u64 seq, PACKED_HEADER and the values for all-numeric
+    # types, ARRAY for the rest
+    PACKED = "packed"
+
+
+# packed frames to clients start with their sequence number
+PACKED_SEQ = struct.Struct("<Q")
+
+
+class Frame:
+    """
+    A message encoded once and shared by every client it is sent to.
+
+    :param text: str
+        The message to send, a JSON object.
+    :param topic: Optional[str]
+        The message type, used to coalesce frames of the same topic.
+    """
+
+    __slots__ = "topic", "data", "seq", "key", "keyframe", "delta", "array", "packed"
+
+    def __init__(self, text: str, topic: Optional[str] = None):
+        self.topic = topic
+        self.data = text.encode()
+        self.seq: Optional[int] = None
+
+        # delta encoding, see util.delta: the keyframe this frame is relative
+        # to (itself for keyframes) and the delta encoded version
+        self.key: Optional[int] = None
+        self.keyframe: Optional[Frame] = None
+        self.delta: Optional[bytes] = None
+
+        # positional encodings, only for frames posted with post_data while a
+        # client wants them
+        self.array: Optional[bytes] = None
+        self.packed: Optional[bytes] = None
+
+    @staticmethod
+    def _prefix(data: bytes, key: str, value: int) -> bytes:
+        if data[:1] == b"{" and data[1:2] != b"}":
+            return b'{"%s":%d,' % (key.encode(), value) + data[1:]
+        return data
+
+    def stamp(self, seq: int):
+        """
+        Number the frame by adding a "seq" key to the front of its JSON object.
+        """
+        self.seq = seq
+        self.data = self._prefix(self.data, "seq", seq)
+        if self.delta is not None:
+            self.delta = self._prefix(self.delta, "seq", seq)
+        if self.array is not None:
+            self.array = b"[%d," % seq + self.array[1:]
+        if self.packed is not None:
+            self.packed = PACKED_SEQ.pack(seq) + self.packed
+
+    def make_keyframe(self, key: int):
+        """
+        Mark the frame as the keyframe with the given id.
+        """
+        self.key = key
+        self.keyframe = self
+        self.data = self._prefix(self.data, "key", key)
+
+
+class ClientQueue:
+    """
+    Bounded outbound queue and sender task for a single websocket, so a slow
+    client only ever delays itself.
+
+    :param ws: web.WebSocketResponse
+        The websocket to send to.
+    :param name: str
+        Name to use for the client in logs and stats, e.g. its remote address.
+    :param max_size: int
+        The most frames to hold before applying the policy.
+    :param policy: SlowClientPolicy
+        What to do when the queue is full.
+    :param compress: Optional[int]
+        The compression level to use when sending messages.
+    :param encoding: Encoding
+        How to encode frames that have more than one encoding. Frames that
+        don't have the client's encoding are sent as JSON.
+    """
+
+    def __init__(
+        self,
+        ws: web.WebSocketResponse,
+        name: str,
+        max_size: int,
+        policy: SlowClientPolicy,
+        compress: Optional[int] = None,
+        encoding: Encoding = Encoding.JSON,
+    ):
+        self.ws = ws
+        self.name = name
+        self.max_size = max_size
+        self.policy = policy
+        self.compress = compress
+        self.encoding = encoding
+        # topic -> the last keyframe sent, which deltas can be applied to
+        self._keyframes: Dict[str, Frame] = {}
+
+        self._pending: Deque[Frame] = deque()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # glob patterns of the topics this client wants, None for everything
+        self.topics: Optional[Set[str]] = None
+        # glob patterns unsubscribed from broader topics, which win over
+        # topics, e.g. "/core/*" from everything
+        self.excluded: Set[str] = set()
+
+        # rate limits as glob pattern -> max Hz, resolved per topic on first use
+        self.rates: Dict[str, float] = {}
+        self._intervals: Dict[str, float] = {}
+        # newest frame of each rate limited topic waiting for its slot
+        self._held: Dict[str, Frame] = {}
+        self._next_send: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+        # stats
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.bytes_sent = 0
+        self.deltas_sent = 0
+
+    def start(self):
+        """
+        Start the sender task. Must be called from the event loop.
+        """
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        """
+        Stop the sender task, discarding anything still queued.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._held.clear()
+        self._pending.clear()
+
+    @property
+    def closed(self) -> bool:
+        return self.ws.closed or self._task is None or self._task.done()
+
+    def wants(self, topic: Optional[str]) -> bool:
+        """
+        Check if the client is subscribed to a topic. Frames without a topic
+        go to everyone.
+        """
+        if topic is None:
+            return True
+        if any(fnmatchcase(topic, pattern) for pattern in self.excluded):
+            return False
+        if self.topics is None:
+            return True
+        return any(fnmatchcase(topic, pattern) for pattern in self.topics)
+
+    def set_rate(self, pattern: str, rate: float):
+        """
+        Limit how often topics matching a pattern are sent to this client.
+        Frames that arrive too soon replace each other, and the newest one is
+        sent when the topic's next slot comes up.
+
+        :param pattern: str
+            Glob pattern of the topics to limit, e.g. "/core/feedback".
+        :param rate: float
+            Maximum frames per second, 0 to remove the limit.
+        """
+        if rate > 0:
+            self.rates[pattern] = rate
+        else:
+            self.rates.pop(pattern, None)
+        self._intervals.clear()
+
+    def _interval(self, topic: str) -> float:
+        """
+        Get the minimum seconds between frames of a topic, 0 if unlimited. The
+        most restrictive matching pattern wins.
+        """
+        interval = self._intervals.get(topic)
+        if interval is None:
+            rates = [r for p, r in self.rates.items() if fnmatchcase(topic, p)]
+            interval = 1 / min(rates) if rates else 0.0
+            self._intervals[topic] = interval
+        return interval
+
+    def put(self, frame: Frame) -> bool:
+        """
+        Queue a frame for sending without waiting, honoring rate limits.
+
+        :param frame: Frame
+            The frame to queue.
+        :return: bool
+            False if the client can't keep up and is being disconnected.
+        """
+        topic = frame.topic
+        if topic is None or not self.rates:
+            return self._enqueue(frame)
+
+        interval = self._interval(topic)
+        if not interval:
+            return self._enqueue(frame)
+
+        now = asyncio.get_running_loop().time()
+        if topic not in self._held and now >= self._next_send.get(topic, 0.0):
+            self._next_send[topic] = now + interval
+            return self._enqueue(frame)
+
+        # too soon, hold on to it until the topic's next slot
+        if topic in self._held:
+            self.coalesced += 1
+        else:
+            self._timers[topic] = asyncio.get_running_loop().call_at(
+                self._next_send[topic], self._flush, topic
+            )
+        self._held[topic] = frame
+        return True
+
+    def _flush(self, topic: str):
+        """
+        Send the frame held back for a rate limited topic.
+        """
+        self._timers.pop(topic, None)
+        frame = self._held.pop(topic, None)
+        if frame is None:
+            return
+        self._next_send[topic] = asyncio.get_running_loop().time() + self._interval(
+            topic
+        )
+        self._enqueue(frame)
+
+    def _enqueue(self, frame: Frame) -> bool:
+        if len(self._pending) >= self.max_size:
+            if self.policy == SlowClientPolicy.DISCONNECT:
+                LOG.warning(f"Disconnecting {self.name}, it can't keep up")
+                self.stop()
+                asyncio.get_running_loop().create_task(self.ws.close())
+                return False
+            if self.policy == SlowClientPolicy.LATEST_PER_TOPIC:
+                self._coalesce()
+            # still full (or not coalescing), so make room the hard way
+            while len(self._pending) >= self.max_size:
+                self._pending.popleft()
+                self.dropped += 1
+
+        self._pending.append(frame)
+        self.max_depth = max(self.max_depth, len(self._pending))
+        self._ready.set()
+        return True
+
+    def _coalesce(self):
+        """
+        Keep only the newest queued frame of each topic, preserving order.
+        """
+        seen: Set[Optional[str]] = set()
+        kept: Deque[Frame] = deque()
+        for frame in reversed(self._pending):
+            # frames without a topic can't be coalesced
+            if frame.topic is None or frame.topic not in seen:
+                seen.add(frame.topic)
+                kept.appendleft(frame)
+        self.dropped += len(self._pending) - len(kept)
+        self._pending = kept
+
+    async def _run(self):
+        while not self.ws.closed:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._pending and not self.ws.closed:
+                frame = self._pending.popleft()
+                data, msg_type = self._encode(frame)
+                try:
+                    await self.ws.send_frame(data, msg_type, compress=self.compress)
+                    self.sent += 1
+                    self.bytes_sent += len(data)
+                except Exception as e:
+                    LOG.error(f"Error sending message to {self.name}: {e}")
+                    return
+
+    def _encode(self, frame: Frame) -> Tuple[bytes, WSMsgType]:
+        """
+        Pick the client's encoding of a frame.
+        """
+        if self.encoding == Encoding.DELTA and frame.keyframe is not None:
+            if frame.keyframe is frame:
+                self._keyframes[frame.topic] = frame
+            elif self._keyframes.get(frame.topic) is frame.keyframe:
+                self.deltas_sent += 1
+                return frame.delta, WSMsgType.TEXT
+            # otherwise it never got the keyframe (it was dropped or sent
+            # before the client connected), so send it all
+        elif self.encoding == Encoding.PACKED and frame.packed is not None:
+            return frame.packed, WSMsgType.BINARY
+        elif (
+            self.encoding in (Encoding.ARRAY, Encoding.PACKED)
+            and frame.array is not None
+        ):
+            # packed clients get arrays for types that can't be packed
+            return frame.array, WSMsgType.TEXT
+        return frame.data, WSMsgType.TEXT
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "client": self.name,
+            "topics": ["*"] if self.topics is None else sorted(self.topics),
+            "excluded": sorted(self.excluded),
+            "policy": self.policy.value,
+            "depth": len(self._pending),
+            "max_depth": self.max_depth,
+            "capacity": self.max_size,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "rates": dict(self.rates),
+            "coalesced": self.coalesced,
+            "encoding": self.encoding.value,
+            "bytes_sent": self.bytes_sent,
+            "deltas_sent": self.deltas_sent,
+        }
+
+
 class WSSender:
     """
     Handles sending messages to multiple websockets.
 
+    Every message is encoded into a Frame once and queued for each client,
+    and each client has its own sender task so one slow connection can't hold
+    up the rest.
+
+    Frames are numbered with a "seq" key, and the last replay_size of them are
+    kept so a client that reconnects can resume where it left off instead of
+    starting over. Every new client is first sent a ResumeData saying which
+    session (WSSender instance) and sequence number it is starting at.
+
+    The newest frame of every topic is kept, and new clients that aren't
+    resuming get all of them before any live traffic, so they don't have to
+    wait for slow topics to show something.
+
     :param compress: Optional[int]
         The compression level to use when sending messages.
+    :param max_queue: int
+        How many frames each client may have queued.
+    :param policy: SlowClientPolicy
+        What to do when a client's queue is full.
+    :param snapshot: bool
+        Send new clients the newest frame of every topic.
+    :param replay_size: int
+        How many frames to keep for resuming clients.
+    :param delta: Optional[DeltaEncoder]
+        Encodes deltas of messages sent with post_data for clients that opt
+        in. Without one, those clients get full messages.
     """
 
-    _connections: Set[web.WebSocketResponse] = set()
-    _queue: asyncio.Queue = asyncio.Queue()
-
-    def __init__(self, compress: Optional[int] = None):
+    def __init__(
+        self,
+        compress: Optional[int] = None,
+        max_queue: int = 64,
+        policy: SlowClientPolicy = SlowClientPolicy.LATEST_PER_TOPIC,
+        snapshot: bool = True,
+        replay_size: int = 1024,
+        delta: Optional[DeltaEncoder] = None,
+    ):
         self.compress = compress
+        self.max_queue = max_queue
+        self.policy = policy
+        self.snapshot = snapshot
+
+        self._connections: Dict[web.WebSocketResponse, ClientQueue] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # the event loop that owns the queue, see bind
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # topic -> subscribed clients, filled in as topics are seen and
+        # cleared whenever a client or subscription changes
+        self._subscribers: Dict[Optional[str], List[ClientQueue]] = {}
 
-    def add(self, ws: web.WebSocketResponse) -> bool:
+        # topic -> newest frame, only touched from the event loop
+        self._latest: Dict[str, Frame] = {}
+
+        # sequence numbers only mean something within one session
+        self.session = secrets.token_hex(8)
+        self.seq = 0
+        self._replay: Deque[Frame] = deque(maxlen=replay_size)
+
+        self.delta = delta
+        # topic -> newest keyframe posted
+        self._keyframes: Dict[str, Frame] = {}
+        # extra encodings are only worth making while someone wants them
+        self._encodings: Dict[Encoding, int] = {e: 0 for e in Encoding}
+
+        # stats
+        self.resumed = 0
+        self.resume_misses = 0
+
+    def add(
+        self,
+        ws: web.WebSocketResponse,
+        name: Optional[str] = None,
+        resume: Optional[Tuple[str, int]] = None,
+        encoding: Encoding = Encoding.JSON,
+    ) -> bool:
         """
         Add a websocket to the handler pool.
 
         :param ws: web.WebSocketResponse
             Websocket to add.
+        :param name: Optional[str]
+            Name for the client in logs and stats, e.g. its remote address.
+        :param resume: Optional[Tuple[str, int]]
+            The session and last sequence number a reconnecting client saw.
+            If those frames are still kept, it's sent only the ones it missed
+            instead of the snapshot.
+        :param encoding: Encoding
+            How to encode feedback for the client. Delta encoding falls back
+            to JSON without a DeltaEncoder.
         :return: bool
             True if the websocket was added, False if it was already in the pool.
         """
-        if ws not in self._connections:
-            self._connections.add(ws)
-            return True
-        return False
+        if ws in self._connections:
+            return False
+
+        if encoding == Encoding.DELTA and self.delta is None:
+            encoding = Encoding.JSON
+        client = ClientQueue(
+            ws,
+            name or str(id(ws)),
+            self.max_queue,
+            self.policy,
+            self.compress,
+            encoding,
+        )
+        client.start()
+        self._connections[ws] = client
+        self._subscribers.clear()
+        self._encodings[encoding] += 1
+
+        missed = self._missed(resume) if resume is not None else None
+        if resume is not None:
+            if missed is None:
+                self.resume_misses += 1
+            else:
+                self.resumed += 1
+        status = {
+            "session": self.session,
+            "seq": self.seq,
+            "resumed": missed is not None,
+            "missed": len(missed) if missed is not None else 0,
+            "encoding": encoding.value,
+            "schema": registry.schema()["hash"],
+        }
+        client.put(Frame(ResumeData.encode_dict(status), ResumeData.msg_type))
+
+        if missed is None:
+            self._send_snapshot(client)
+        else:
+            for frame in missed:
+                if client.wants(frame.topic):
+                    client.put(frame)
+        return True
+
+    def _missed(self, resume: Tuple[str, int]) -> Optional[List[Frame]]:
+        """
+        Get the frames after a session and sequence number, or None if some of
+        them are no longer kept.
+        """
+        session, seq = resume
+        if session != self.session or seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        if not self._replay or self._replay[0].seq > seq + 1:
+            return None
+        # sequence numbers are consecutive, so the first missed one is at
+        return list(self._replay)[seq + 1 - self._replay[0].seq :]
+
+    def _send_snapshot(
+        self, client: ClientQueue, skip: Callable[[str], bool] = lambda _: False
+    ):
+        """
+        Queue the newest frame of every topic the client wants.
+
+        :param client: ClientQueue
+            The client to send to.
+        :param skip: Callable[[str], bool]
+            Topics to leave out, e.g. ones the client already had.
+        """
+        if not self.snapshot:
+            return
+        for topic, frame in self._latest.items():
+            if client.wants(topic) and not skip(topic):
+                client.put(frame)
 
     def remove(self, ws: web.WebSocketResponse) -> bool:
         """
@@ -62,60 +565,247 @@ class WSSender:
         :return: bool
             True if the websocket was removed, False if it was not found.
         """
-        try:
-            self._connections.remove(ws)
-            return True
-        except KeyError:
+        client = self._connections.pop(ws, None)
+        if client is None:
+            return False
+        self._encodings[client.encoding] -= 1
+        client.stop()
+        self._subscribers.clear()
+        return True
+
+    def subscribe(self, ws: web.WebSocketResponse, topics: Iterable[str]) -> bool:
+        """
+        Subscribe a websocket to topics. Clients start out subscribed to every
+        topic; their first subscription replaces that with just the given ones.
+        Subscribing a pattern that was excluded by unsubscribe lifts the
+        exclusion. Topics that weren't subscribed before get their newest frame
+        right away.
+
+        :param ws: web.WebSocketResponse
+            Websocket to subscribe.
+        :param topics: Iterable[str]
+            Glob patterns of topics to receive, e.g. "/arm/*".
+        :return: bool
+            False if the websocket is not in the pool.
+        """
+        client = self._connections.get(ws)
+        if client is None:
+            return False
+
+        topics = set(topics)
+        wanted = {topic for topic in self._latest if client.wants(topic)}
+        if client.topics is None:
+            client.topics = topics
+        else:
+            client.topics.update(topics)
+        client.excluded.difference_update(topics)
+        self._subscribers.clear()
+        self._send_snapshot(client, skip=wanted.__contains__)
+        return True
+
+    def unsubscribe(self, ws: web.WebSocketResponse, topics: Iterable[str]) -> bool:
+        """
+        Unsubscribe a websocket from topics.
+
+        :param ws: web.WebSocketResponse
+            Websocket to unsubscribe.
+        :param topics: Iterable[str]
+            Patterns to remove. Subscribed patterns they cover are removed,
+            and they are excluded from broader ones, so unsubscribing
+            "/core/*" while subscribed to "*" (the default) stops just those.
+            Unsubscribing "*" stops all topics.
+        :return: bool
+            False if the websocket is not in the pool.
+        """
+        client = self._connections.get(ws)
+        if client is None:
+            return False
+
+        if client.topics is None:
+            client.topics = {"*"}
+        for pattern in topics:
+            # drop the subscriptions it covers, and exclude it from the ones
+            # that cover it
+            client.topics = {t for t in client.topics if not fnmatchcase(t, pattern)}
+            if any(fnmatchcase(pattern, t) for t in client.topics):
+                client.excluded.add(pattern)
+        self._subscribers.clear()
+        return True
+
+    def set_rate(self, ws: web.WebSocketResponse, pattern: str, rate: float) -> bool:
+        """
+        Limit how often a websocket receives topics matching a pattern. Only
+        the newest frame of a limited topic is kept between sends.
+
+        :param ws: web.WebSocketResponse
+            Websocket to limit.
+        :param pattern: str
+            Glob pattern of the topics to limit, e.g. "/core/feedback".
+        :param rate: float
+            Maximum frames per second, 0 to remove the limit.
+        :return: bool
+            False if the websocket is not in the pool.
+        """
+        client = self._connections.get(ws)
+        if client is None:
             return False
+        client.set_rate(pattern, rate)
+        return True
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """
+        Set the event loop that sends messages. Messages posted from other
+        threads are handed over to this loop.
+
+        :param loop: asyncio.AbstractEventLoop
+            The loop that will run WSSender.loop.
+        """
+        self._loop = loop
 
-    async def send(self, msg: str):
+    def post(self, msg: str, topic: Optional[str] = None):
+        """
+        Send a message to all handled websockets without waiting. Safe to call
+        from any thread, e.g. ROS executor threads.
+
+        :param msg: str
+            The message to send.
+        :param topic: Optional[str]
+            The message type, used to route and coalesce messages.
+        """
+        # encoding happens on the calling thread, off the event loop
+        self._post_frame(Frame(msg, topic))
+
+    def post_data(
+        self, ws_type: Type[WebsocketData], data: Dict[str, Any], timestamp: int
+    ):
+        """
+        Encode and send a message given in to_dict form, along with the other
+        encodings connected clients want. Safe to call from any thread.
+
+        :param ws_type: Type[WebsocketData]
+            The message type.
+        :param data: Dict[str, Any]
+            The message data in to_dict form.
+        :param timestamp: int
+            The message timestamp in milliseconds.
+        """
+        topic = ws_type.msg_type
+        frame = Frame(ws_type.encode_dict(data, timestamp), topic)
+        if self._encodings[Encoding.PACKED]:
+            frame.packed = registry.encode_packed(ws_type, data, timestamp)
+        if self._encodings[Encoding.ARRAY] or (
+            self._encodings[Encoding.PACKED] and frame.packed is None
+        ):
+            frame.array = registry.encode_array(ws_type, data, timestamp).encode()
+        if self.delta is not None and self._encodings[Encoding.DELTA]:
+            key, delta = self.delta.encode(topic, data, timestamp)
+            if delta is None:
+                frame.make_keyframe(key)
+                self._keyframes[topic] = frame
+            else:
+                keyframe = self._keyframes.get(topic)
+                if keyframe is not None and keyframe.key == key:
+                    frame.keyframe = keyframe
+                    frame.delta = delta.encode()
+        self._post_frame(frame)
+
+    def _post_frame(self, frame: Frame):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if self._loop is None:
+            if running is None:
+                LOG.warning(f"Dropping {frame.topic} message, no event loop to send it")
+                return
+            self._loop = running
+
+        if running is self._loop:
+            self._queue.put_nowait(frame)
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, frame)
+
+    async def send(self, msg: str, topic: Optional[str] = None):
         """
         Send a message to all handled websockets.
 
-        :param msg: bytes
+        :param msg: str
             The message to send.
+        :param topic: Optional[str]
+            The message type, used to route and coalesce messages.
         """
-        await self._queue.put(msg)
+        self.post(msg, topic)
 
     async def loop(self):
         """
         Main loop to send messages to all handled websockets.
         """
+        self.bind(asyncio.get_running_loop())
         while True:
-            await self._send_all(await self._queue.get())
+            self._send_all(await self._queue.get())
 
-    async def _send_all(self, msg: str):
+    def _send_all(self, frame: Frame):
         """
-        Send a message to all handled websockets.
+        Queue a frame for all websockets subscribed to its topic.
 
-        :param msg: bytes
-            The message to send.
+        :param frame: Frame
+            The frame to send.
         """
 
-        # LOG.debug(f"Sending WS message to {len(self._connections)} clients: {msg}")
+        self.seq += 1
+        frame.stamp(self.seq)
+        self._replay.append(frame)
+        if frame.topic is not None:
+            self._latest[frame.topic] = frame
+
+        subscribers = self._subscribers.get(frame.topic)
+        if subscribers is None:
+            subscribers = [
+                client
+                for client in self._connections.values()
+                if client.wants(frame.topic)
+            ]
+            self._subscribers[frame.topic] = subscribers
 
-        # send messages to all connections
+        # queue the frame for all subscribed connections
         to_remove = set()
-        for ws in self._connections:
+        for client in subscribers:
             # if it's closed, keep track of it to remove it
-            if ws.closed:
-                to_remove.add(ws)
+            if client.closed:
+                to_remove.add(client.ws)
                 continue
-            try:
-                await ws.send_str(msg, self.compress)
-            except Exception as e:
-                print(traceback.format_exc())
-                LOG.error(f"Error sending message to {ws}: {e}")
-                to_remove.add(ws)
+            if not client.put(frame):
+                to_remove.add(client.ws)
 
         # remove closed connections
         for ws in to_remove:
             self.remove(ws)
 
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Get queue depth and drop counters for every client.
+        """
+        return [client.stats() for client in self._connections.values()]
+
+    def stream_stats(self) -> Dict[str, Any]:
+        """
+        Get the sequence numbering and resume counters.
+        """
+        return {
+            "session": self.session,
+            "seq": self.seq,
+            "replay_kept": len(self._replay),
+            "replay_size": self._replay.maxlen,
+            "resumed": self.resumed,
+            "resume_misses": self.resume_misses,
+            "encodings": {e.value: n for e, n in self._encodings.items()},
+        }
+
     async def close(self):
         """
         Close all connections.
         """
-        for ws in self._connections:
+        for ws in list(self._connections):
+            self.remove(ws)
             await ws.close()
-        self._connections.clear()
@@ -0,0 +1,181 @@
+from typing import *
+import asyncio
+import datetime
+import logging
+from util.websocket_types import WebsocketData
+
+LOG = logging.getLogger(__name__)
+
+
+def now_ms() -> int:
+    return int(datetime.datetime.now().timestamp() * 1000)
+
+
+class ClockOffset:
+    """
+    Estimates how stale a client's messages are from their timestamps, without
+    the client's clock having to agree with ours.
+
+    Our clock minus a message's timestamp is the clock offset plus however
+    long the message took to get here. The smallest difference seen recently
+    is the offset plus the best case delay, so how far a message is above it
+    is how long it was held up, e.g. queued behind a radio stall. Only the
+    last one to two windows count, so the estimate follows clock drift.
+
+    A client clock that steps backwards (an NTP correction, say) makes every
+    later message look late by the size of the step. A stall only holds up
+    messages until the link recovers, and then they arrive in one burst, so
+    messages that keep arriving more than step late for settle seconds mean
+    the clock stepped, and the estimate starts over from them.
+
+    :param window: float
+        Seconds of messages the smallest difference is taken over.
+    :param step: float
+        Seconds late a message has to be to count towards a clock step.
+    :param settle: float
+        Seconds messages have to keep arriving that late before the estimate
+        is reset.
+    """
+
+    def __init__(self, window: float = 30.0, step: float = 0.5, settle: float = 1.0):
+        self.window_ms = int(window * 1000)
+        self.step_ms = int(step * 1000)
+        self.settle_ms = int(settle * 1000)
+        self._best: Optional[int] = None
+        self._previous: Optional[int] = None
+        self._window_start = 0
+        # when the current run of messages more than step late started
+        self._late_since: Optional[int] = None
+
+        # stats
+        self.steps = 0
+
+    @property
+    def offset(self) -> Optional[int]:
+        """
+        Our clock minus the client's, plus the best case delay, in
+        milliseconds. None until a message has been seen.
+        """
+        if self._previous is None:
+            return self._best
+        if self._best is None:
+            return self._previous
+        return min(self._best, self._previous)
+
+    def age(self, timestamp: int, now: Optional[int] = None) -> int:
+        """
+        Update the estimate with a message and get how much later than the
+        best case it arrived, in milliseconds.
+
+        :param timestamp: int
+            The message timestamp from the client's clock.
+        :param now: Optional[int]
+            When it arrived by our clock, now if not given.
+        """
+        if now is None:
+            now = now_ms()
+        if now - self._window_start >= self.window_ms:
+            self._previous = self._best
+            self._best = None
+            self._window_start = now
+
+        difference = now - timestamp
+        if self._best is None or difference < self._best:
+            self._best = difference
+        age = difference - self.offset
+
+        if age <= self.step_ms:
+            self._late_since = None
+        elif self._late_since is None:
+            self._late_since = now
+        elif now - self._late_since >= self.settle_ms:
+            LOG.info(f"client clock stepped back by about {age} ms")
+            self.steps += 1
+            self._best = difference
+            self._previous = None
+            self._window_start = now
+            self._late_since = None
+            age = 0
+        return age
+
+
+class ControlMailbox:
+    """
+    Latest-wins delivery of control messages, so a burst of frames that piled
+    up behind a stalled link doesn't replay old stick positions one after
+    another.
+
+    Each topic (msg_type) has a slot holding only its newest message. Putting
+    a message replaces whatever is still waiting in its slot, and the slots
+    are delivered once the event loop gets to it, i.e. after every frame that
+    arrived in the same burst has been read. Messages older than max_age are
+    dropped outright.
+
+    Only used from the event loop.
+
+    :param deliver: Callable[[WebsocketData], Any]
+        Called with each message that survives.
+    :param max_age: int
+        Drop messages that arrive more than this many milliseconds later than
+        the best case, see ClockOffset. 0 keeps them all.
+    """
+
+    def __init__(self, deliver: Callable[[WebsocketData], Any], max_age: int = 500):
+        self.deliver = deliver
+        self.max_age = max_age
+        self._slots: Dict[str, WebsocketData] = {}
+        self._scheduled = False
+
+        # stats, per topic
+        self.delivered: Dict[str, int] = {}
+        self.coalesced: Dict[str, int] = {}
+        self.expired: Dict[str, int] = {}
+
+    def put(self, ws_data: WebsocketData, age: int = 0) -> bool:
+        """
+        Queue a message for delivery, replacing any older one of its topic.
+
+        :param ws_data: WebsocketData
+            The message.
+        :param age: int
+            How late it arrived in milliseconds, see ClockOffset.age.
+        :return: bool
+            False if it was too old and dropped.
+        """
+        topic = ws_data.msg_type
+        if self.max_age and age > self.max_age:
+            self.expired[topic] = self.expired.get(topic, 0) + 1
+            LOG.debug(f"dropping {topic} message {age} ms late")
+            return False
+
+        if topic in self._slots:
+            self.coalesced[topic] = self.coalesced.get(topic, 0) + 1
+        self._slots[topic] = ws_data
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+        return True
+
+    def _flush(self):
+        self._scheduled = False
+        slots, self._slots = self._slots, {}
+        for topic, ws_data in slots.items():
+            self.delivered[topic] = self.delivered.get(topic, 0) + 1
+            try:
+                self.deliver(ws_data)
+            except Exception as e:
+                LOG.error(f"failed to deliver {topic} message: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        topics = sorted({*self.delivered, *self.coalesced, *self.expired})
+        return {
+            "max_age": self.max_age,
+            "topics": {
+                topic: {
+                    "delivered": self.delivered.get(topic, 0),
+                    "coalesced": self.coalesced.get(topic, 0),
+                    "expired": self.expired.get(topic, 0),
+                }
+                for topic in topics
+            },
+        }
@@ -0,0 +1,189 @@
+from typing import *
+import asyncio
+import logging
+import time
+from util.websocket_types import WebsocketData
+
+LOG = logging.getLogger(__name__)
+
+# upper edges of the publish jitter histogram buckets, in milliseconds
+JITTER_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0)
+
+
+def subsystem(topic: str) -> str:
+    """
+    The part of the rover a control topic drives, its first path component,
+    e.g. "arm" for both /arm/control/manual and /arm/control/ik.
+    """
+    return topic.strip("/").split("/")[0]
+
+
+class ControlResampler:
+    """
+    Republishes the newest command of each control topic at a fixed rate, so
+    the rover gets steady commands no matter how unevenly they arrive, and
+    brakes when they stop arriving. The stop command is only republished for
+    a while, then the topic goes quiet so it doesn't override anything else
+    publishing to it. A topic also goes quiet as soon as another topic of the
+    same subsystem gets a command, e.g. when a client switches the arm from
+    manual to IK control.
+
+    Ticks are scheduled against the monotonic clock rather than one period
+    after the last tick, so a late tick doesn't push back the ones after it.
+    Ticks that are missed entirely are skipped and counted. How late each tick
+    runs is kept as a histogram.
+
+    Only used from the event loop.
+
+    :param publish: Callable[[WebsocketData], Any]
+        Called with each command to publish.
+    :param stop_commands: Dict[Type[WebsocketData], Dict[str, Any]]
+        The types to resample, each with the fields (in to_dict form) to
+        override in its newest command to make it stop the rover. Other types
+        are published as they come.
+    :param rate: float
+        Ticks per second. 0 publishes every command as it comes instead.
+    :param timeout: float
+        Seconds without a new command after which a topic's stop command is
+        published instead.
+    :param stop_duration: float
+        Seconds the stop command is republished for before the topic goes
+        quiet.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[WebsocketData], Any],
+        stop_commands: Dict[Type[WebsocketData], Dict[str, Any]],
+        rate: float = 50.0,
+        timeout: float = 1.0,
+        stop_duration: float = 1.0,
+    ):
+        self.publish = publish
+        self.stop_commands = stop_commands
+        self.rate = rate
+        self.timeout = timeout
+        self.stop_duration = stop_duration
+
+        # topic -> newest command and when it arrived
+        self._latest: Dict[str, Tuple[WebsocketData, float]] = {}
+        # topic -> the command a stop command was made from, and the stop command
+        self._stopped: Dict[str, Tuple[WebsocketData, WebsocketData]] = {}
+
+        # stats
+        self.ticks = 0
+        self.missed = 0
+        self.published: Dict[str, int] = {}
+        self.stops: Dict[str, int] = {}
+        self.retired: Dict[str, int] = {}
+        self.jitter = [0] * (len(JITTER_BUCKETS) + 1)
+        self.max_jitter = 0.0
+
+    def update(self, ws_data: WebsocketData):
+        """
+        Take a new command from a client.
+        """
+        if self.rate <= 0 or type(ws_data) not in self.stop_commands:
+            self._publish(ws_data)
+            return
+        topic = ws_data.msg_type
+        for other in [
+            other
+            for other in self._latest
+            if other != topic and subsystem(other) == subsystem(topic)
+        ]:
+            LOG.info(f"{topic} took over from {other}")
+            self._retire(other)
+        self._latest[topic] = (ws_data, time.monotonic())
+
+    def _retire(self, topic: str):
+        del self._latest[topic]
+        self._stopped.pop(topic, None)
+        self.retired[topic] = self.retired.get(topic, 0) + 1
+
+    def _publish(self, ws_data: WebsocketData):
+        topic = ws_data.msg_type
+        self.published[topic] = self.published.get(topic, 0) + 1
+        try:
+            self.publish(ws_data)
+        except Exception as e:
+            LOG.error(f"failed to publish {topic}: {e}")
+
+    def _stop_command(self, ws_data: WebsocketData) -> WebsocketData:
+        stopped = self._stopped.get(ws_data.msg_type)
+        if stopped is not None and stopped[0] is ws_data:
+            return stopped[1]
+        stop = type(ws_data).from_dict(
+            {**ws_data.to_dict(), **self.stop_commands[type(ws_data)]},
+            msg_type=ws_data.msg_type,
+        )
+        self._stopped[ws_data.msg_type] = (ws_data, stop)
+        self.stops[ws_data.msg_type] = self.stops.get(ws_data.msg_type, 0) + 1
+        LOG.warning(f"no {ws_data.msg_type} command for {self.timeout} s, stopping")
+        return stop
+
+    def tick(self, now: float):
+        """
+        Publish the newest command of every topic, or its stop command if it
+        is too old, or nothing once that has been published long enough.
+        """
+        self.ticks += 1
+        for topic, (ws_data, arrived) in list(self._latest.items()):
+            quiet = now - arrived
+            if quiet > self.timeout + self.stop_duration:
+                LOG.info(f"no {topic} command for {quiet:.1f} s, going quiet")
+                self._retire(topic)
+                continue
+            if quiet > self.timeout:
+                ws_data = self._stop_command(ws_data)
+            self._publish(ws_data)
+
+    def _observe(self, late: float):
+        late_ms = late * 1000
+        self.max_jitter = max(self.max_jitter, late_ms)
+        for i, edge in enumerate(JITTER_BUCKETS):
+            if late_ms <= edge:
+                self.jitter[i] += 1
+                return
+        self.jitter[-1] += 1
+
+    async def loop(self):
+        """
+        Tick at the configured rate until cancelled.
+        """
+        if self.rate <= 0:
+            return
+        period = 1 / self.rate
+        next_tick = time.monotonic()
+        while True:
+            next_tick += period
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            now = time.monotonic()
+            late = now - next_tick
+            if late >= period:
+                # fell behind, so skip to the tick that's due now
+                skipped = int(late // period)
+                self.missed += skipped
+                next_tick += skipped * period
+                late -= skipped * period
+            self._observe(late)
+            self.tick(now)
+
+    def stats(self) -> Dict[str, Any]:
+        labels = [f"<={edge:g}" for edge in JITTER_BUCKETS]
+        labels.append(f">{JITTER_BUCKETS[-1]:g}")
+        return {
+            "rate": self.rate,
+            "timeout": self.timeout,
+            "stop_duration": self.stop_duration,
+            "ticks": self.ticks,
+            "missed_ticks": self.missed,
+            "published": dict(self.published),
+            "stops": dict(self.stops),
+            "retired": dict(self.retired),
+            "jitter_ms": dict(zip(labels, self.jitter)),
+            "max_jitter_ms": self.max_jitter,
+        }
@@ -0,0 +1,142 @@
+"""
+Delta encoding of feedback messages for clients that opt in with
+?encoding=delta.
+
+Every keyframe_interval messages of a topic, a keyframe is sent in full with
+a "key" id added. The messages in between are sent as
+
+    {"seq": ..., "type": ..., "timestamp": ..., "key": <id>, "delta": {...}}
+
+where delta only holds the fields that differ from that keyframe by more than
+their epsilon (nested types only list their differing fields). A client
+reconstructs the full message by applying the delta to the keyframe with that
+id, see apply_delta. Deltas are relative to the keyframe rather than to the
+previous message, so a dropped or coalesced message never corrupts the
+client's state.
+"""
+
+from typing import *
+from fnmatch import fnmatchcase
+from threading import Lock
+import logging
+from util import fast_json
+
+LOG = logging.getLogger(__name__)
+
+
+def parse_epsilons(spec: str) -> Dict[str, float]:
+    """
+    Parse epsilons like "bat_voltage=0.01,*_temp=0.1" into a pattern dict.
+    """
+    out = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        pattern, _, epsilon = entry.partition("=")
+        out[pattern.strip()] = float(epsilon)
+    return out
+
+
+def apply_delta(keyframe: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rebuild a full message's data from its keyframe's data and its delta.
+    """
+    out = dict(keyframe)
+    for field, value in delta.items():
+        if isinstance(value, dict):
+            out[field] = apply_delta(keyframe[field], value)
+        else:
+            out[field] = value
+    return out
+
+
+class DeltaEncoder:
+    """
+    Encodes messages as deltas against a per-topic keyframe. Safe to call from
+    any thread.
+
+    :param keyframe_interval: int
+        Send a keyframe every this many messages of a topic.
+    :param epsilons: Dict[str, float]
+        Glob patterns of field names (nested fields as e.g. "bno_accel.x") to
+        how much a number may differ from the keyframe before it's sent. The
+        first matching pattern wins; unmatched fields use default_epsilon.
+    :param default_epsilon: float
+        The epsilon of fields no pattern matches. 0 sends every change.
+    """
+
+    def __init__(
+        self,
+        keyframe_interval: int = 20,
+        epsilons: Optional[Dict[str, float]] = None,
+        default_epsilon: float = 0.0,
+    ):
+        self.keyframe_interval = keyframe_interval
+        self.epsilons = epsilons or {}
+        self.default_epsilon = default_epsilon
+        self._resolved: Dict[str, float] = {}
+
+        # topic -> (key id, keyframe data, messages since the keyframe)
+        self._keys: Dict[str, Tuple[int, Dict[str, Any], int]] = {}
+        self._next_key = 0
+        self._lock = Lock()
+
+    def _epsilon(self, field: str) -> float:
+        epsilon = self._resolved.get(field)
+        if epsilon is None:
+            epsilon = next(
+                (e for p, e in self.epsilons.items() if fnmatchcase(field, p)),
+                self.default_epsilon,
+            )
+            self._resolved[field] = epsilon
+        return epsilon
+
+    def _diff(
+        self, keyframe: Dict[str, Any], data: Dict[str, Any], prefix: str = ""
+    ) -> Dict[str, Any]:
+        out = {}
+        for field, value in data.items():
+            old = keyframe.get(field)
+            if isinstance(value, dict):
+                changed = self._diff(old or {}, value, f"{prefix}{field}.")
+                if changed:
+                    out[field] = changed
+            elif (
+                isinstance(value, float)
+                and isinstance(old, float)
+                and abs(value - old) <= self._epsilon(prefix + field)
+            ):
+                continue
+            elif value != old or type(value) is not type(old):
+                out[field] = value
+        return out
+
+    def encode(
+        self, topic: str, data: Dict[str, Any], timestamp: int
+    ) -> Tuple[int, Optional[str]]:
+        """
+        Encode a message.
+
+        :param topic: str
+            The message type.
+        :param data: Dict[str, Any]
+            The message data in to_dict form.
+        :param timestamp: int
+            The message timestamp.
+        :return: Tuple[int, Optional[str]]
+            The key id and the delta message, or None if this message is the
+            new keyframe with that id.
+        """
+        with self._lock:
+            state = self._keys.get(topic)
+            if state is None or state[2] + 1 >= self.keyframe_interval:
+                self._next_key += 1
+                self._keys[topic] = (self._next_key, data, 0)
+                return self._next_key, None
+            key, keyframe, count = state
+            self._keys[topic] = (key, keyframe, count + 1)
+
+        delta = self._diff(keyframe, data)
+        return key, fast_json.dumps(
+            {"type": topic, "timestamp": timestamp, "key": key, "delta": delta}
+        )
@@ -0,0 +1,330 @@
+from typing import *
+from collections import OrderedDict
+import logging
+import numpy as np
+from util.websocket_types import NAN_SENTINEL
+
+LOG = logging.getLogger(__name__)
+
+# how many samples of one pyramid level are combined into one of the next
+FACTOR = 4
+
+
+class Pyramid:
+    """
+    Min/max/sum/count aggregates of a time series at every power of FACTOR,
+    so a time range can be bucketed from a level with only a few times more
+    samples than buckets instead of from every raw sample.
+
+    Level 0 is the raw series. Samples equal to NAN_SENTINEL (or NaN) count as
+    missing. New samples can be appended with extend, which only redoes the
+    last block of each level.
+
+    :param t: np.ndarray
+        Timestamps in milliseconds, ascending.
+    :param y: np.ndarray
+        Values, same length as t.
+    """
+
+    def __init__(self, t: np.ndarray, y: np.ndarray):
+        # per level, arrays with room to grow, and how much of them is used
+        self._data: List[Tuple[np.ndarray, ...]] = []
+        self._lengths: List[int] = []
+        self.levels: List[Tuple[np.ndarray, ...]] = []
+        self.extend(t, y)
+
+    @staticmethod
+    def _samples(t: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, ...]:
+        y = np.asarray(y, dtype=np.float64)
+        missing = np.isnan(y) | (y == NAN_SENTINEL)
+        return (
+            np.asarray(t, dtype=np.int64),
+            np.where(missing, np.inf, y),
+            np.where(missing, -np.inf, y),
+            np.where(missing, 0.0, y),
+            (~missing).astype(np.int64),
+        )
+
+    def _store(self, index: int, at: int, arrays: Tuple[np.ndarray, ...]):
+        """
+        Write arrays into a level from position at on, dropping what was
+        there, growing its storage by doubling so appends stay cheap.
+        """
+        length = at + len(arrays[0])
+        if index == len(self._data):
+            self._data.append(tuple(np.empty(length, a.dtype) for a in arrays))
+            self._lengths.append(0)
+            self.levels.append(())
+        data = self._data[index]
+        if length > len(data[0]):
+            grown = tuple(np.empty(max(length, 2 * len(d)), d.dtype) for d in data)
+            for g, d in zip(grown, data):
+                g[:at] = d[:at]
+            data = self._data[index] = grown
+        for d, a in zip(data, arrays):
+            d[at:length] = a
+        self._lengths[index] = length
+        self.levels[index] = tuple(d[:length] for d in data)
+
+    def extend(self, t: np.ndarray, y: np.ndarray) -> bool:
+        """
+        Append samples to the series.
+
+        :param t: np.ndarray
+            Timestamps in milliseconds, ascending and not before the last
+            sample's.
+        :param y: np.ndarray
+            Values, same length as t.
+        :return: bool
+            False, with nothing appended, if the samples are older than the
+            last one, so the pyramid has to be rebuilt instead.
+        """
+        samples = self._samples(t, y)
+        if len(self) and len(samples[0]) and samples[0][0] < self.levels[0][0][-1]:
+            return False
+
+        levels = len(self._lengths)
+        # where each level changes from; the block of the level below holding
+        # its first change is reduced again along with the ones after it
+        changed = len(self)
+        self._store(0, changed, samples)
+        index = 1
+        while self._lengths[index - 1] > FACTOR:
+            changed = changed // FACTOR if index < levels else 0
+            below = tuple(a[changed * FACTOR :] for a in self.levels[index - 1])
+            self._store(index, changed, self._reduce(*below))
+            index += 1
+        return True
+
+    @staticmethod
+    def _reduce(t, mn, mx, total, count):
+        pad = -len(t) % FACTOR
+
+        def blocks(a: np.ndarray, fill) -> np.ndarray:
+            return np.concatenate((a, np.full(pad, fill, a.dtype))).reshape(-1, FACTOR)
+
+        return (
+            t[::FACTOR],
+            blocks(mn, np.inf).min(axis=1),
+            blocks(mx, -np.inf).max(axis=1),
+            blocks(total, 0.0).sum(axis=1),
+            blocks(count, 0).sum(axis=1),
+        )
+
+    def __len__(self) -> int:
+        return self._lengths[0] if self._lengths else 0
+
+    def level_for(self, start: int, end: int, points: int) -> int:
+        """
+        Get the coarsest level that still has about FACTOR samples per point
+        between start and end.
+        """
+        t = self.levels[0][0]
+        n = np.searchsorted(t, end, side="right") - np.searchsorted(t, start)
+        level = 0
+        while (
+            level + 1 < len(self.levels)
+            and n // FACTOR ** (level + 1) >= points * FACTOR
+        ):
+            level += 1
+        return level
+
+    def _range(self, level: int, start: int, end: int):
+        t = self.levels[level][0]
+        first = np.searchsorted(t, start)
+        last = np.searchsorted(t, end, side="right")
+        return tuple(a[first:last] for a in self.levels[level])
+
+    def buckets(self, start: int, end: int, points: int) -> Dict[str, Any]:
+        """
+        Split start to end into points equal buckets and get the min, max,
+        mean and count of each.
+
+        :return: Dict[str, Any]
+            The level used and columns of bucket start timestamps and stats.
+            Buckets without samples are left out, and a mean of NAN_SENTINEL
+            means a bucket only had missing samples. Above level 0, samples
+            within one block of a bucket edge may be counted in the bucket
+            next to it.
+        """
+        level = self.level_for(start, end, points)
+        t, mn, mx, total, count = self._range(level, start, end)
+
+        edges = np.linspace(start, end, points + 1)
+        first = np.searchsorted(t, edges[:-1])
+        last = np.searchsorted(t, edges[1:])
+        last[-1] = len(t)
+        filled = last > first
+        first = first[filled]
+        # reduceat segments run up to the next start, and the buckets left out
+        # in between are empty, so each segment is exactly one bucket
+        stop = last[filled][-1] if len(first) else 0
+
+        def reduce(ufunc, a):
+            return ufunc.reduceat(a[:stop], first) if len(first) else a[:0]
+
+        bucket_count = reduce(np.add, count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = reduce(np.add, total) / bucket_count
+        empty = bucket_count == 0
+
+        def column(a: np.ndarray) -> List[float]:
+            return np.where(empty, NAN_SENTINEL, a).tolist()
+
+        return {
+            "level": level,
+            "columns": {
+                "timestamp": edges[:-1][filled].astype(np.int64).tolist(),
+                "min": column(reduce(np.minimum, mn)),
+                "max": column(reduce(np.maximum, mx)),
+                "mean": column(mean),
+                "count": bucket_count.tolist(),
+            },
+        }
+
+    def lttb(self, start: int, end: int, points: int) -> Dict[str, Any]:
+        """
+        Decimate start to end to about points samples with
+        largest-triangle-three-buckets, which keeps the shape of the series
+        (peaks included) far better than taking every nth sample.
+
+        Works on the block means of the coarsest level with enough samples.
+        Missing samples are skipped.
+        """
+        level = self.level_for(start, end, points)
+        t, _, _, total, count = self._range(level, start, end)
+        present = count > 0
+        t = t[present]
+        y = total[present] / count[present]
+        return {
+            "level": level,
+            "columns": dict(zip(("timestamp", "value"), lttb(t, y, points))),
+        }
+
+
+def lttb(t: np.ndarray, y: np.ndarray, points: int) -> Tuple[List[int], List[float]]:
+    """
+    Largest-triangle-three-buckets decimation of a series to points samples.
+    The first and last samples are always kept.
+    """
+    n = len(t)
+    if points >= n or points < 3:
+        return t.tolist(), y.tolist()
+
+    x = t.astype(np.float64)
+    # bucket boundaries for everything but the first and last sample
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    keep = np.empty(points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    # averages of every bucket, each used as the third point for the one before
+    sums = np.add.reduceat(np.stack((x, y), axis=1)[: n - 1], edges[:-1], axis=0)
+    averages = sums / np.diff(edges)[:, None]
+
+    selected = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 1 < points - 2:
+            cx, cy = averages[i + 1]
+        else:
+            cx, cy = x[-1], y[-1]
+        ax, ay = x[selected], y[selected]
+        # twice the area of the triangle with each candidate in this bucket
+        area = np.abs((ax - cx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (cy - ay))
+        selected = lo + int(np.argmax(area))
+        keep[i + 1] = selected
+
+    return t[keep].tolist(), y[keep].tolist()
+
+
+class PyramidCache:
+    """
+    LRU cache of pyramids, extended or rebuilt whenever the series they were
+    built from has changed.
+
+    :param size: int
+        How many pyramids to keep.
+    """
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self._pyramids: OrderedDict[Hashable, Tuple[Hashable, Pyramid]] = OrderedDict()
+
+        # stats
+        self.hits = 0
+        self.extended = 0
+        self.misses = 0
+
+    def lookup(
+        self,
+        key: Hashable,
+        version: Hashable,
+        extend: Optional[Callable[[Hashable, Pyramid], bool]] = None,
+    ) -> Optional[Pyramid]:
+        """
+        Get the cached pyramid for key if it is up to date, or can be brought
+        up to date with extend.
+
+        :param key: Hashable
+            What series this is, e.g. (source, topic, field).
+        :param version: Hashable
+            Changes whenever the series does, e.g. how many samples it has
+            ever had.
+        :param extend: Optional[Callable[[Hashable, Pyramid], bool]]
+            Given the version a cached pyramid was built for and the pyramid,
+            appends the samples added since then to it. Returns False if it
+            can't, and the pyramid has to be rebuilt.
+        """
+        cached = self._pyramids.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        cached_version, pyramid = cached
+        if cached_version == version:
+            self.hits += 1
+        elif extend is not None and extend(cached_version, pyramid):
+            self.extended += 1
+            self._pyramids[key] = (version, pyramid)
+        else:
+            self.misses += 1
+            return None
+        self._pyramids.move_to_end(key)
+        return pyramid
+
+    def put(self, key: Hashable, version: Hashable, pyramid: Pyramid):
+        """
+        Cache a pyramid built for a version of a series, see lookup.
+        """
+        self._pyramids[key] = (version, pyramid)
+        self._pyramids.move_to_end(key)
+        while len(self._pyramids) > self.size:
+            self._pyramids.popitem(last=False)
+
+    def get(
+        self,
+        key: Hashable,
+        version: Hashable,
+        load: Callable[[], Tuple[np.ndarray, np.ndarray]],
+        extend: Optional[Callable[[Hashable, Pyramid], bool]] = None,
+    ) -> Pyramid:
+        """
+        Get the pyramid for key, building it from load if it isn't cached and
+        up to date, see lookup.
+
+        :param load: Callable[[], Tuple[np.ndarray, np.ndarray]]
+            Returns the timestamps and values of the series.
+        """
+        pyramid = self.lookup(key, version, extend)
+        if pyramid is None:
+            pyramid = Pyramid(*load())
+            self.put(key, version, pyramid)
+        return pyramid
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cached": len(self._pyramids),
+            "hits": self.hits,
+            "extended": self.extended,
+            "misses": self.misses,
+        }
@@ -0,0 +1,43 @@
+"""
+JSON encoding for the websocket hot paths.
+
+Uses orjson when it is installed and falls back to the standard library
+otherwise. Both produce compact JSON.
+"""
+
+from typing import *
+import json
+import logging
+
+LOG = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(obj: Any) -> str:
+        """
+        Encode an object as a JSON string.
+        """
+        return orjson.dumps(obj).decode()
+
+    loads: Callable[[Union[str, bytes]], Any] = orjson.loads
+else:
+    BACKEND = "json"
+
+    # reusing one encoder skips rebuilding it on every call like json.dumps does
+    _encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def dumps(obj: Any) -> str:
+        """
+        Encode an object as a JSON string.
+        """
+        return _encoder.encode(obj)
+
+    loads: Callable[[Union[str, bytes]], Any] = json.loads
+
+LOG.debug(f"using {BACKEND} for JSON encoding")
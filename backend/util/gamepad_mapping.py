@@ -0,0 +1,409 @@
+"""
+Maps raw controller state (ControllerStateData) to rover commands on the
+backend, so a controller only has to send its axes and buttons.
+
+A profile maps one controller to one command type:
+
+    {
+        "type": "/core/control",
+        "axes": {
+            "left_stick": {"mix": {"ls_y": -1}, "deadzone": 0.08, "expo": 0.3},
+        },
+        "buttons": [
+            {"field": "brake", "button": "b", "action": "hold"},
+            {"field": "max_speed", "button": "d_up", "action": "step", "step": 10, "max": 100},
+        ],
+        "defaults": {"max_speed": 40, ...},
+    }
+
+Every axis output is a weighted sum ("mix") of controller fields, with
+buttons counting as 0 or 1. Then it gets a deadzone (rescaled so output starts
+at 0 at the edge of the deadzone), an expo curve ((1 - expo) * x + expo * x^3),
+"scale" and an optional "offset". The output can be "while" or "unless" a
+button is held, or "integrate"d over time (clamped to "min" and "max") for
+position targets. Outputs to int fields round away from zero, so anything
+past the deadzone moves. All axes of a profile are computed at once with
+numpy.
+
+Button actions happen on the press (rising edge) of a button, except "hold",
+which follows it: "hold" sets the field while the button is held, "toggle"
+flips it, and "step" adds "step" to it, clamped to "min" and "max". Fields no
+axis sets keep their "defaults", which must cover them all.
+"""
+
+from typing import *
+import json
+import logging
+import numpy as np
+from util.websocket_types import ControllerStateData, WebsocketData, registry
+
+LOG = logging.getLogger(__name__)
+
+# controller fields, in the order of their positional values
+INPUTS = [".".join(path) for path, _ in ControllerStateData._flat]
+INPUT_INDEX = {name: i for i, name in enumerate(INPUTS)}
+
+# buttons count as pressed past this
+PRESSED = 0.5
+
+# longest time step integrated at once, so a stalled controller doesn't jump
+MAX_DT = 0.1
+
+DEFAULT_PROFILES: Dict[str, Dict[str, Any]] = {
+    "drive": {
+        "type": "/core/control",
+        "axes": {
+            "left_stick": {"mix": {"ls_y": -1}, "deadzone": 0.08, "expo": 0.3},
+            "right_stick": {"mix": {"rs_y": -1}, "deadzone": 0.08, "expo": 0.3},
+        },
+        "buttons": [
+            {"field": "brake", "button": "b", "action": "hold"},
+            {
+                "field": "max_speed",
+                "button": "d_up",
+                "action": "step",
+                "step": 10,
+                "max": 100,
+            },
+            {
+                "field": "max_speed",
+                "button": "d_down",
+                "action": "step",
+                "step": -10,
+                "min": 0,
+            },
+        ],
+        "defaults": {
+            "left_stick": 0.0,
+            "right_stick": 0.0,
+            "max_speed": 40,
+            "brake": False,
+            "turn_to_enable": False,
+            "turn_to": 0.0,
+            "turn_to_timeout": 0.0,
+        },
+    },
+    "arm": {
+        "type": "/arm/control/manual",
+        "axes": {
+            "axis0": {"mix": {"d_right": 1, "d_left": -1}, "unless": "rb"},
+            "axis1": {"mix": {"ls_x": 1}, "deadzone": 0.5, "unless": "rb"},
+            "axis2": {"mix": {"ls_y": -1}, "deadzone": 0.5, "unless": "rb"},
+            "axis3": {"mix": {"rs_y": -1}, "deadzone": 0.5, "unless": "rb"},
+            "effector_roll": {"mix": {"rs_x": 1}, "deadzone": 0.5, "while": "rb"},
+            "effector_yaw": {"mix": {"ls_x": 1}, "deadzone": 0.5, "while": "rb"},
+            "gripper": {"mix": {"rt": 1, "lt": -1}, "deadzone": 0.5},
+            "linear_actuator": {"mix": {"y": 1, "x": -1}},
+        },
+        "buttons": [
+            {"field": "brake", "button": "b", "action": "hold"},
+            {"field": "laser", "button": "a", "action": "toggle"},
+        ],
+        "defaults": {
+            "axis0": 0,
+            "axis1": 0,
+            "axis2": 0,
+            "axis3": 0,
+            "brake": False,
+            "effector_roll": 0,
+            "effector_yaw": 0,
+            "gripper": 0,
+            "linear_actuator": 0,
+            "laser": 0,
+        },
+    },
+    "ptz": {
+        "type": "/ptz/control",
+        "axes": {
+            "yaw": {
+                "mix": {"rs_x": 1},
+                "deadzone": 0.1,
+                "expo": 0.5,
+                "scale": 90,
+                "integrate": True,
+                "min": -135,
+                "max": 135,
+            },
+            "pitch": {
+                "mix": {"rs_y": -1},
+                "deadzone": 0.1,
+                "expo": 0.5,
+                "scale": 60,
+                "integrate": True,
+                "min": -90,
+                "max": 90,
+            },
+        },
+        "buttons": [],
+        "defaults": {
+            "control_mode": 1,
+            "turn_yaw": 0,
+            "turn_pitch": 0,
+            "yaw": 0.0,
+            "pitch": 0.0,
+            "axis_id": 0,
+            "angle": 0.0,
+            "zoom_level": 1.0,
+            "stream_type": 0,
+            "stream_freq": 0,
+            "reset": False,
+        },
+    },
+}
+
+
+def parse_assignments(spec: str) -> Dict[str, List[str]]:
+    """
+    Parse which profiles drive which controller, like
+    "controller1=drive,controller2=arm+ptz".
+    """
+    out = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        controller, _, profiles = entry.partition("=")
+        out[controller.strip()] = [p.strip() for p in profiles.split("+")]
+    return out
+
+
+def load_profiles(path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Get the built in profiles, overridden and extended by those in a JSON file
+    of profile name -> profile.
+    """
+    profiles = dict(DEFAULT_PROFILES)
+    if path:
+        with open(path) as f:
+            profiles.update(json.load(f))
+    return profiles
+
+
+def _input(name: str) -> int:
+    if name not in INPUT_INDEX:
+        raise ValueError(f"unknown controller input '{name}'")
+    return INPUT_INDEX[name]
+
+
+class Profile:
+    """
+    A compiled mapping profile, see the module docstring.
+
+    :param name: str
+        The profile name, for logs.
+    :param config: Dict[str, Any]
+        The profile.
+    """
+
+    def __init__(self, name: str, config: Dict[str, Any]):
+        self.name = name
+        ws_type = registry.lookup(config["type"])
+        if ws_type is None:
+            raise ValueError(f"profile {name} maps to unknown type {config['type']}")
+        self.ws_type: Type[WebsocketData] = ws_type
+        field_types = {entry.field: entry.field_type for entry in ws_type._fields}
+
+        self.defaults: Dict[str, Any] = dict(config.get("defaults", {}))
+        axes: Dict[str, Dict[str, Any]] = config.get("axes", {})
+        missing = set(field_types) - set(self.defaults) - set(axes)
+        if missing:
+            raise ValueError(f"profile {name} doesn't set {', '.join(sorted(missing))}")
+        for field in set(axes) | set(self.defaults):
+            if field not in field_types:
+                raise ValueError(f"profile {name} sets unknown field '{field}'")
+
+        # one row per axis output
+        self.axis_fields = list(axes)
+        count = len(self.axis_fields)
+        self.mix = np.zeros((count, len(INPUTS)))
+        self.deadzone = np.zeros(count)
+        self.expo = np.zeros(count)
+        self.scale = np.ones(count)
+        self.offset = np.zeros(count)
+        self.low = np.full(count, -np.inf)
+        self.high = np.full(count, np.inf)
+        self.integrate = np.zeros(count, dtype=bool)
+        self.is_int = np.zeros(count, dtype=bool)
+        # gating inputs, pointing at input 0 where there is none
+        self.has_while = np.zeros(count, dtype=bool)
+        self.while_input = np.zeros(count, dtype=np.int64)
+        self.has_unless = np.zeros(count, dtype=bool)
+        self.unless_input = np.zeros(count, dtype=np.int64)
+
+        for i, field in enumerate(self.axis_fields):
+            axis = axes[field]
+            for source, weight in axis["mix"].items():
+                self.mix[i, _input(source)] = weight
+            self.deadzone[i] = axis.get("deadzone", 0.0)
+            self.expo[i] = axis.get("expo", 0.0)
+            self.scale[i] = axis.get("scale", 1.0)
+            self.offset[i] = axis.get("offset", 0.0)
+            self.low[i] = axis.get("min", -np.inf)
+            self.high[i] = axis.get("max", np.inf)
+            self.integrate[i] = axis.get("integrate", False)
+            self.is_int[i] = field_types[field] is int
+            if "while" in axis:
+                self.has_while[i] = True
+                self.while_input[i] = _input(axis["while"])
+            if "unless" in axis:
+                self.has_unless[i] = True
+                self.unless_input[i] = _input(axis["unless"])
+            if self.is_int[i] and self.integrate[i]:
+                raise ValueError(f"profile {name} integrates int field '{field}'")
+            if not 0 <= self.deadzone[i] < 1:
+                raise ValueError(f"profile {name} has a bad deadzone on '{field}'")
+
+        self.buttons: List[Dict[str, Any]] = list(config.get("buttons", []))
+        for button in self.buttons:
+            _input(button["button"])
+            if button["field"] not in field_types:
+                raise ValueError(
+                    f"profile {name} sets unknown field '{button['field']}'"
+                )
+            if button["action"] not in ("hold", "toggle", "step"):
+                raise ValueError(
+                    f"profile {name} has unknown button action '{button['action']}'"
+                )
+        self.button_inputs = np.array(
+            [_input(button["button"]) for button in self.buttons], dtype=np.int64
+        )
+        self.field_types = field_types
+
+    def axes(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Compute every axis output (before integration) from the controller's
+        inputs.
+        """
+        raw = self.mix @ inputs
+        magnitude = np.maximum(np.abs(raw) - self.deadzone, 0.0) / (1 - self.deadzone)
+        magnitude = np.minimum(magnitude, 1.0)
+        shaped = (1 - self.expo) * magnitude + self.expo * magnitude**3
+        out = np.sign(raw) * shaped * self.scale
+
+        pressed = inputs > PRESSED
+        gate = (~self.has_while | pressed[self.while_input]) & (
+            ~self.has_unless | ~pressed[self.unless_input]
+        )
+        out = np.where(gate, out, 0.0)
+        return np.where(self.is_int, np.sign(out) * np.ceil(np.abs(out) - 1e-9), out)
+
+
+class ProfileState:
+    """
+    The fields one profile last produced for one controller, which toggles,
+    steps and integrated axes carry on from.
+    """
+
+    def __init__(self, profile: Profile):
+        self.profile = profile
+        self.values: Dict[str, Any] = dict(profile.defaults)
+        self.integrated = np.array(
+            [float(self.values.get(field, 0.0)) for field in profile.axis_fields]
+        )
+        self.pressed = np.zeros(len(profile.buttons), dtype=bool)
+        self.last_timestamp: Optional[int] = None
+
+    def update(self, inputs: np.ndarray, timestamp: int) -> WebsocketData:
+        profile = self.profile
+        out = profile.axes(inputs)
+
+        if profile.integrate.any():
+            dt = 0.0
+            if self.last_timestamp is not None:
+                dt = min(max((timestamp - self.last_timestamp) / 1000, 0.0), MAX_DT)
+            self.integrated = np.clip(
+                self.integrated + out * dt, profile.low, profile.high
+            )
+        self.last_timestamp = timestamp
+        out = np.clip(
+            np.where(profile.integrate, self.integrated, out + profile.offset),
+            profile.low,
+            profile.high,
+        )
+        for field, value, is_int in zip(
+            profile.axis_fields, out.tolist(), profile.is_int.tolist()
+        ):
+            self.values[field] = int(value) if is_int else value
+
+        if profile.buttons:
+            pressed = inputs[profile.button_inputs] > PRESSED
+            rising = pressed & ~self.pressed
+            self.pressed = pressed
+            for button, held, pressed_now in zip(
+                profile.buttons, pressed.tolist(), rising.tolist()
+            ):
+                self._button(button, held, pressed_now)
+
+        return profile.ws_type.from_dict(dict(self.values), msg_timestamp=timestamp)
+
+    def _button(self, button: Dict[str, Any], held: bool, pressed: bool):
+        field = button["field"]
+        field_type = self.profile.field_types[field]
+        action = button["action"]
+        if action == "hold":
+            self.values[field] = field_type(held)
+        elif not pressed:
+            return
+        elif action == "toggle":
+            self.values[field] = field_type(not self.values[field])
+        else:
+            value = self.values[field] + button["step"]
+            value = min(max(value, button.get("min", value)), button.get("max", value))
+            self.values[field] = field_type(value)
+
+
+class GamepadMapper:
+    """
+    Turns controller state into commands, using the profiles assigned to each
+    controller. Controllers without profiles aren't mapped.
+
+    :param profiles: Dict[str, Dict[str, Any]]
+        Profile name -> profile, see the module docstring.
+    :param assignments: Dict[str, List[str]]
+        Controller (the end of its msg_type, e.g. "controller1") -> the names
+        of the profiles it drives.
+    """
+
+    def __init__(
+        self, profiles: Dict[str, Dict[str, Any]], assignments: Dict[str, List[str]]
+    ):
+        self.assignments: Dict[str, List[Profile]] = {}
+        for controller, names in assignments.items():
+            for name in names:
+                if name not in profiles:
+                    raise ValueError(f"{controller} assigned unknown profile {name}")
+            self.assignments[controller] = [
+                Profile(name, profiles[name]) for name in names
+            ]
+        # msg_type -> state of each profile of that controller
+        self._states: Dict[str, List[ProfileState]] = {}
+
+        # stats
+        self.mapped = 0
+        self.unmapped = 0
+
+    def map(self, ws_data: ControllerStateData) -> List[WebsocketData]:
+        """
+        Map a controller's state to the commands of its profiles.
+        """
+        states = self._states.get(ws_data.msg_type)
+        if states is None:
+            controller = ws_data.msg_type.rsplit("/", 1)[-1]
+            states = [ProfileState(p) for p in self.assignments.get(controller, ())]
+            self._states[ws_data.msg_type] = states
+        if not states:
+            self.unmapped += 1
+            return []
+
+        self.mapped += 1
+        inputs = np.array(ControllerStateData.to_values(ws_data.data), dtype=np.float64)
+        return [state.update(inputs, ws_data.msg_timestamp) for state in states]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "assignments": {
+                controller: [profile.name for profile in profiles]
+                for controller, profiles in self.assignments.items()
+            },
+            "mapped": self.mapped,
+            "unmapped": self.unmapped,
+        }
@@ -0,0 +1,206 @@
+from typing import *
+import logging
+import math
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+# mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+
+class PositionPredictor:
+    """
+    Dead-reckoning position predictor for the rover.
+
+    Runs a constant-velocity Kalman filter in a local east/north frame (meters)
+    centered on the first fix. GPS fixes correct the filter; in between, the
+    position is extrapolated from the estimated velocity so the antenna can be
+    pointed at where the rover is now instead of where it was at the last fix.
+
+    Optionally, the BNO055 acceleration can be used as a control input. It is
+    rotated into east/north with the rover's orientation, assuming x points
+    forward and y points to the left. It is off by default because raw BNO055
+    acceleration includes gravity whenever the rover is tilted.
+
+    :param gps_noise: float
+        Standard deviation of GPS fixes, in meters.
+    :param accel_noise: float
+        Standard deviation of unmodeled acceleration, in m/s^2.
+    :param max_extrapolation: float
+        Never extrapolate further than this many seconds past the last fix.
+    :param use_accel: bool
+        Use bno_accel as a control input.
+    """
+
+    def __init__(
+        self,
+        gps_noise: float = 2.5,
+        accel_noise: float = 1.0,
+        max_extrapolation: float = 2.0,
+        use_accel: bool = False,
+    ):
+        self.gps_noise = gps_noise
+        self.accel_noise = accel_noise
+        self.max_extrapolation = max_extrapolation
+        self.use_accel = use_accel
+
+        self._origin: Optional[Tuple[float, float]] = None
+        self._meters_per_deg_lon = 0.0
+        self._meters_per_deg_lat = math.radians(1) * EARTH_RADIUS
+
+        # [east, north, east velocity, north velocity]
+        self._x = np.zeros(4)
+        self._P = np.eye(4)
+        self._t: Optional[float] = None
+        self._accel = np.zeros(2)
+        # latitude and longitude of the last fix from update_feedback
+        self._last_fix: Optional[Tuple[float, float]] = None
+
+        self._H = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]])
+        self._R = np.eye(2) * gps_noise**2
+
+    @property
+    def has_fix(self) -> bool:
+        return self._t is not None
+
+    def _to_local(self, lat: float, lon: float) -> np.ndarray:
+        return np.array(
+            [
+                (lon - self._origin[1]) * self._meters_per_deg_lon,
+                (lat - self._origin[0]) * self._meters_per_deg_lat,
+            ]
+        )
+
+    def _to_global(self, east: float, north: float) -> Tuple[float, float]:
+        return (
+            self._origin[0] + north / self._meters_per_deg_lat,
+            self._origin[1] + east / self._meters_per_deg_lon,
+        )
+
+    def _transition(self, dt: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        F = np.eye(4)
+        F[0, 2] = F[1, 3] = dt
+
+        # control input and process noise for white noise acceleration
+        B = np.array([[dt**2 / 2, 0.0], [0.0, dt**2 / 2], [dt, 0.0], [0.0, dt]])
+        Q = B @ B.T * self.accel_noise**2
+        return F, B, Q
+
+    def update(
+        self,
+        lat: float,
+        lon: float,
+        t: float,
+        orientation: Optional[float] = None,
+        accel: Optional[Tuple[float, float]] = None,
+    ) -> bool:
+        """
+        Correct the filter with a GPS fix.
+
+        :param lat: float
+            Latitude in degrees.
+        :param lon: float
+            Longitude in degrees.
+        :param t: float
+            Time the fix was received, in seconds on a monotonic clock.
+        :param orientation: Optional[float]
+            Rover heading in degrees clockwise from north.
+        :param accel: Optional[Tuple[float, float]]
+            Forward (x) and left (y) acceleration in m/s^2.
+        :return: bool
+            False if the fix was ignored because it isn't a real fix.
+        """
+        # the rover reports NaN (or its sentinel) or 0,0 before it has a fix
+        if not (abs(lat) <= 90 and abs(lon) <= 180) or (lat == 0 and lon == 0):
+            return False
+
+        if self._origin is None:
+            self._origin = (lat, lon)
+            self._meters_per_deg_lon = self._meters_per_deg_lat * math.cos(
+                math.radians(lat)
+            )
+
+        z = self._to_local(lat, lon)
+        if self._t is None:
+            self._x = np.array([z[0], z[1], 0.0, 0.0])
+            self._P = np.diag([self.gps_noise**2] * 2 + [4.0, 4.0])
+            self._t = t
+            return True
+
+        # predict up to the fix
+        dt = max(t - self._t, 0.0)
+        F, B, Q = self._transition(dt)
+        self._x = F @ self._x + B @ self._accel
+        self._P = F @ self._P @ F.T + Q
+
+        # correct with the fix
+        y = z - self._H @ self._x
+        S = self._H @ self._P @ self._H.T + self._R
+        K = self._P @ self._H.T @ np.linalg.inv(S)
+        self._x = self._x + K @ y
+        self._P = (np.eye(4) - K @ self._H) @ self._P
+        self._t = t
+
+        self._accel = np.zeros(2)
+        if self.use_accel and accel is not None and orientation is not None:
+            # also filters out NaN and the NaN sentinel
+            if abs(accel[0]) < 100 and abs(accel[1]) < 100 and abs(orientation) < 1000:
+                heading = math.radians(orientation)
+                forward = np.array([math.sin(heading), math.cos(heading)])
+                left = np.array([-math.cos(heading), math.sin(heading)])
+                self._accel = accel[0] * forward + accel[1] * left
+        return True
+
+    def update_feedback(self, feedback: Dict[str, Any], t: float) -> bool:
+        """
+        Correct the filter with CoreFeedbackData, in to_dict form.
+
+        Feedback comes several times per GPS fix and repeats the last fix in
+        between, so only feedback whose position changed is used. Otherwise
+        the filter would take one fix for many agreeing measurements and pull
+        its velocity towards zero.
+
+        :param feedback: Dict[str, Any]
+            The feedback data.
+        :param t: float
+            Time the feedback was received, in seconds on a monotonic clock.
+        :return: bool
+            False if the feedback had no usable fix, or no new one.
+        """
+        fix = (feedback["gps_lat"], feedback["gps_long"])
+        if fix == self._last_fix:
+            return False
+        accel = feedback["bno_accel"]
+        if not self.update(
+            *fix,
+            t,
+            orientation=feedback["orientation"],
+            accel=(accel["x"], accel["y"]),
+        ):
+            return False
+        self._last_fix = fix
+        return True
+
+    def predict(self, t: float) -> Optional[Tuple[float, float]]:
+        """
+        Extrapolate the rover's position without changing the filter.
+
+        :param t: float
+            Time to predict for, on the same clock as update.
+        :return: Optional[Tuple[float, float]]
+            Latitude and longitude in degrees, None before the first fix.
+        """
+        if self._t is None:
+            return None
+
+        dt = min(max(t - self._t, 0.0), self.max_extrapolation)
+        F, B, _ = self._transition(dt)
+        x = F @ self._x + B @ self._accel
+        return self._to_global(x[0], x[1])
+
+    def speed(self) -> float:
+        """
+        Get the estimated ground speed in m/s.
+        """
+        return float(math.hypot(self._x[2], self._x[3]))
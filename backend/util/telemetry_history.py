@@ -0,0 +1,328 @@
+from typing import *
+from threading import Lock
+from fnmatch import fnmatchcase
+import datetime
+import io
+import logging
+import numpy as np
+from util.websocket_types import WebsocketData
+
+LOG = logging.getLogger(__name__)
+
+# numpy column types for spec field types. strings are stored fixed width so
+# every buffer has a fixed size, STR_WIDTH characters unless spec_dtype is told
+# otherwise; longer strings are truncated
+STR_WIDTH = 64
+COLUMN_TYPES = {
+    float: np.float64,
+    int: np.int64,
+    bool: np.bool_,
+    str: np.dtype(f"U{STR_WIDTH}"),
+}
+
+
+def _columns(
+    ws_type: Type[WebsocketData], path: Tuple[str, ...] = ()
+) -> List[Tuple[Tuple[str, ...], Any]]:
+    """
+    Flatten a spec into (path, numpy type) columns, in the spec's stable
+    order. Nested types become one column per field, e.g. bno_accel.x. Fields
+    without a fixed size numpy type (lists) are left out.
+    """
+    out = []
+    for entry in ws_type._fields:
+        field_path = path + (entry.field,)
+        if issubclass(entry.field_type, WebsocketData):
+            out.extend(_columns(entry.field_type, field_path))
+        elif entry.field_type in COLUMN_TYPES:
+            out.append((field_path, COLUMN_TYPES[entry.field_type]))
+    return out
+
+
+def spec_dtype(
+    ws_type: Type[WebsocketData],
+    str_widths: Optional[Dict[str, int]] = None,
+) -> Tuple[np.dtype, List[Tuple[str, ...]]]:
+    """
+    Build the fixed width record type for a message type: a "timestamp"
+    column (milliseconds, like message timestamps) followed by one column per
+    spec field, named by their dotted path.
+
+    :param ws_type: Type[WebsocketData]
+        The message type.
+    :param str_widths: Optional[Dict[str, int]]
+        Glob patterns of "<msg_type>.<column>" (e.g. "/auto/feedback.warn")
+        to how many characters a string column holds. The first matching
+        pattern wins; other string columns hold STR_WIDTH.
+    :return: Tuple[np.dtype, List[Tuple[str, ...]]]
+        The record type and the path of each field column in the data dict.
+    """
+    paths = []
+    columns = []
+    for path, column_type in _columns(ws_type):
+        paths.append(path)
+        name = ".".join(path)
+        if column_type == COLUMN_TYPES[str] and str_widths:
+            width = next(
+                (
+                    w
+                    for p, w in str_widths.items()
+                    if fnmatchcase(f"{ws_type.msg_type}.{name}", p)
+                ),
+                STR_WIDTH,
+            )
+            column_type = np.dtype(f"U{width}")
+        columns.append((name, column_type))
+    dtype = np.dtype([("timestamp", np.int64)] + columns)
+    return dtype, paths
+
+
+def string_columns(dtype: np.dtype) -> Tuple[Tuple[int, str, int], ...]:
+    """
+    Get the (index, name, width in characters) of a record type's string
+    columns, for check_strings.
+    """
+    return tuple(
+        (i, name, dtype[name].itemsize // 4)
+        for i, name in enumerate(dtype.names)
+        if dtype[name].kind == "U"
+    )
+
+
+# (topic, column) pairs already warned about by check_strings
+_truncated: Set[Tuple[str, str]] = set()
+
+
+def check_strings(
+    topic: str, columns: Tuple[Tuple[int, str, int], ...], row: Tuple[Any, ...]
+):
+    """
+    Warn, once per topic and column, if a row from pack_row has a string too
+    long for its column, since it is about to be truncated.
+
+    :param columns: Tuple[Tuple[int, str, int], ...]
+        The string_columns of the row's record type.
+    """
+    for i, name, width in columns:
+        if len(row[i]) > width and (topic, name) not in _truncated:
+            _truncated.add((topic, name))
+            LOG.warning(
+                f"{topic} {name} is longer than {width} characters and is "
+                "truncated, raise its width with STR_WIDTHS"
+            )
+
+
+def pack_row(
+    paths: List[Tuple[str, ...]], data: Dict[str, Any], timestamp: int
+) -> Tuple[Any, ...]:
+    """
+    Flatten a message in to_dict form into a record of its spec_dtype.
+    """
+    row = [timestamp]
+    for path in paths:
+        value = data
+        for key in path:
+            value = value[key]
+        row.append(value)
+    return tuple(row)
+
+
+def unpack_row(
+    paths: List[Tuple[str, ...]], row: np.void
+) -> Tuple[int, Dict[str, Any]]:
+    """
+    Turn a record of a spec_dtype back into a timestamp and to_dict form.
+    """
+    data = {}
+    for i, path in enumerate(paths, 1):
+        target = data
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        target[path[-1]] = row[i].item()
+    return int(row[0]), data
+
+
+class TopicHistory:
+    """
+    Fixed size ring buffer of one topic's messages, stored as a numpy
+    structured array with a "timestamp" column (milliseconds, like message
+    timestamps) and one column per spec field.
+
+    Appended to from ROS executor threads and read from the event loop, so
+    access is locked.
+
+    :param ws_type: Type[WebsocketData]
+        The message type to store.
+    :param capacity: int
+        How many messages to keep. Older messages are overwritten.
+    :param str_widths: Optional[Dict[str, int]]
+        Widths of string columns, see spec_dtype.
+    """
+
+    def __init__(
+        self,
+        ws_type: Type[WebsocketData],
+        capacity: int,
+        str_widths: Optional[Dict[str, int]] = None,
+    ):
+        self.ws_type = ws_type
+        self.topic: str = ws_type.msg_type
+        self.capacity = capacity
+
+        self.dtype, self._paths = spec_dtype(ws_type, str_widths)
+        self._strings = string_columns(self.dtype)
+        self._buffer = np.zeros(capacity, dtype=self.dtype)
+        # index the next message is written to, and how many are stored
+        self._head = 0
+        self._count = 0
+        # how many messages were ever appended
+        self._appended = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, data: Dict[str, Any], timestamp: int):
+        """
+        Store a message.
+
+        :param data: Dict[str, Any]
+            The message data in to_dict form.
+        :param timestamp: int
+            The message timestamp in milliseconds.
+        """
+        row = pack_row(self._paths, data, timestamp)
+        check_strings(self.topic, self._strings, row)
+        with self._lock:
+            self._buffer[self._head] = row
+            self._head = (self._head + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+            self._appended += 1
+
+    @property
+    def appended(self) -> int:
+        """
+        How many messages were ever appended, which changes whenever the
+        history does.
+        """
+        return self._appended
+
+    def appended_rows(self, first: int, last: int) -> np.ndarray:
+        """
+        Get a copy of the messages appended between two values of appended,
+        oldest first. Messages that have been overwritten since are left out.
+
+        :param first: int
+            The value of appended before the first message to get.
+        :param last: int
+            The value of appended after the last message to get.
+        """
+        with self._lock:
+            first = max(first, self._appended - self._count)
+            last = min(last, self._appended)
+            # message number i was written to i % capacity
+            indexes = np.arange(first, max(first, last)) % self.capacity
+            return self._buffer[indexes]
+
+    def since(self, timestamp: int = 0) -> np.ndarray:
+        """
+        Get a copy of the stored messages newer than timestamp, oldest first.
+
+        :param timestamp: int
+            Only return messages with a timestamp strictly after this, in
+            milliseconds.
+        :return: np.ndarray
+            The messages as a structured array.
+        """
+        with self._lock:
+            start = (self._head - self._count) % self.capacity
+            if start + self._count <= self.capacity:
+                rows = self._buffer[start : start + self._count].copy()
+            else:
+                rows = np.concatenate(
+                    (self._buffer[start:], self._buffer[: self._head])
+                )
+
+        # timestamps are nearly always in order, but the clock could step back
+        return rows[rows["timestamp"] > timestamp]
+
+    def to_columns(self, rows: np.ndarray) -> Dict[str, Any]:
+        """
+        Convert rows from since to columnar JSON-ready data.
+        """
+        return {
+            "type": self.topic,
+            "count": len(rows),
+            "columns": {name: rows[name].tolist() for name in self.dtype.names},
+        }
+
+    @staticmethod
+    def to_npy(rows: np.ndarray) -> bytes:
+        """
+        Convert rows from since to a .npy file, which keeps the column names
+        and types.
+        """
+        out = io.BytesIO()
+        np.save(out, rows, allow_pickle=False)
+        return out.getvalue()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "topic": self.topic,
+            "stored": self._count,
+            "capacity": self.capacity,
+            "bytes": self._buffer.nbytes,
+        }
+
+
+class TelemetryHistory:
+    """
+    Ring buffer history for a set of feedback topics, so clients that
+    (re)connect can backfill their charts.
+
+    :param types: Iterable[Type[WebsocketData]]
+        The message types to keep history for.
+    :param capacity: int
+        How many messages to keep per topic.
+    :param str_widths: Optional[Dict[str, int]]
+        Widths of string columns, see spec_dtype.
+    """
+
+    def __init__(
+        self,
+        types: Iterable[Type[WebsocketData]],
+        capacity: int,
+        str_widths: Optional[Dict[str, int]] = None,
+    ):
+        self.topics: Dict[str, TopicHistory] = {
+            t.msg_type: TopicHistory(t, capacity, str_widths) for t in types
+        }
+
+    def get(self, topic: str) -> Optional[TopicHistory]:
+        return self.topics.get(topic)
+
+    def record(
+        self,
+        ws_type: Type[WebsocketData],
+        data: Dict[str, Any],
+        timestamp: Optional[int] = None,
+    ):
+        """
+        Store a message if its topic has history. Safe to call from any thread.
+
+        :param ws_type: Type[WebsocketData]
+            The message type.
+        :param data: Dict[str, Any]
+            The message data in to_dict form.
+        :param timestamp: Optional[int]
+            The message timestamp in milliseconds, now if not given.
+        """
+        history = self.topics.get(ws_type.msg_type)
+        if history is None:
+            return
+        if not timestamp:
+            timestamp = int(datetime.datetime.now().timestamp() * 1000)
+        history.append(data, timestamp)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [history.stats() for history in self.topics.values()]
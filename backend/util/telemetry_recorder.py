@@ -0,0 +1,451 @@
+from typing import *
+from pathlib import Path
+from queue import Queue, Empty, Full
+from threading import Thread
+import datetime
+import heapq
+import json
+import logging
+import numpy as np
+from util.websocket_types import WebsocketData
+from util.telemetry_history import (
+    COLUMN_TYPES,
+    check_strings,
+    pack_row,
+    spec_dtype,
+    string_columns,
+    unpack_row,
+)
+
+LOG = logging.getLogger(__name__)
+
+# segment files start with MAGIC, a little endian u16 header length and a JSON
+# header, padded so the fixed width records after it are aligned
+MAGIC = b"BSREC\x01"
+HEADER_ALIGN = 64
+INDEX_FILE = "index.jsonl"
+
+
+def recordable(ws_type: Type[WebsocketData]) -> bool:
+    """
+    Whether every field of a message type fits a fixed width record, so it can
+    be replayed as it was.
+    """
+    for entry in ws_type._fields:
+        if issubclass(entry.field_type, WebsocketData):
+            if not recordable(entry.field_type):
+                return False
+        elif entry.field_type not in COLUMN_TYPES:
+            return False
+    return True
+
+
+def topic_dir(topic: str) -> str:
+    return topic.strip("/").replace("/", "_")
+
+
+class SegmentWriter:
+    """
+    Writes one topic's records to append-only segment files, starting a new
+    segment once the current one is too big or too old. Each finished segment
+    is added to the topic's index.
+
+    Only used from the recorder's writer thread.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        ws_type: Type[WebsocketData],
+        topic: str,
+        segment_bytes: int,
+        segment_seconds: float,
+        str_widths: Optional[Dict[str, int]] = None,
+    ):
+        self.directory = directory / topic_dir(topic)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ws_type = ws_type
+        self.topic = topic
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.dtype, self.paths = spec_dtype(ws_type, str_widths)
+        self.strings = string_columns(self.dtype)
+
+        self._file = None
+        self._path: Path | None = None
+        self._first = 0
+        self._last = 0
+        self._count = 0
+        self._size = 0
+        self.segments = 0
+
+    def _header(self) -> bytes:
+        header = json.dumps(
+            {
+                "type": self.topic,
+                "descr": np.lib.format.dtype_to_descr(self.dtype),
+            }
+        ).encode()
+        length = len(MAGIC) + 2 + len(header)
+        header += b" " * (-length % HEADER_ALIGN)
+        return MAGIC + len(header).to_bytes(2, "little") + header
+
+    def write(self, rows: List[Tuple[Any, ...]]):
+        first, last = rows[0][0], rows[-1][0]
+        if self._file is not None and (
+            self._size >= self.segment_bytes
+            or (first - self._first) / 1000 >= self.segment_seconds
+        ):
+            self.close()
+        if self._file is None:
+            self._path = self.directory / f"{first}.seg"
+            self._file = open(self._path, "xb")
+            self._size = self._file.write(self._header())
+            self._first = first
+            self._count = 0
+            self.segments += 1
+
+        self._size += self._file.write(np.array(rows, dtype=self.dtype).tobytes())
+        self._count += len(rows)
+        self._last = last
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        with open(self.directory / INDEX_FILE, "a") as index:
+            index.write(
+                json.dumps(
+                    {
+                        "file": self._path.name,
+                        "first": self._first,
+                        "last": self._last,
+                        "count": self._count,
+                    }
+                )
+                + "\n"
+            )
+
+
+class TelemetryRecorder:
+    """
+    Records messages to disk for later replay (see tests/replay.py).
+
+    Each topic gets a directory of append-only segment files of fixed width
+    records generated from the message type's spec, plus an index of the
+    timestamps each finished segment covers. record only queues the message;
+    packing and writing happen on a separate thread so neither the event loop
+    nor ROS callbacks wait on the disk.
+
+    :param directory: str | Path
+        Where to write the session. Created if it doesn't exist.
+    :param segment_bytes: int
+        Start a new segment once the current one is this big.
+    :param segment_seconds: float
+        Start a new segment once the current one covers this much time.
+    :param max_queue: int
+        How many messages may wait for the writer before new ones are dropped.
+    :param str_widths: Optional[Dict[str, int]]
+        Widths of string columns, see util.telemetry_history.spec_dtype.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        segment_bytes: int = 64 * 1024 * 1024,
+        segment_seconds: float = 600.0,
+        max_queue: int = 10000,
+        str_widths: Optional[Dict[str, int]] = None,
+    ):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.str_widths = str_widths
+        self._queue: Queue = Queue(max_queue)
+        self._writers: Dict[str, SegmentWriter] = {}
+        self._thread: Thread | None = None
+        self._unrecordable: Set[str] = set()
+
+        # stats
+        self.recorded = 0
+        self.dropped = 0
+
+    def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._thread = Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+        LOG.info(f"recording telemetry to {self.directory}")
+
+    def record(
+        self,
+        ws_type: Type[WebsocketData],
+        data: Dict[str, Any],
+        timestamp: Optional[int] = None,
+        msg_type: Optional[str] = None,
+    ):
+        """
+        Queue a message to be written. Never blocks; safe to call from any
+        thread.
+
+        Each topic's records have to be in timestamp order for reading back,
+        so timestamps should come from the backend's clock, not a client's.
+
+        :param ws_type: Type[WebsocketData]
+            The message type.
+        :param data: Dict[str, Any]
+            The message data in to_dict form.
+        :param timestamp: Optional[int]
+            The message timestamp in milliseconds, now if not given.
+        :param msg_type: Optional[str]
+            The topic to record under, if not the type's own, e.g. the
+            msg_type of a message of a prefix type.
+        """
+        if not timestamp:
+            timestamp = int(datetime.datetime.now().timestamp() * 1000)
+        try:
+            self._queue.put_nowait(
+                (ws_type, msg_type or ws_type.msg_type, data, timestamp)
+            )
+        except Full:
+            self.dropped += 1
+
+    def close(self):
+        """
+        Write everything queued so far and close the segments.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            # drain whatever else is waiting so it's written in one go
+            try:
+                while len(batch) < 1000:
+                    batch.append(self._queue.get_nowait())
+            except Empty:
+                pass
+
+            by_topic: Dict[str, List[Tuple[Any, ...]]] = {}
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                ws_type, topic, data, timestamp = item
+                writer = self._writer(ws_type, topic)
+                if writer is None:
+                    continue
+                row = pack_row(writer.paths, data, timestamp)
+                check_strings(topic, writer.strings, row)
+                by_topic.setdefault(topic, []).append(row)
+
+            for topic, rows in by_topic.items():
+                try:
+                    self._writers[topic].write(rows)
+                    self._writers[topic].flush()
+                    self.recorded += len(rows)
+                except OSError as e:
+                    self.dropped += len(rows)
+                    LOG.error(f"failed to record {topic}: {e}")
+
+        for writer in self._writers.values():
+            writer.close()
+
+    def _writer(self, ws_type: Type[WebsocketData], topic: str) -> SegmentWriter | None:
+        writer = self._writers.get(topic)
+        if writer is not None:
+            return writer
+        if ws_type.msg_type in self._unrecordable:
+            return None
+        if not recordable(ws_type):
+            LOG.warning(
+                f"not recording {ws_type.msg_type}: it has variable size fields"
+            )
+            self._unrecordable.add(ws_type.msg_type)
+            return None
+
+        writer = SegmentWriter(
+            self.directory,
+            ws_type,
+            topic,
+            self.segment_bytes,
+            self.segment_seconds,
+            self.str_widths,
+        )
+        self._writers[topic] = writer
+        return writer
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": str(self.directory),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "segments": sum(w.segments for w in self._writers.values()),
+        }
+
+
+class Segment:
+    """
+    A memory-mapped segment file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a recording segment")
+            length = int.from_bytes(f.read(2), "little")
+            header = json.loads(f.read(length))
+
+        self.topic: str = header["type"]
+        self.dtype = np.lib.format.descr_to_dtype([tuple(d) for d in header["descr"]])
+        self.paths = [tuple(name.split(".")) for name in self.dtype.names[1:]]
+
+        offset = len(MAGIC) + 2 + length
+        # a partly written last record (e.g. after a crash) is ignored
+        count = (path.stat().st_size - offset) // self.dtype.itemsize
+        self.rows = (
+            np.memmap(path, self.dtype, mode="r", offset=offset, shape=(count,))
+            if count
+            else np.zeros(0, self.dtype)
+        )
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def between(
+        self, start: Optional[int] = None, end: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Get the records between start and end, still memory-mapped.
+        """
+        timestamps = self.rows["timestamp"]
+        first = 0 if start is None else int(np.searchsorted(timestamps, start))
+        last = (
+            len(timestamps)
+            if end is None
+            else int(np.searchsorted(timestamps, end, side="right"))
+        )
+        return self.rows[first:last]
+
+    def messages(
+        self, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+        """
+        Yield (timestamp, topic, data) of the records between start and end.
+        """
+        for row in self.between(start, end):
+            timestamp, data = unpack_row(self.paths, row)
+            yield timestamp, self.topic, data
+
+
+class Recording:
+    """
+    A recorded session, read back through memory-mapped segments.
+
+    :param directory: str | Path
+        The directory a TelemetryRecorder wrote to.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        # per topic: (first timestamp, last timestamp or None if unknown, path)
+        self.segments: Dict[str, List[Tuple[int, int | None, Path]]] = {}
+
+        for topic_path in sorted(p for p in self.directory.iterdir() if p.is_dir()):
+            indexed: Dict[str, Tuple[int, int]] = {}
+            index = topic_path / INDEX_FILE
+            if index.exists():
+                for line in index.read_text().splitlines():
+                    entry = json.loads(line)
+                    indexed[entry["file"]] = (entry["first"], entry["last"])
+
+            segments = []
+            topic = None
+            for path in topic_path.glob("*.seg"):
+                if topic is None:
+                    topic = Segment(path).topic
+                # segments that were never finished aren't in the index
+                first, last = indexed.get(path.name, (int(path.stem), None))
+                segments.append((first, last, path))
+            if topic is not None:
+                self.segments[topic] = sorted(segments)
+
+    @property
+    def topics(self) -> List[str]:
+        return list(self.segments)
+
+    def _segments(
+        self, topic: str, start: Optional[int], end: Optional[int]
+    ) -> Iterator[Segment]:
+        for first, last, path in self.segments[topic]:
+            # the index lets segments outside the range be skipped unopened
+            if end is not None and first > end:
+                break
+            if start is not None and last is not None and last < start:
+                continue
+            yield Segment(path)
+
+    def _topic_messages(
+        self, topic: str, start: Optional[int], end: Optional[int]
+    ) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+        for segment in self._segments(topic, start, end):
+            yield from segment.messages(start, end)
+
+    def columns(
+        self,
+        topic: str,
+        names: List[str],
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        Read some columns of a topic's records between start and end into one
+        structured array, without unpacking the records one by one.
+
+        :param topic: str
+            The recorded topic.
+        :param names: List[str]
+            Column names, e.g. ["timestamp", "bno_accel.x"].
+        """
+        parts = [
+            segment.between(start, end)[names]
+            for segment in self._segments(topic, start, end)
+        ]
+        if not parts:
+            raise KeyError(topic)
+        return np.concatenate(parts)
+
+    def version(self, topic: str) -> Tuple[Tuple[str, int], ...]:
+        """
+        Something that changes whenever a topic's segments do, for caching.
+        """
+        return tuple(
+            (path.name, path.stat().st_size) for _, _, path in self.segments[topic]
+        )
+
+    def messages(
+        self,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        topics: Optional[Iterable[str]] = None,
+    ) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+        """
+        Yield (timestamp, topic, data) of every recorded message between start
+        and end (milliseconds), across topics in timestamp order.
+        """
+        topics = self.topics if topics is None else topics
+        return heapq.merge(
+            *(self._topic_messages(topic, start, end) for topic in topics),
+            key=lambda message: message[0],
+        )
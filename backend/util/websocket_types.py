@@ -1,18 +1,52 @@
 from typing import *
 
 import logging
+import math
 from abc import ABC
 from ros2_interfaces_pkg import msg
 from geometry_msgs.msg import Vector3
 from std_msgs.msg import String
-import json
 import datetime
 from numbers import Number
+from struct import Struct
+from time import perf_counter_ns
+from util import fast_json
+import hashlib
+import json
 
 LOG = logging.getLogger(__name__)
 
+# sent in place of NaN, which JSON can't represent
+NAN_SENTINEL = -69420.0
+
 T = TypeVar("T", bound=Type["WebsocketData"])
 
+# version of the schema served at /api/schema and of the positional and packed
+# encodings it describes
+SCHEMA_VERSION = 1
+
+# struct codes of field types that can be packed into binary frames
+PACKED_CODES = {float: "d", int: "q", bool: "?"}
+
+# ranges of the ROS2 field types (as named by get_fields_and_field_types)
+# that packed values can fall outside of. ROS2 messages only check these with
+# assert, so they are checked explicitly when building messages from values
+ROS_INT_RANGES = {
+    **{
+        f"int{bits}": (-(1 << (bits - 1)), (1 << (bits - 1)) - 1)
+        for bits in (8, 16, 32)
+    },
+    **{f"uint{bits}": (0, (1 << bits) - 1) for bits in (8, 16, 32, 64)},
+    "octet": (0, 255),
+    "byte": (0, 255),
+    "char": (0, 255),
+}
+FLOAT32_MAX = 3.4028234663852886e38
+
+# packed frames from clients start with the type id and timestamp, frames to
+# clients additionally start with the sequence number
+PACKED_HEADER = Struct("<Hq")
+
 
 class SpecField:
     __slots__ = "field", "ros_property", "field_type"
@@ -36,6 +70,247 @@ class SpecField:
         return {cls(s, s, t) for s, t in spec.items()}
 
 
+def _compile_decoder(
+    fields: Tuple[SpecField, ...],
+) -> Callable[[Dict[str, Any], Optional[str]], Dict[str, Any]]:
+    """
+    Generate a straight-line validating decoder for a spec.
+
+    The decoder takes the input dict and the msg_type (for warnings) and returns
+    the validated data dict. Missing fields raise ValueError, fields of the wrong
+    type raise TypeError, any Number is accepted for a float field and converted,
+    and fields not in the spec are warned about. The input dict is not modified.
+
+    :param fields: Tuple[SpecField, ...]
+        The spec to compile, in the order the fields should be checked.
+    :return: Callable[[Dict[str, Any], Optional[str]], Dict[str, Any]]
+        The decoder.
+    """
+    env: Dict[str, Any] = {
+        "Number": Number,
+        "LOG": LOG,
+        "known": frozenset(entry.field for entry in fields),
+    }
+    lines = ["def decode(data, msg_type):", "    out = {}"]
+
+    for i, entry in enumerate(fields):
+        key = repr(entry.field)
+        env[f"missing{i}"] = f"Field '{entry.field}' missing from input: "
+        env[f"mistyped{i}"] = (
+            f"Field '{entry.field}' is not of type {entry.field_type}: "
+        )
+        env[f"type{i}"] = entry.field_type
+
+        # we can immediately error out of parsing if data is missing
+        lines += [
+            f"    if {key} not in data:",
+            f"        raise ValueError(missing{i} + str(data))",
+            f"    value = data[{key}]",
+        ]
+        if entry.field_type is float:
+            # JSON has no separate int type, so clients may send 1 instead of 1.0
+            lines += [
+                "    if value.__class__ is not float:",
+                "        if not isinstance(value, Number):",
+                f"            raise TypeError(mistyped{i} + str(data))",
+                "        value = float(value)",
+            ]
+        else:
+            lines += [
+                f"    if not isinstance(value, type{i}):",
+                f"        raise TypeError(mistyped{i} + str(data))",
+            ]
+        lines.append(f"    out[{key}] = value")
+
+    # every spec field is present by now, so any extra key means an unknown field
+    lines += [
+        f"    if len(data) > {len(fields)}:",
+        "        for field in data:",
+        "            if field not in known:",
+        "                LOG.warning(",
+        "                    f\"Field '{field}' not in spec for {msg_type if msg_type else 'unknown'}!\"",
+        "                )",
+        "    return out",
+    ]
+
+    exec("\n".join(lines), env)
+    return env["decode"]
+
+
+def _compile_ros_encoder(
+    fields: Tuple[SpecField, ...],
+) -> Callable[[Any], Dict[str, Any]]:
+    """
+    Generate a function that reads a ROS2 message straight into the dict that
+    to_dict would produce for it, in a single pass and without validation.
+
+    NaN floats are replaced with NAN_SENTINEL and nested WebsocketData fields
+    (like Vector3) become nested dicts, just like to_dict.
+
+    :param fields: Tuple[SpecField, ...]
+        The spec to compile.
+    :return: Callable[[Any], Dict[str, Any]]
+        The encoder.
+    """
+    lines = ["def encode(ros_data):"]
+    counter = iter(range(1 << 16))
+
+    def build(fields: Tuple[SpecField, ...], source: str) -> str:
+        items = []
+        for entry in fields:
+            attr = f"{source}.{entry.ros_property}"
+            if issubclass(entry.field_type, WebsocketData):
+                nested = f"nested{next(counter)}"
+                lines.append(f"    {nested} = {attr}")
+                value = build(entry.field_type._fields, nested)
+            elif entry.field_type is float:
+                value = f"value{next(counter)}"
+                lines.append(f"    {value} = {attr}")
+                value = f"{value} if {value} == {value} else NAN_SENTINEL"
+            else:
+                value = attr
+            items.append(f"{entry.field!r}: {value}")
+        return "{" + ", ".join(items) + "}"
+
+    body = build(fields, "ros_data")
+    lines.append(f"    return {body}")
+
+    env: Dict[str, Any] = {"NAN_SENTINEL": NAN_SENTINEL}
+    exec("\n".join(lines), env)
+    return env["encode"]
+
+
+def _flatten(
+    fields: Tuple[SpecField, ...], path: Tuple[str, ...] = ()
+) -> Tuple[Tuple[Tuple[str, ...], type], ...]:
+    """
+    Flatten a spec into (path, type) leaves in order, nested types inline.
+    """
+    out = []
+    for entry in fields:
+        if issubclass(entry.field_type, WebsocketData):
+            out.extend(_flatten(entry.field_type._fields, path + (entry.field,)))
+        else:
+            out.append((path + (entry.field,), entry.field_type))
+    return tuple(out)
+
+
+def _compile_positional(
+    flat: Tuple[Tuple[Tuple[str, ...], type], ...],
+) -> Tuple[
+    Callable[[Dict[str, Any]], List[Any]],
+    Callable[[Any], Dict[str, Any]],
+    Callable[[Dict[str, Any]], List[Any]],
+]:
+    """
+    Generate the functions between to_dict form and positional values, one per
+    flattened field in order.
+
+    :param flat: Tuple[Tuple[Tuple[str, ...], type], ...]
+        The flattened spec.
+    :return: Tuple[Callable, Callable, Callable]
+        to_values(data) -> list, from_values(values) -> dict, which expects
+        exactly len(flat) values, and data_values(data) -> list, which reads
+        a WebsocketData object's data, where nested types are still objects.
+        from_values does not validate types.
+    """
+    getters = ", ".join(
+        "data" + "".join(f"[{key!r}]" for key in path) for path, _ in flat
+    )
+    data_getters = ", ".join(
+        "data" + "".join(f"[{key!r}].data" for key in path[:-1]) + f"[{path[-1]!r}]"
+        for path, _ in flat
+    )
+
+    def build(prefix: Tuple[str, ...]) -> str:
+        items = []
+        done = set()
+        for i, (path, _) in enumerate(flat):
+            if path[: len(prefix)] != prefix:
+                continue
+            key = path[len(prefix)]
+            if len(path) == len(prefix) + 1:
+                items.append(f"{key!r}: values[{i}]")
+            elif key not in done:
+                done.add(key)
+                items.append(f"{key!r}: {build(prefix + (key,))}")
+        return "{" + ", ".join(items) + "}"
+
+    lines = [
+        "def to_values(data):",
+        f"    return [{getters}]",
+        "def from_values(values):",
+        f"    return {build(())}",
+        "def data_values(data):",
+        f"    return [{data_getters}]",
+    ]
+    env: Dict[str, Any] = {}
+    exec("\n".join(lines), env)
+    return env["to_values"], env["from_values"], env["data_values"]
+
+
+def _compile_values_to_ros(
+    ros_type: Any, fields: Tuple[SpecField, ...]
+) -> Callable[[Sequence[Any]], Any]:
+    """
+    Generate a function that builds a ROS2 message straight from positional
+    values in _flatten order, without a dict in between.
+
+    The values must already have their spec types, e.g. from a packed Struct.
+    Values out of range for their ROS2 field raise ValueError. The ranges are
+    checked here rather than left to the ROS2 setters, which only assert them
+    and so don't check at all under python -O.
+
+    :param ros_type: Any
+        The ROS2 message type.
+    :param fields: Tuple[SpecField, ...]
+        The spec to compile.
+    :return: Callable[[Sequence[Any]], Any]
+        The decoder.
+    """
+    env: Dict[str, Any] = {}
+    lines = ["def decode(values):"]
+    counter = iter(range(1 << 16))
+    index = iter(range(1 << 16))
+
+    def check(value: str, ros_field_type: str, name: str):
+        if ros_field_type in ROS_INT_RANGES:
+            low, high = ROS_INT_RANGES[ros_field_type]
+            lines.append(f"    if not {low} <= {value} <= {high}:")
+        elif ros_field_type == "float":
+            # like ROS2, infinities and NaN are fine but finite values must fit
+            lines.append(f"    if {FLOAT32_MAX!r} < abs({value}) < INF:")
+        else:
+            return
+        lines.append(f"        raise ValueError('{name} out of range: %r' % {value})")
+
+    def build(ros_type: Any, fields: Tuple[SpecField, ...]) -> str:
+        target = f"ros{next(counter)}"
+        env[f"{target}_type"] = ros_type
+        # generated ROS2 messages describe their fields, stand-ins may not
+        describe = getattr(ros_type, "get_fields_and_field_types", None)
+        ros_field_types = describe() if describe is not None else {}
+        lines.append(f"    {target} = {target}_type()")
+        for entry in fields:
+            if issubclass(entry.field_type, WebsocketData):
+                value = build(entry.field_type.ros_type, entry.field_type._fields)
+            else:
+                value = f"values[{next(index)}]"
+                check(
+                    value,
+                    ros_field_types.get(entry.ros_property, ""),
+                    entry.ros_property,
+                )
+            lines.append(f"    {target}.{entry.ros_property} = {value}")
+        return target
+
+    env["INF"] = math.inf
+
+    lines.append(f"    return {build(ros_type, fields)}")
+    exec("\n".join(lines), env)
+    return env["decode"]
+
+
 class WebsocketData(ABC, Generic[T]):
     """
     Abstract class for websocket data types.
@@ -44,15 +319,67 @@ class WebsocketData(ABC, Generic[T]):
     msg_type: Optional[str]
     msg_timestamp: int
 
+    # if set, any type string starting with msg_type is parsed by this class
+    prefix_match: bool = False
+
     ros_type: T
     spec: Set[SpecField]
     data: Dict[str, Any] = {}
 
+    # compiled from spec when the subclass is created, see _compile_decoder
+    _fields: Tuple[SpecField, ...] = ()
+    _nested: Tuple[Tuple[str, Type["WebsocketData"]], ...] = ()
+    _decode: Callable[[Dict[str, Any], Optional[str]], Dict[str, Any]]
+    _ros_to_dict: Callable[[Any], Dict[str, Any]]
+    # flattened spec for the positional encodings, see schema
+    _flat: Tuple[Tuple[Tuple[str, ...], type], ...] = ()
+    _to_values: Callable[[Dict[str, Any]], List[Any]]
+    _from_values: Callable[[Any], Dict[str, Any]]
+    _data_values: Callable[[Dict[str, Any]], List[Any]]
+    # None unless every field is a number or bool
+    _packed: Optional[Struct] = None
+    # builds the ROS2 message from packed values, for types that have both
+    _values_to_ros: Optional[Callable[[Sequence[Any]], Any]] = None
+    # the ROS2 message, if it was decoded before the data, see from_packed
+    _ros: Optional[T] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "spec" not in cls.__dict__:
+            return
+
+        # sorted so that every process agrees on the field order
+        cls._fields = tuple(sorted(cls.spec, key=lambda entry: entry.field))
+        cls._nested = tuple(
+            (entry.field, entry.field_type)
+            for entry in cls._fields
+            if issubclass(entry.field_type, WebsocketData)
+        )
+        cls._decode = staticmethod(_compile_decoder(cls._fields))
+        cls._ros_to_dict = staticmethod(_compile_ros_encoder(cls._fields))
+
+        cls._flat = _flatten(cls._fields)
+        to_values, from_values, data_values = _compile_positional(cls._flat)
+        cls._to_values = staticmethod(to_values)
+        cls._from_values = staticmethod(from_values)
+        cls._data_values = staticmethod(data_values)
+        if cls._flat and all(t in PACKED_CODES for _, t in cls._flat):
+            cls._packed = Struct("<" + "".join(PACKED_CODES[t] for _, t in cls._flat))
+        else:
+            cls._packed = None
+        cls._values_to_ros = None
+        if cls._packed is not None and getattr(cls, "ros_type", None) is not None:
+            cls._values_to_ros = staticmethod(
+                _compile_values_to_ros(cls.ros_type, cls._fields)
+            )
+
     @classmethod
     def check_type(cls, to_check: str) -> bool:
         """
         Check if the type of the data is correct.
         """
+        if cls.prefix_match:
+            return to_check.startswith(cls.msg_type)
         return to_check == cls.msg_type
 
     def __init__(
@@ -73,32 +400,8 @@ class WebsocketData(ABC, Generic[T]):
             self.msg_timestamp = int(datetime.datetime.now().timestamp() * 1000)
 
         # ensure all fields are present and of the correct type
-        for entry in self.spec:
-            # check presence
-            # we can immediately error out of parsing if data is missing
-            if entry.field not in data:
-                raise ValueError(f"Field '{entry.field}' missing from input: {data}")
-
-            # TODO: remove this stupid hack
-            if isinstance(data[entry.field], Number) and entry.field_type == float:
-                data[entry.field] = float(data[entry.field])
-
-            # check that the type matches the spec
-            # this is because the data is technically untrusted, as it comes from the client
-            if not isinstance(data[entry.field], entry.field_type):
-                raise TypeError(
-                    f"Field '{entry.field}' is not of type {entry.field_type}: {data}"
-                )
-
-            # if it passed all of the checks, we can add it to the data dictionary
-            self.data[entry.field] = data[entry.field]
-
-        # warn for any extra fields
-        for field in data.keys():
-            if field not in [spec.field for spec in self.spec]:
-                LOG.warning(
-                    f"Field '{field}' not in spec for {self.msg_type if self.msg_type else 'unknown'}!"
-                )
+        # this is because the data is technically untrusted, as it comes from the client
+        self.data = self._decode(data, self.msg_type)
 
     @classmethod
     def from_dict(
@@ -112,18 +415,15 @@ class WebsocketData(ABC, Generic[T]):
         Convert a Dict into a WebsocketType object.
         """
 
-        # shallow copy is fine because we're going to be parsing nested dictionaries
-        out_data = dict_data.copy()
-
         # convert nested dicts to WebsocketData (if the spec calls for it)
-        for entry in cls.spec:
-            if issubclass(entry.field_type, WebsocketData):
-                out_data[entry.field] = entry.field_type.from_dict(
-                    out_data[entry.field]
-                )
+        # shallow copy is fine because we're going to be parsing nested dictionaries
+        if cls._nested:
+            dict_data = dict_data.copy()
+            for field, field_type in cls._nested:
+                dict_data[field] = field_type.from_dict(dict_data[field])
 
         # initializing here does spec checking for us
-        return cls(out_data, msg_type=msg_type, msg_timestamp=msg_timestamp)
+        return cls(dict_data, msg_type=msg_type, msg_timestamp=msg_timestamp)
 
     def to_dict(self) -> Dict[str, Any]:
         """
@@ -141,7 +441,7 @@ class WebsocketData(ABC, Generic[T]):
             if isinstance(self.data[entry.field], float) and (
                 self.data[entry.field] != self.data[entry.field]
             ):
-                out[entry.field] = -69420.0
+                out[entry.field] = NAN_SENTINEL
             else:
                 # otherwise we can just copy it over. this effectively deep copies
                 out[entry.field] = self.data[entry.field]
@@ -152,7 +452,7 @@ class WebsocketData(ABC, Generic[T]):
         """
         Convert the data to a JSON string.
         """
-        return json.dumps(
+        return fast_json.dumps(
             {
                 "type": self.msg_type,
                 "timestamp": self.msg_timestamp,
@@ -160,6 +460,162 @@ class WebsocketData(ABC, Generic[T]):
             }
         )
 
+    @classmethod
+    def ros_to_dict(cls, ros_data: T) -> Dict[str, Any]:
+        """
+        Read a ROS2 message straight into the dict to_dict would give for it,
+        skipping the WebsocketData object and its validation entirely.
+
+        Only use this for trusted data, i.e. messages that came from ROS.
+        """
+        return cls._ros_to_dict(ros_data)
+
+    @classmethod
+    def encode_dict(
+        cls,
+        data: Dict[str, Any],
+        msg_timestamp: Optional[int] = None,
+        msg_type: Optional[str] = None,
+    ) -> str:
+        """
+        Encode a dict in to_dict form as the JSON string to_json would give.
+        msg_type overrides the type's, e.g. for prefix types.
+        """
+        if not msg_timestamp:
+            msg_timestamp = int(datetime.datetime.now().timestamp() * 1000)
+
+        return fast_json.dumps(
+            {
+                "type": msg_type or cls.msg_type,
+                "timestamp": msg_timestamp,
+                "data": data,
+            }
+        )
+
+    @classmethod
+    def schema(cls) -> Dict[str, Any]:
+        """
+        Describe the type for clients: its fields, flattened (nested fields
+        like "bno_accel.x") in the stable order the positional encodings use,
+        and the struct format of its packed encoding if it has one.
+        """
+        fields = [
+            {"name": ".".join(path), "type": field_type.__name__}
+            for path, field_type in cls._flat
+        ]
+        described = {
+            "type": cls.msg_type,
+            "name": cls.__name__,
+            "prefix": cls.prefix_match,
+            "fields": fields,
+            "packed": cls._packed.format if cls._packed is not None else None,
+        }
+        canonical = json.dumps(described, sort_keys=True).encode()
+        described["hash"] = hashlib.sha256(canonical).hexdigest()[:16]
+        return described
+
+    @classmethod
+    def to_values(cls, data: Dict[str, Any]) -> List[Any]:
+        """
+        Get the positional values of data in to_dict form, in schema order.
+        """
+        return cls._to_values(data)
+
+    def values(self) -> List[Any]:
+        """
+        Get the positional values of this message, in schema order, straight
+        from its data. Unlike to_values(to_dict()), NaN is left as is.
+        """
+        return self._data_values(self.data)
+
+    @classmethod
+    def from_values(
+        cls,
+        values: Sequence[Any],
+        *,
+        msg_type: Optional[str] = None,
+        msg_timestamp: Optional[int] = None,
+    ) -> "WebsocketData":
+        """
+        Convert positional values in schema order into a WebsocketData object,
+        validated just like from_dict.
+        """
+        if len(values) != len(cls._flat):
+            raise ValueError(
+                f"{cls.__name__} takes {len(cls._flat)} values, got {len(values)}"
+            )
+        return cls.from_dict(
+            cls._from_values(values), msg_type=msg_type, msg_timestamp=msg_timestamp
+        )
+
+    @classmethod
+    def from_packed(
+        cls,
+        values: Sequence[Any],
+        *,
+        msg_type: Optional[str] = None,
+        msg_timestamp: Optional[int] = None,
+    ) -> "WebsocketData":
+        """
+        Convert values unpacked with the type's packed Struct into a
+        WebsocketData object, building its ROS2 message right away.
+
+        The Struct already guarantees every field is present and of its spec
+        type, so the dict validation from_dict does is skipped, and to_ros
+        returns the message built here instead of converting the data again.
+        Types without a ROS2 message fall back to from_values.
+
+        :raises ValueError: If a value is out of range for its ROS2 field.
+        """
+        if cls._values_to_ros is None:
+            return cls.from_values(
+                values, msg_type=msg_type, msg_timestamp=msg_timestamp
+            )
+        try:
+            ros_data = cls._values_to_ros(values)
+        except ValueError as e:
+            raise ValueError(f"{cls.__name__} {e}") from e
+        except AssertionError as e:
+            # whatever else the ROS2 setters check, when asserts are on
+            raise ValueError(f"{cls.__name__} value rejected: {e}") from e
+
+        data = cls._from_values(values)
+        for field, field_type in cls._nested:
+            data[field] = field_type._trusted(data[field])
+        out = cls._trusted(data, msg_type=msg_type, msg_timestamp=msg_timestamp)
+        out._ros = ros_data
+        return out
+
+    @classmethod
+    def _trusted(
+        cls,
+        data: Dict[str, Any],
+        *,
+        msg_type: Optional[str] = None,
+        msg_timestamp: Optional[int] = None,
+    ) -> "WebsocketData":
+        """
+        Wrap data that is already known to match the spec, without validating.
+        """
+        out = cls.__new__(cls)
+        if msg_type:
+            out.msg_type = msg_type
+        out.msg_timestamp = msg_timestamp or int(
+            datetime.datetime.now().timestamp() * 1000
+        )
+        out.data = data
+        return out
+
+    @classmethod
+    def encode_ros(cls, ros_data: T, msg_timestamp: Optional[int] = None) -> str:
+        """
+        Encode a ROS2 message straight to the JSON string to_json would give for
+        it, skipping the WebsocketData object and its validation entirely.
+
+        Only use this for trusted data, i.e. messages that came from ROS.
+        """
+        return cls.encode_dict(cls._ros_to_dict(ros_data), msg_timestamp)
+
     @classmethod
     def from_ros(cls, ros_data: T) -> "WebsocketData":
         """
@@ -183,6 +639,9 @@ class WebsocketData(ABC, Generic[T]):
         """
         Convert the data to a ROS2 message.
         """
+        if self._ros is not None:
+            return self._ros
+
         # instantiate the ROS2 message type
         ros_data = self.ros_type()
 
@@ -265,11 +724,8 @@ class ControllerStateData(WebsocketData):
     Controller data type.
     """
 
-    @classmethod
-    def check_type(cls, to_check):
-        return to_check.startswith(cls.msg_type)
-
     msg_type = "/basestation/controller"
+    prefix_match = True
     ros_type = msg.ControllerState
     spec = SpecField.build_spec_dict(
         {
@@ -536,6 +992,60 @@ class AntennaFeedbackData(WebsocketData):
     )
 
 
+class SubscribeData(WebsocketData):
+    """
+    Subscribe the sending client to topics, given as glob patterns like "/arm/*".
+    """
+
+    msg_type = "/basestation/subscribe"
+    ros_type = None
+    spec = SpecField.build_spec_dict({"topics": list})
+
+
+class UnsubscribeData(WebsocketData):
+    """
+    Unsubscribe the sending client from previously subscribed topic patterns.
+    """
+
+    msg_type = "/basestation/unsubscribe"
+    ros_type = None
+    spec = SpecField.build_spec_dict({"topics": list})
+
+
+class RateLimitData(WebsocketData):
+    """
+    Limit how often the sending client receives topics matching a glob pattern.
+    A rate of 0 removes the limit.
+    """
+
+    msg_type = "/basestation/rate"
+    ros_type = None
+    spec = SpecField.build_spec_dict({"topic": str, "rate": float})
+
+
+class ResumeData(WebsocketData):
+    """
+    Sent by the backend as the first message on every websocket connection.
+    It gives the session and sequence number the stream starts at, and
+    whether a resume requested with ?session=...&seq=... succeeded. If it
+    didn't, a snapshot of every topic follows instead of the missed frames.
+    It also gives the encoding the client will get and the schema hash.
+    """
+
+    msg_type = "/basestation/resume"
+    ros_type = None
+    spec = SpecField.build_spec_dict(
+        {
+            "session": str,
+            "seq": int,
+            "resumed": bool,
+            "missed": int,
+            "encoding": str,
+            "schema": str,
+        }
+    )
+
+
 types: Set[WebsocketData] = {
     ArmIKData,
     ArmManualData,
@@ -551,4 +1061,224 @@ types: Set[WebsocketData] = {
     PtzControlData,
     AntennaResetData,
     AntennaFeedbackData,
+    SubscribeData,
+    UnsubscribeData,
+    RateLimitData,
+    ResumeData,
 }
+
+
+class TypeRegistry:
+    """
+    Maps message type strings to the WebsocketData class that parses them.
+
+    Exact types are found with a single dict lookup. Prefix types (like
+    ControllerStateData) are indexed by the length of their prefix, so a lookup
+    costs one dict probe per distinct prefix length no matter how many types are
+    registered.
+
+    Every type also gets a numeric id for the positional and packed
+    encodings, see schema.
+
+    :param to_register: Iterable[Type[WebsocketData]]
+        Types to register right away. They are given ids in msg_type order.
+    """
+
+    def __init__(self, to_register: Iterable[Type[WebsocketData]] = ()):
+        self._ids: Dict[Type[WebsocketData], int] = {}
+        self._by_id: List[Type[WebsocketData]] = []
+        self._schema: Optional[Dict[str, Any]] = None
+        self._exact: Dict[str, Type[WebsocketData]] = {}
+        self._prefixes: Dict[int, Dict[str, Type[WebsocketData]]] = {}
+        # longest prefix first so the most specific type wins
+        self._prefix_lengths: Tuple[int, ...] = ()
+
+        # dispatch cost counters
+        self.lookups = 0
+        self.exact_hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+        self.lookup_ns = 0
+
+        for t in sorted(to_register, key=lambda t: t.msg_type):
+            self.register(t)
+
+    def register(self, t: Type[WebsocketData]):
+        """
+        Register a type with the registry.
+
+        :param t: Type[WebsocketData]
+            The type to register. Its msg_type must not already be registered.
+        """
+        if not t.msg_type:
+            raise ValueError(f"{t.__name__} has no msg_type to register")
+
+        if t.prefix_match:
+            table = self._prefixes.setdefault(len(t.msg_type), {})
+        else:
+            table = self._exact
+
+        if table.get(t.msg_type, t) is not t:
+            raise ValueError(
+                f"msg_type '{t.msg_type}' is already registered to {table[t.msg_type].__name__}"
+            )
+        table[t.msg_type] = t
+        self._prefix_lengths = tuple(sorted(self._prefixes, reverse=True))
+        if t not in self._ids:
+            self._ids[t] = len(self._by_id)
+            self._by_id.append(t)
+            self._schema = None
+
+    def lookup(self, msg_type: str) -> Optional[Type[WebsocketData]]:
+        """
+        Find the type that parses the given type string.
+
+        :param msg_type: str
+            The type string from the websocket message.
+        :return: Optional[Type[WebsocketData]]
+            The matching type, or None if nothing matches.
+        """
+        start = perf_counter_ns()
+        self.lookups += 1
+
+        found = self._exact.get(msg_type)
+        if found is not None:
+            self.exact_hits += 1
+        else:
+            for length in self._prefix_lengths:
+                found = self._prefixes[length].get(msg_type[:length])
+                if found is not None:
+                    self.prefix_hits += 1
+                    break
+            else:
+                self.misses += 1
+
+        self.lookup_ns += perf_counter_ns() - start
+        return found
+
+    def __len__(self) -> int:
+        return len(self._exact) + sum(len(p) for p in self._prefixes.values())
+
+    def type_id(self, t: Type[WebsocketData]) -> int:
+        return self._ids[t]
+
+    def by_id(self, type_id: int) -> Optional[Type[WebsocketData]]:
+        if 0 <= type_id < len(self._by_id):
+            return self._by_id[type_id]
+        return None
+
+    def schema(self) -> Dict[str, Any]:
+        """
+        Describe every registered type and its id, with a hash that changes
+        whenever any of them does. Clients using the positional or packed
+        encodings should check the hash when they connect.
+        """
+        if self._schema is None:
+            described = [
+                {"id": type_id, **t.schema()} for type_id, t in enumerate(self._by_id)
+            ]
+            digest = hashlib.sha256()
+            for entry in described:
+                digest.update(f"{entry['id']}:{entry['hash']};".encode())
+            self._schema = {
+                "version": SCHEMA_VERSION,
+                "hash": digest.hexdigest()[:16],
+                "types": described,
+            }
+        return self._schema
+
+    def encode_array(
+        self, t: Type[WebsocketData], data: Dict[str, Any], msg_timestamp: int
+    ) -> str:
+        """
+        Encode data in to_dict form as a positional frame:
+        [type id, timestamp, values...].
+        """
+        return fast_json.dumps([self._ids[t], msg_timestamp, *t._to_values(data)])
+
+    def encode_packed(
+        self,
+        t: Type[WebsocketData],
+        data: Dict[str, Any],
+        msg_timestamp: int,
+        msg_type: Optional[str] = None,
+    ) -> Optional[bytes]:
+        """
+        Encode data in to_dict form as a packed frame: PACKED_HEADER (type id,
+        timestamp) then the values in the type's packed format. Prefix types
+        are followed by the rest of their msg_type in UTF-8, e.g. "1" for
+        "/basestation/controller1". None if the type can't be packed.
+        """
+        if t._packed is None:
+            return None
+        packed = PACKED_HEADER.pack(self._ids[t], msg_timestamp) + t._packed.pack(
+            *t._to_values(data)
+        )
+        if t.prefix_match and msg_type is not None:
+            packed += msg_type[len(t.msg_type) :].encode()
+        return packed
+
+    def decode_array(self, frame: List[Any]) -> WebsocketData:
+        """
+        Decode a positional frame from a client. The type may be given by id,
+        or by msg_type string for prefix types like ControllerStateData.
+
+        :raises ValueError, TypeError: If the frame or its values are invalid.
+        """
+        if not isinstance(frame, list) or len(frame) < 2:
+            raise ValueError(f"positional frame too short: {frame}")
+        type_ref, msg_timestamp = frame[0], frame[1]
+        if isinstance(type_ref, str):
+            t = self.lookup(type_ref)
+            msg_type = type_ref
+        elif isinstance(type_ref, int):
+            t = self.by_id(type_ref)
+            msg_type = None
+        else:
+            raise TypeError(f"positional frame type must be an id or string")
+        if t is None:
+            raise ValueError(f"unknown type {type_ref}")
+        if not isinstance(msg_timestamp, int):
+            raise TypeError(f"positional frame timestamp must be an int")
+        return t.from_values(frame[2:], msg_type=msg_type, msg_timestamp=msg_timestamp)
+
+    def decode_packed(self, frame: bytes) -> WebsocketData:
+        """
+        Decode a packed frame from a client, building the ROS2 message of
+        types that have one right away, see WebsocketData.from_packed.
+
+        :raises ValueError: If the frame is invalid.
+        """
+        if len(frame) < PACKED_HEADER.size:
+            raise ValueError(f"packed frame too short")
+        type_id, msg_timestamp = PACKED_HEADER.unpack_from(frame)
+        t = self.by_id(type_id)
+        if t is None or t._packed is None:
+            raise ValueError(f"type id {type_id} can't be packed")
+        end = PACKED_HEADER.size + t._packed.size
+        if len(frame) < end or (len(frame) > end and not t.prefix_match):
+            raise ValueError(f"packed {t.__name__} frame has the wrong size")
+        msg_type = None
+        if t.prefix_match:
+            msg_type = t.msg_type + bytes(frame[end:]).decode()
+        values = t._packed.unpack_from(frame, PACKED_HEADER.size)
+        return t.from_packed(values, msg_type=msg_type, msg_timestamp=msg_timestamp)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Report how much dispatching has cost so far.
+
+        :return: Dict[str, Union[int, float]]
+            Lookup counts by outcome and the mean lookup time in nanoseconds.
+        """
+        return {
+            "types": len(self),
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "prefix_hits": self.prefix_hits,
+            "misses": self.misses,
+            "mean_ns": self.lookup_ns / self.lookups if self.lookups else 0.0,
+        }
+
+
+registry = TypeRegistry(types)